@@ -1,28 +1,45 @@
-from fastapi import APIRouter, BackgroundTasks, Query
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional
 from datetime import datetime
+import json
 from services.monitoring_service import MonitoringService
-from models.monitoring_model import ONTData, MonitoringConfig
+from services.swh_service import SWHService
+from services.scheduler import collection_scheduler
+from services.monitoring_ingest import MonitoringIngestService, ingest_stats
+from config import MONITORING_STREAM_MAX_POINTS
+from models.monitoring_model import MonitoringConfig
 
 router = APIRouter()
 
 @router.post("/collect-data")
 async def start_data_collection(background_tasks: BackgroundTasks):
-    background_tasks.add_task(MonitoringService.collect_and_store_ont_data)
+    background_tasks.add_task(SWHService.collect_and_store_ont_data_async)
     return {"message": "ONT data collection started in the background"}
 
 @router.post("/store-data")
-async def store_monitoring_data(data: List[ONTData]):
-    MonitoringService.create_monitoring_data(data)
-    return {"message": "ONT monitoring data stored successfully"}
+async def store_monitoring_data(request: Request):
+    # El cuerpo (array JSON de ONTData) se valida e inserta por lotes a medida que llega
+    result = await MonitoringIngestService.ingest_stream(request.stream())
+    if 'parse_error' in result:
+        if not result['inserted']:
+            raise HTTPException(status_code=400, detail=result)
+        # Los lotes anteriores al error ya están guardados: reenviar el cuerpo entero los duplicaría,
+        # así que se responde con lo insertado y el índice del primer elemento que no se ha leído
+        return JSONResponse(status_code=207, content={"message": "ONT monitoring data partially stored", **result})
+    return {"message": "ONT monitoring data stored successfully", **result}
+
+@router.get("/ingest-stats")
+async def get_ingest_stats():
+    return ingest_stats.snapshot()
 
 @router.delete("/delete")
-def delete_monitoring_data(
+async def delete_monitoring_data(
     building: str = Query(None),
     floor: str = Query(None),
     serial: str = Query(None)
 ):
-    result = MonitoringService.delete_monitoring_data(building, floor, serial)
+    result = await MonitoringService.delete_monitoring_data_async(building, floor, serial)
     return {
         "message": f"Datos eliminados correctamente. {result['deleted_count']} documentos borrados.",
         "onts_affected": result['onts_affected']
@@ -37,7 +54,7 @@ async def get_time_series_data(
     end_date: Optional[datetime] = None,
     interval: str = 'hour'
 ):
-    data = MonitoringService.get_time_series_data(
+    data = await MonitoringService.get_time_series_data_async(
         serial=serial,
         floor=floor,
         building=building,
@@ -47,13 +64,64 @@ async def get_time_series_data(
     )
     return data
 
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+@router.get("/time-series/stream")
+async def stream_time_series_data(
+    serial: Optional[str] = None,
+    floor: Optional[str] = None,
+    building: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    interval: str = 'hour',
+    after: Optional[datetime] = None,
+    limit: int = Query(MONITORING_STREAM_MAX_POINTS, ge=1, le=MONITORING_STREAM_MAX_POINTS),
+    response_format: str = Query("ndjson", alias="format")
+):
+    # Mismos puntos que /time-series/, escritos según se leen del cursor y paginados por clave:
+    # si quedan más de limit puntos, la respuesta termina con next_after, que se pasa como after
+    # en la siguiente petición. En ndjson es una última línea {"next_after": ...}; en json, un
+    # campo junto a "points".
+    if response_format not in ("ndjson", "json"):
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{response_format}'")
+
+    async def body():
+        points = MonitoringService.stream_time_series(serial, floor, building, start_date, end_date, interval, after, limit + 1)
+        count = 0
+        last_bucket = None
+        more = False
+        if response_format == "json":
+            yield '{"points":['
+        async for bucket, point in points:
+            if count == limit:
+                more = True
+                break
+            line = json.dumps(point, default=json_default)
+            if response_format == "json":
+                yield line if count == 0 else "," + line
+            else:
+                yield line + "\n"
+            count += 1
+            last_bucket = bucket
+        next_after = last_bucket.isoformat() if more else None
+        if response_format == "json":
+            yield f'],"next_after":{json.dumps(next_after)}}}'
+        elif more:
+            yield json.dumps({"next_after": next_after}) + "\n"
+
+    media_type = "application/x-ndjson" if response_format == "ndjson" else "application/json"
+    return StreamingResponse(body(), media_type=media_type)
+
 @router.get("/latest-values")
 async def get_latest_values(
     serial: Optional[str] = None,
     floor: Optional[str] = None,
     building: Optional[str] = None
 ):
-    data = MonitoringService.get_latest_values(
+    data = await MonitoringService.get_latest_values_async(
         serial=serial,
         floor=floor,
         building=building
@@ -62,11 +130,16 @@ async def get_latest_values(
 
 @router.get("/config")
 async def get_monitoring_config():
-    config = MonitoringService.get_monitoring_config()
+    config = await MonitoringService.get_monitoring_config_async()
     return config
 
 @router.put("/config")
 async def update_monitoring_config(config: MonitoringConfig):
-    MonitoringService.update_monitoring_config(config)
+    await MonitoringService.update_monitoring_config_async(config)
+    collection_scheduler.reload()
     return {"message": "Monitoring configuration updated successfully"}
 
+@router.get("/scheduler")
+async def get_scheduler_metrics():
+    return collection_scheduler.metrics()
+
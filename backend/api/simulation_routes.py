@@ -1,19 +1,56 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from services.simulation_service import SimulationService
 from services.manager_service import ManagerService
+from services.simulation_jobs import simulation_jobs
+from services.simulation_store import SimulationStore
+from models.simulation_model import Simulation
 
 router = APIRouter()
 simulation_service = SimulationService()
 manager_service = ManagerService()
 
+RESPONSE_FORMATS = ("records", "columnar", "binary")
+
 class SimulationRequest(BaseModel):
     building_name: str
     floor_name: str
 
+def resolve_response_format(response_format: Optional[str], accept: Optional[str]) -> str:
+    if response_format:
+        if response_format not in RESPONSE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format '{response_format}'")
+        return response_format
+    if accept and "application/octet-stream" in accept:
+        return "binary"
+    return "records"
+
+def heatmap_binary_response(x_values, y_values, values, resolution):
+    # Valores float32 en bruto; la geometría de la rejilla va en las cabeceras
+    layout = simulation_service.heatmap_layout(x_values, y_values, resolution)
+    return Response(
+        content=simulation_service.heatmap_to_bytes(values),
+        media_type="application/octet-stream",
+        headers={
+            "X-Heatmap-Origin": ",".join(str(v) for v in layout['origin']),
+            "X-Heatmap-Step": ",".join(str(v) for v in layout['step']),
+            "X-Heatmap-Shape": ",".join(str(v) for v in layout['shape']),
+            "X-Heatmap-Dtype": "float32-le",
+        }
+    )
+
+# def y no async def: FastAPI la ejecuta en su pool de hilos, así que ni la lectura del piso
+# ni el cálculo del mapa bloquean el bucle de eventos (ni a los clientes de Socket.IO)
 @router.post("/run-simulation")
-async def run_simulation(request: SimulationRequest):
+def run_simulation(
+    request: SimulationRequest,
+    http_request: Request,
+    response_format: Optional[str] = Query(None, alias="format")
+):
+    response_format = resolve_response_format(response_format, http_request.headers.get("accept"))
     try:
         # Obtener datos del piso usando ManagerService
         floor_data = manager_service.get_floor_by_name(request.building_name, request.floor_name)
@@ -25,16 +62,78 @@ async def run_simulation(request: SimulationRequest):
         onts = floor_data.onts if floor_data.onts else []
         scale = floor_data.scale if floor_data.scale else 1.0
 
-        print("GeoJSON data:", geojson_data)
-        print("ONTs:", onts)
-        print("Scale:", scale)
+        if response_format == "binary":
+            resolution = simulation_service.HEATMAP_RESOLUTION
+            x_values, y_values, values = simulation_service.cached_heatmap_grid(request.building_name, request.floor_name, geojson_data, onts, scale)
+            return heatmap_binary_response(x_values, y_values, values, resolution)
 
         # Ejecutar la simulación
-        simulation_result = simulation_service.run_simulation(geojson_data, onts, scale)
+        simulation_result = simulation_service.run_simulation(geojson_data, onts, scale, response_format, request.building_name, request.floor_name)
 
         return {
             "message": "Simulation completed successfully",
             "result": simulation_result
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs", response_model=List[Simulation])
+async def list_simulation_jobs():
+    return simulation_jobs.list_jobs()
+
+@router.get("/jobs/{simulation_id}", response_model=Simulation)
+async def get_simulation_job(simulation_id: str):
+    simulation = simulation_jobs.get(simulation_id) or await run_in_threadpool(SimulationStore.get, simulation_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    return simulation
+
+@router.delete("/jobs/{simulation_id}")
+async def cancel_simulation_job(simulation_id: str):
+    if not simulation_jobs.cancel(simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not found or already finished")
+    return {"message": "Simulation cancelled"}
+
+@router.get("/simulations", response_model=List[Simulation])
+def list_simulations(building_name: str, floor_name: str, limit: int = Query(20, ge=1, le=200)):
+    return SimulationStore.list_by_floor(building_name, floor_name, limit)
+
+@router.get("/simulations/{simulation_id}", response_model=Simulation)
+def get_simulation(simulation_id: str):
+    simulation = SimulationStore.get(simulation_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    return simulation
+
+@router.get("/simulations/{simulation_id}/grid")
+def get_simulation_grid(
+    simulation_id: str,
+    http_request: Request,
+    row_start: Optional[int] = Query(None, ge=0),
+    row_stop: Optional[int] = Query(None, ge=0),
+    col_start: Optional[int] = Query(None, ge=0),
+    col_stop: Optional[int] = Query(None, ge=0),
+    response_format: Optional[str] = Query(None, alias="format")
+):
+    # Rectángulo [row_start:row_stop, col_start:col_stop] de una rejilla guardada (por defecto, entera)
+    response_format = resolve_response_format(response_format, http_request.headers.get("accept"))
+    simulation = SimulationStore.get(simulation_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    grid = SimulationStore.read_grid(simulation, slice(row_start, row_stop), slice(col_start, col_stop))
+    if grid is None:
+        raise HTTPException(status_code=404, detail="Simulation has no stored grid")
+
+    x_values, y_values, values = grid
+    resolution = simulation.grid.step[0]
+    if response_format == "binary":
+        return heatmap_binary_response(x_values, y_values, values, resolution)
+    if response_format == "columnar":
+        return simulation_service.heatmap_to_columnar(x_values, y_values, values, resolution)
+    return simulation_service.heatmap_to_records(x_values, y_values, values)
+
+@router.delete("/simulations/{simulation_id}")
+def delete_simulation(simulation_id: str):
+    if not SimulationStore.delete(simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    return {"message": "Simulation deleted successfully"}
@@ -1,6 +1,42 @@
 FRONTEND_URL = "http://localhost:3000"
 MONGO_URI = "mongodb://mongo:27017"
+MONGO_MAX_POOL_SIZE = 100  # Conexiones máximas por cliente de Mongo (síncrono y asíncrono)
+MONGO_MIN_POOL_SIZE = 10  # Conexiones que se mantienen abiertas aunque no haya carga
 SWH_API_URL = "http://example.com/swh-api"
 SWH_API_USERNAME = "username"
 SWH_API_PASSWORD = "password"
-DATA_COLLECTION_INTERVAL = 300  # Intervalo de recopilación de datos en segundos
\ No newline at end of file
+DATA_COLLECTION_INTERVAL = 300  # Intervalo de recopilación de datos en segundos
+SIMULATION_MEMORY_BUDGET_MB = 64  # Memoria máxima por bloque de la matriz puntos×ONTs del mapa de calor
+SIMULATION_WORKERS = 1  # Procesos para calcular los mapas por teselas (1 = en el proceso actual)
+SIMULATION_TILE_SIZE = 128  # Lado de cada tesela en celdas de la rejilla
+SIMULATION_CACHE_ENTRIES = 32  # Resultados de simulación guardados en memoria (LRU)
+SIMULATION_CACHE_DIR = "simulation_cache"  # Directorio del nivel en disco de la caché de simulaciones
+SIMULATION_CACHE_MAX_DISK_MB = 512  # Tamaño máximo en disco antes de expulsar los resultados menos usados
+SIMULATION_COVERAGE_MAX_MB = 256  # Memoria máxima de las capas de cobertura por ONT guardadas (LRU por piso)
+SIMULATION_STREAM_COARSE_POINTS = 4096  # Puntos de la primera etapa (baja resolución) de la simulación progresiva
+SIMULATION_MAX_JOBS = 2  # Simulaciones ejecutándose a la vez en el servidor; el resto espera en cola
+SIMULATION_JOB_WORKERS = 2  # Procesos del pool en el que se calculan las simulaciones
+SIMULATION_JOB_HISTORY = 100  # Trabajos terminados que se conservan para consultar su estado
+MONITORING_INGEST_BATCH_SIZE = 1000  # Documentos por insert_many (no ordenado) al almacenar datos de monitoreo
+MONITORING_INGEST_MAX_ERRORS = 100  # Errores por documento incluidos como máximo en la respuesta
+SWH_POLL_CONCURRENCY = 100  # Peticiones simultáneas como máximo al SWH durante una recogida
+SWH_REQUEST_TIMEOUT = 10  # Tiempo máximo por petición al SWH en segundos
+SWH_MAX_RETRIES = 3  # Reintentos por ONT ante errores de red, timeouts o respuestas 5xx
+SWH_RETRY_BASE_DELAY = 0.5  # Espera base (s) del backoff exponencial con jitter entre reintentos
+SWH_POLL_BATCH_SIZE = 500  # Lecturas de ONT que se entregan juntas al escritor de monitoreo
+SCHEDULER_CONFIG_RELOAD = 10  # Segundos entre relecturas de MonitoringConfig (enabled, interval) por el planificador
+SCHEDULER_OVERLAP_POLICY = "skip"  # "skip" descarta el tick si la recogida anterior sigue en marcha; "coalesce" la repite al terminar
+SCHEDULER_HISTORY = 50  # Duraciones de las últimas recogidas guardadas en las métricas del planificador
+MONGO_EXPLAIN_ON_STARTUP = True  # Registrar al arrancar el plan de ejecución de las consultas más frecuentes
+MONITORING_STORAGE_MODE = "regular"  # "regular" (colección normal) o "timeseries" (colección time-series de MongoDB)
+MONITORING_TIMESERIES_COLLECTION = "monitoring_timeseries"  # Colección de las lecturas en modo "timeseries"
+MONITORING_TIMESERIES_GRANULARITY = "minutes"  # Granularidad de los buckets time-series (seconds, minutes, hours)
+MONITORING_ROLLUPS_ENABLED = True  # Mantener buckets de minuto/hora/día al almacenar datos y leer de ellos las series temporales
+MONITORING_ROLLUPS_READY_TTL = 30  # Segundos que se recuerda si los rollups están completos antes de volver a consultarlo
+MONITORING_ROLLUP_REBUILD_LOCK_TIMEOUT = 300  # Segundos sin progreso tras los que el cerrojo de un rebuild (proceso caído) se puede tomar
+MONITORING_LATEST_ENABLED = True  # Mantener la última lectura de cada ONT al almacenar datos y leer de ella los valores actuales
+TOPOLOGY_CACHE_MAX_AGE = 300  # Segundos entre recargas en segundo plano de la topología de ONTs en memoria (0 = sólo al escribir o por change stream)
+TOPOLOGY_CHANGE_STREAM = False  # Seguir los cambios de manager con un change stream (requiere replica set)
+MONITORING_STREAM_MAX_POINTS = 10000  # Puntos máximos por página del endpoint de series temporales en streaming
+MONITORING_STREAM_BATCH_SIZE = 500  # Documentos por lote del cursor al hacer streaming de series temporales
+MONITORING_MIGRATION_BATCH_SIZE = 5000  # Documentos por lote al migrar monitoring_data a la colección time-series
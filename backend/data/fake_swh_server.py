@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import random
+from datetime import datetime
+from fastapi import FastAPI, HTTPException
+import uvicorn
+from fake_data_generator import generate_bulk_ont_data
+
+# Servidor SWH falso para probar la recogida de datos en local:
+#   python data/fake_swh_server.py --onts 5000 --latency 0.05 --failure-rate 0.02
+# y apuntar SWH_API_URL a http://localhost:8090
+#
+# GET /onts          -> lista de seriales
+# GET /onts/{serial} -> lectura actual de la ONT (mismo formato que fake_data_generator)
+
+
+def create_app(num_onts=1000, latency=0.05, jitter=0.02, failure_rate=0.0):
+    app = FastAPI()
+    serials = [f"FAKE{i:08x}" for i in range(num_onts)]
+    known = set(serials)
+
+    @app.get("/onts")
+    async def list_onts():
+        return serials
+
+    @app.get("/onts/{serial}")
+    async def get_ont(serial: str):
+        if serial not in known:
+            raise HTTPException(status_code=404, detail="ONT not found")
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+        if random.random() < failure_rate:
+            raise HTTPException(status_code=503, detail="SWH temporarily unavailable")
+        data = generate_bulk_ont_data({'serials': [serial], 'total_duration_minutes': 0, 'start_time': datetime.utcnow()})[0]
+        return data
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake SWH API server")
+    parser.add_argument("--onts", type=int, default=1000, help="Number of ONTs served")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Latency standard deviation in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.onts, args.latency, args.jitter, args.failure_rate), host="0.0.0.0", port=args.port)
@@ -0,0 +1,56 @@
+import argparse
+import logging
+import time
+from pymongo import UpdateMany
+from config import MONITORING_MIGRATION_BATCH_SIZE, MONITORING_ROLLUPS_ENABLED
+from database.mongo import monitoring_data_collection, monitoring_latest_collection
+from database.monitoring_storage import field
+from services.monitoring_rollups import MonitoringRollupService
+from services.topology_cache import topology_cache
+
+# Rellena edificio y piso en las lecturas guardadas antes de que la ingesta los añadiera:
+#   python -m database.backfill_monitoring_location
+# Usa la topología actual del gestor. Por defecto sólo toca lecturas sin edificio, así que se
+# puede relanzar sin coste; con --overwrite reasigna también las que ya lo tienen.
+# Si ha cambiado alguna lectura y los rollups están activados, al terminar se recalculan (los
+# buckets de piso y edificio se agregaron con la ubicación que había al ingerirlas).
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(batch_size=MONITORING_MIGRATION_BATCH_SIZE, overwrite=False):
+    topology_cache.load()
+    locations = sorted(topology_cache.locations().items())
+    updated = 0
+    started = time.perf_counter()
+
+    # Un UpdateMany por ONT: el filtro por serial usa el índice serial_timestamp
+    for start in range(0, len(locations), batch_size):
+        chunk = locations[start:start + batch_size]
+        for collection, serial_field, path in ((monitoring_data_collection, field('serial'), field),
+                                               (monitoring_latest_collection, '_id', str)):
+            operations = []
+            for serial, (building, floor) in chunk:
+                query = {serial_field: serial}
+                if not overwrite:
+                    query[path('building')] = None
+                operations.append(UpdateMany(query, {'$set': {path('building'): building, path('floor'): floor}}))
+            result = collection.bulk_write(operations, ordered=False)
+            if collection is monitoring_data_collection:
+                updated += result.modified_count
+        logger.info(f"Stamped location on {updated} documents ({min(start + batch_size, len(locations))}/{len(locations)} ONTs, "
+                    f"{time.perf_counter() - started:.1f}s)")
+
+    logger.info(f"Backfill finished: {updated} documents updated for {len(locations)} ONTs")
+    if MONITORING_ROLLUPS_ENABLED and updated:
+        MonitoringRollupService.rebuild(batch_size)
+    return updated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Stamp building and floor from the manager topology onto stored monitoring data")
+    parser.add_argument("--batch-size", type=int, default=MONITORING_MIGRATION_BATCH_SIZE, help="ONTs per bulk write")
+    parser.add_argument("--overwrite", action="store_true", help="Also restamp documents that already have a building")
+    args = parser.parse_args()
+    backfill(args.batch_size, args.overwrite)
@@ -0,0 +1,112 @@
+import logging
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from database.mongo import monitoring_data_collection, manager_collection, simulations_collection, monitoring_rollup_collections, monitoring_latest_collection
+from database.monitoring_storage import field, ensure_monitoring_collection
+
+logger = logging.getLogger(__name__)
+
+# Índices que necesitan las consultas del servidor; create_indexes no hace nada si ya existen
+INDEXES = [
+    (monitoring_data_collection, [
+        IndexModel([(field("serial"), ASCENDING), ("timestamp", ASCENDING)], name="serial_timestamp"),
+        IndexModel([(field("building"), ASCENDING), (field("floor"), ASCENDING), ("timestamp", ASCENDING)], name="building_floor_timestamp"),
+    ]),
+    (monitoring_latest_collection, [
+        IndexModel([("building", ASCENDING), ("floor", ASCENDING)], name="building_floor"),
+    ]),
+    *[(collection, [
+        IndexModel([("scope", ASCENDING), ("key", ASCENDING), ("bucket", ASCENDING)], name="scope_key_bucket", unique=True),
+    ]) for collection in monitoring_rollup_collections.values()],
+    (manager_collection, [
+        IndexModel([("name", ASCENDING)], name="name"),
+        IndexModel([("floors.name", ASCENDING)], name="floors_name"),
+    ]),
+    (simulations_collection, [
+        IndexModel([("building_name", ASCENDING), ("floor_name", ASCENDING), ("created_at", DESCENDING)], name="floor_created_at"),
+    ]),
+]
+
+
+def ensure_indexes():
+    # La colección time-series tiene que existir antes: create_indexes crearía una normal
+    ensure_monitoring_collection()
+    for collection, indexes in INDEXES:
+        try:
+            names = collection.create_indexes(indexes)
+            logger.info(f"Indexes ready on '{collection.name}': {', '.join(names)}")
+        except PyMongoError as e:
+            logger.error(f"Could not create indexes on '{collection.name}': {e}")
+
+
+def hot_queries():
+    # Consultas representativas de los paneles: (descripción, colección, filtro, orden)
+    since = datetime.utcnow() - timedelta(days=1)
+    return [
+        ("latest snapshot of an ONT", monitoring_data_collection, {field("serial"): ""}, [("timestamp", DESCENDING)]),
+        ("time series of several ONTs", monitoring_data_collection,
+         {field("serial"): {"$in": ["", " "]}, "timestamp": {"$gte": since}}, [("timestamp", ASCENDING)]),
+        ("time series of a floor", monitoring_data_collection,
+         {field("building"): "", field("floor"): "", "timestamp": {"$gte": since}}, [("timestamp", ASCENDING)]),
+        ("hourly rollup of a floor", monitoring_rollup_collections["hour"],
+         {"scope": "floor", "key": "", "bucket": {"$gte": since}}, [("bucket", ASCENDING)]),
+        ("building by name", manager_collection, {"name": ""}, None),
+        ("building by floor name", manager_collection, {"floors.name": ""}, None),
+        ("simulations of a floor", simulations_collection, {"building_name": "", "floor_name": ""}, [("created_at", DESCENDING)]),
+    ]
+
+
+def plan_stages(plan):
+    # Etapas del plan ganador, de la raíz a las hojas
+    stages = []
+    while plan:
+        if "queryPlan" in plan:
+            # Con el motor SBE el plan va envuelto en queryPlan
+            plan = plan["queryPlan"]
+            continue
+        stages.append(plan.get("stage", "?"))
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+def explain_hot_queries():
+    # Registra el plan de cada consulta y avisa si recorre la colección entera u ordena en memoria
+    for description, collection, query, sort in hot_queries():
+        try:
+            cursor = collection.find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explain = cursor.explain()
+        except Exception as e:
+            # Es sólo diagnóstico: nunca debe impedir el arranque
+            logger.error(f"Could not explain '{description}': {e}")
+            continue
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        index_names = sorted(_index_names(explain.get("queryPlanner", {}).get("winningPlan", {})))
+        message = f"Query plan for {description} on '{collection.name}': {' <- '.join(stages)}"
+        if index_names:
+            message += f" (index: {', '.join(index_names)})"
+        if "COLLSCAN" in stages or "SORT" in stages:
+            logger.warning(message)
+        else:
+            logger.info(message)
+
+
+def _index_names(plan):
+    names = set()
+    if isinstance(plan, dict):
+        if plan.get("indexName"):
+            names.add(plan["indexName"])
+        for value in plan.values():
+            names |= _index_names(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            names |= _index_names(value)
+    return names
+
+
+def bootstrap_indexes(explain=True):
+    ensure_indexes()
+    if explain:
+        explain_hot_queries()
@@ -0,0 +1,77 @@
+import argparse
+import logging
+import time
+from pymongo.errors import BulkWriteError
+from config import MONITORING_TIMESERIES_COLLECTION, MONITORING_MIGRATION_BATCH_SIZE
+from database.mongo import db
+from database.monitoring_storage import to_storage, ensure_timeseries_collection
+
+# Copia monitoring_data a la colección time-series por lotes, en orden de _id:
+#   python -m database.migrate_monitoring_timeseries --batch-size 5000
+# El último _id copiado se guarda en la colección migrations, así que si se interrumpe se puede
+# relanzar sin duplicar lecturas (las colecciones time-series no imponen un _id único).
+# Después hay que poner MONITORING_STORAGE_MODE = "timeseries" en config.py.
+
+logger = logging.getLogger(__name__)
+
+SOURCE_COLLECTION = "monitoring_data"
+MIGRATION_ID = "monitoring_timeseries"
+
+
+def collection_size(name):
+    stats = db.command("collStats", name)
+    return stats.get("size", 0), stats.get("storageSize", 0) + stats.get("totalIndexSize", 0)
+
+
+def migrate(batch_size=MONITORING_MIGRATION_BATCH_SIZE, source_name=SOURCE_COLLECTION, target_name=MONITORING_TIMESERIES_COLLECTION, restart=False):
+    ensure_timeseries_collection(target_name)
+    source = db[source_name]
+    target = db[target_name]
+    progress = db["migrations"]
+
+    if restart:
+        progress.delete_one({"_id": MIGRATION_ID})
+    state = progress.find_one({"_id": MIGRATION_ID}) or {}
+    last_id = state.get("last_id")
+    copied = state.get("copied", 0)
+    failed = state.get("failed", 0)
+    total = source.estimated_document_count()
+    started = time.perf_counter()
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(source.find(query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        try:
+            result = target.insert_many([to_storage(document, timeseries=True) for document in batch], ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", [])[:10]:
+                logger.warning(f"Could not copy document {batch[error['index']].get('_id')}: {error.get('errmsg')}")
+        copied += inserted
+        failed += len(batch) - inserted
+        last_id = batch[-1]["_id"]
+        progress.update_one({"_id": MIGRATION_ID}, {"$set": {"last_id": last_id, "copied": copied, "failed": failed}}, upsert=True)
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Copied {copied}/{total} documents ({failed} failed), {copied / elapsed if elapsed else 0:.0f} docs/s")
+
+    source_size, source_storage = collection_size(source_name)
+    target_size, target_storage = collection_size(target_name)
+    logger.info(f"Migration finished: {copied} documents copied, {failed} failed")
+    logger.info(f"'{source_name}': {source_size / 2**20:.1f} MB data, {source_storage / 2**20:.1f} MB on disk")
+    logger.info(f"'{target_name}': {target_size / 2**20:.1f} MB data, {target_storage / 2**20:.1f} MB on disk")
+    return {"copied": copied, "failed": failed}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Copy monitoring_data into the time-series collection")
+    parser.add_argument("--batch-size", type=int, default=MONITORING_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--source", default=SOURCE_COLLECTION)
+    parser.add_argument("--target", default=MONITORING_TIMESERIES_COLLECTION)
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved progress and copy from the beginning")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.source, args.target, args.restart)
@@ -1,15 +1,28 @@
 from pymongo import MongoClient
-from config import MONGO_URI
+import gridfs
+from config import MONGO_URI, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONITORING_STORAGE_MODE, MONITORING_TIMESERIES_COLLECTION
 
-client = MongoClient(MONGO_URI)
+client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
 db = client["network_management_db"]
 
-# Colecciones para el monitoreo de dispositivos
-monitoring_data_collection = db["monitoring_data"]
+# Colecciones para el monitoreo de dispositivos. En modo "timeseries" las lecturas van a una
+# colección time-series con serial, building y floor en el metaField (ver monitoring_storage)
+MONITORING_TIMESERIES = MONITORING_STORAGE_MODE == "timeseries"
+monitoring_data_collection = db[MONITORING_TIMESERIES_COLLECTION if MONITORING_TIMESERIES else "monitoring_data"]
 monitoring_config_collection = db["monitoring_config"]
+# Última lectura de cada ONT, _id = serial (ver monitoring_latest)
+monitoring_latest_collection = db["monitoring_latest"]
+# Buckets pre-agregados para las series temporales (ver monitoring_rollups)
+monitoring_rollup_collections = {interval: db[f"monitoring_rollup_{interval}"] for interval in ("minute", "hour", "day")}
+# Marca de rollups completos y cerrojo del rebuild, compartidos entre procesos
+monitoring_rollup_state_collection = db["monitoring_rollup_state"]
 
 # Colecciones para la gestión de edificios y ONTs
 manager_collection = db["manager"]
 buildings_collection = db["buildings"]
 floors_collection = db["floors"]
-onts_collection = db["onts"]
\ No newline at end of file
+onts_collection = db["onts"]
+
+# Colecciones para los resultados de simulación (metadatos y rejillas en GridFS)
+simulations_collection = db["simulations"]
+simulation_grids = gridfs.GridFS(db, collection="simulation_grids")
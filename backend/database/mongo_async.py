@@ -0,0 +1,23 @@
+from pymongo import AsyncMongoClient
+from pymongo.collection import Collection
+from config import MONGO_URI, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE
+from database import mongo
+
+# Cliente asíncrono para las rutas de FastAPI: las consultas se esperan en el bucle de eventos en
+# lugar de bloquearlo (y con él a los clientes de Socket.IO). Los servicios síncronos, los hilos
+# y los scripts siguen usando el cliente de database.mongo sobre las mismas colecciones.
+async_client = AsyncMongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+async_db = async_client[mongo.db.name]
+
+
+def async_collection(collection: Collection):
+    # Equivalente asíncrono de una colección de database.mongo
+    return async_db[collection.name]
+
+
+async_monitoring_data_collection = async_collection(mongo.monitoring_data_collection)
+async_monitoring_config_collection = async_collection(mongo.monitoring_config_collection)
+async_monitoring_latest_collection = async_collection(mongo.monitoring_latest_collection)
+async_monitoring_rollup_collections = {interval: async_collection(collection) for interval, collection in mongo.monitoring_rollup_collections.items()}
+async_monitoring_rollup_state_collection = async_collection(mongo.monitoring_rollup_state_collection)
+async_manager_collection = async_collection(mongo.manager_collection)
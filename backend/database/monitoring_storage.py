@@ -0,0 +1,60 @@
+import logging
+from typing import Any, Dict
+from pymongo.errors import CollectionInvalid
+from config import MONITORING_STORAGE_MODE, MONITORING_TIMESERIES_COLLECTION, MONITORING_TIMESERIES_GRANULARITY
+from database.mongo import db, MONITORING_TIMESERIES
+
+logger = logging.getLogger(__name__)
+
+# En una colección time-series MongoDB agrupa en buckets las lecturas con el mismo metaField y
+# comprime sus columnas, así que los campos que identifican a la ONT van juntos en "meta"
+TIME_FIELD = "timestamp"
+META_FIELD = "meta"
+META_FIELDS = ("serial", "building", "floor")
+
+if MONITORING_STORAGE_MODE not in ("regular", "timeseries"):
+    raise ValueError(f"Unknown monitoring storage mode: {MONITORING_STORAGE_MODE}")
+
+
+def field(name: str) -> str:
+    # Ruta del campo en la colección de monitoreo: 'serial' -> 'meta.serial' en modo timeseries
+    return f"{META_FIELD}.{name}" if MONITORING_TIMESERIES and name in META_FIELDS else name
+
+
+def to_storage(document: Dict[str, Any], timeseries: bool = MONITORING_TIMESERIES) -> Dict[str, Any]:
+    # Documento de ONTData -> documento tal como se guarda
+    if not timeseries:
+        return document
+    document = dict(document)
+    document[META_FIELD] = {name: document.pop(name, None) for name in META_FIELDS}
+    return document
+
+
+def from_storage(document: Dict[str, Any]) -> Dict[str, Any]:
+    # Inversa de to_storage
+    if META_FIELD not in document:
+        return document
+    document = dict(document)
+    document.update(document.pop(META_FIELD) or {})
+    return document
+
+
+def timeseries_options() -> Dict[str, Any]:
+    return {'timeField': TIME_FIELD, 'metaField': META_FIELD, 'granularity': MONITORING_TIMESERIES_GRANULARITY}
+
+
+def ensure_timeseries_collection(name: str = MONITORING_TIMESERIES_COLLECTION):
+    # Debe llamarse antes de cualquier escritura: insertar o crear índices en una colección
+    # que no existe la crearía como colección normal
+    try:
+        db.create_collection(name, timeseries=timeseries_options())
+        logger.info(f"Created time-series collection '{name}'")
+    except CollectionInvalid:
+        options = db[name].options()
+        if 'timeseries' not in options:
+            raise RuntimeError(f"Collection '{name}' exists but is not a time-series collection")
+
+
+def ensure_monitoring_collection():
+    if MONITORING_TIMESERIES:
+        ensure_timeseries_collection()
@@ -1,4 +1,4 @@
-from config import FRONTEND_URL
+from config import FRONTEND_URL, MONGO_EXPLAIN_ON_STARTUP, TOPOLOGY_CHANGE_STREAM, MONITORING_ROLLUPS_ENABLED, MONITORING_LATEST_ENABLED
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,8 +6,17 @@ from api.manager_routes import router as manager_router
 from api.monitoring_routes import router as monitoring_router
 from api.simulation_routes import router as simulation_routes
 from api.file_routes import router as file_router
-from services.simulation_service import SimulationService
+from services.simulation_jobs import simulation_jobs
+from services.scheduler import collection_scheduler
+from services.topology_cache import topology_cache
+from services.monitoring_rollups import MonitoringRollupService
+from services.monitoring_latest import MonitoringLatestService
+from database.indexes import bootstrap_indexes
+from database.mongo_async import async_client
+from models.simulation_model import SimulationParameters
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from socketio import AsyncServer, ASGIApp
 import logging
 
@@ -15,9 +24,30 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 # Desactivar los mensajes de depuración de PyMongo
-logger = logging.getLogger("pymongo").setLevel(logging.WARNING)
+logging.getLogger("pymongo").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(bootstrap_indexes, MONGO_EXPLAIN_ON_STARTUP)
+    await topology_cache.load_async()
+    topology_cache.start()
+    if TOPOLOGY_CHANGE_STREAM:
+        topology_cache.watch()
+    if MONITORING_ROLLUPS_ENABLED:
+        MonitoringRollupService.seed_in_background()
+    if MONITORING_LATEST_ENABLED:
+        await asyncio.to_thread(MonitoringLatestService.seed)
+    # Recogida periódica de datos de las ONTs mientras el servidor esté en marcha
+    collection_scheduler.start()
+    yield
+    await collection_scheduler.stop()
+    topology_cache.stop()
+    await asyncio.to_thread(MonitoringRollupService.stop_rebuild)
+    await simulation_jobs.shutdown()
+    await async_client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,6 +81,10 @@ async def connect(sid, environ):
 @sio.on('disconnect')
 async def disconnect(sid):
     logger.info(f"Client disconnected: {sid}")
+    # Nadie va a recibir el resultado de sus simulaciones
+    cancelled = simulation_jobs.cancel_owner(sid)
+    if cancelled:
+        logger.info(f"Cancelled {cancelled} simulation(s) of {sid}")
 
 @sio.on('start_simulation')
 async def handle_start_simulation(sid, data):
@@ -63,9 +97,33 @@ async def handle_start_simulation(sid, data):
         await sio.emit('simulation_error', {'error': 'Missing required data'}, room=sid)
         return
     
+    try:
+        parameters = SimulationParameters(**config).dict()
+    except Exception as e:
+        await sio.emit('simulation_error', {'error': f'Invalid simulation parameters: {e}'}, room=sid)
+        return
+
     logger.info(f"Starting simulation for building: {building_name}, floor: {floor_name}")
-    await SimulationService.run_simulation(sio, sid, config, building_name, floor_name)
+    # La simulación se ejecuta como trabajo en segundo plano; los eventos llegan sólo a este cliente
+    simulation = simulation_jobs.submit(
+        building_name, floor_name, parameters, client_emitter(sid), owner=sid,
+        progressive=bool(data.get('stream')), response_format='columnar' if data.get('stream') else 'records'
+    )
+    await sio.emit('simulation_started', {'simulation_id': simulation.id, 'status': simulation.status}, room=sid)
+
+@sio.on('cancel_simulation')
+async def handle_cancel_simulation(sid, data):
+    simulation_id = data.get('simulation_id') if data else None
+    if not simulation_jobs.cancel(simulation_id, owner=sid):
+        await sio.emit('simulation_error', {'simulation_id': simulation_id, 'error': 'Simulation not found or already finished'}, room=sid)
+        return
+    await sio.emit('simulation_cancelled', {'simulation_id': simulation_id}, room=sid)
+
+def client_emitter(sid):
+    async def emit(name, payload):
+        await sio.emit(name, payload, room=sid)
+    return emit
 
 # Función para emitir el progreso
-async def emit_progress(simulation_id, progress):
-    await sio.emit('simulation_progress', {'simulation_id': simulation_id, 'progress': progress})
\ No newline at end of file
+async def emit_progress(simulation_id, progress, room=None):
+    await sio.emit('simulation_progress', {'simulation_id': simulation_id, 'progress': progress}, room=room)
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
+from datetime import datetime
 
 class SimulationParameters(BaseModel):
     num_rays: int
@@ -14,10 +15,22 @@ class SimulationResult(BaseModel):
     rays_data: List[dict]
     walls_data: List[dict]
 
+class SimulationGrid(BaseModel):
+    # Rejilla de received_power guardada en GridFS (float32 little-endian, fila a fila)
+    file_id: str
+    origin: List[float]
+    step: List[float]
+    shape: List[int]
+    dtype: str = "float32"
+
 class Simulation(BaseModel):
     id: Optional[str] = None
     building_name: str
     floor_name: str
     parameters: SimulationParameters
     result: Optional[SimulationResult] = None
-    status: str = "pending"  # pending, running, completed, failed
\ No newline at end of file
+    status: str = "pending"  # pending, running, completed, failed, cancelled
+    grid: Optional[SimulationGrid] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
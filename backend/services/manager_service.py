@@ -2,11 +2,15 @@ from typing import List, Optional, Dict, Any
 from services.swh_service import SWHService
 from models.manager_model import BuildingModel, FloorModel, ONTPosition
 from database.mongo import manager_collection
+from database.mongo_async import async_manager_collection
+from services.simulation_cache import simulation_cache
+from services.topology_cache import topology_cache
 
 class ManagerService:
     @staticmethod
     def create_building(building: BuildingModel):
         result = manager_collection.insert_one(building.dict())
+        topology_cache.refresh_building(building.name)
         return str(result.inserted_id)
 
     @staticmethod
@@ -22,10 +26,14 @@ class ManagerService:
     @staticmethod
     def update_building(name: str, building: BuildingModel):
         manager_collection.replace_one({"name": name}, building.dict(), upsert=True)
+        topology_cache.refresh_building(name)
+        if building.name != name:
+            topology_cache.refresh_building(building.name)
 
     @staticmethod
     def delete_building(name: str):
         manager_collection.delete_one({"name": name})
+        topology_cache.refresh_building(name)
 
     @staticmethod
     def add_floor_to_building(building_name: str, floor: FloorModel):
@@ -33,6 +41,7 @@ class ManagerService:
             {"name": building_name},
             {"$push": {"floors": floor.dict()}}
         )
+        topology_cache.refresh_building(building_name)
 
     @staticmethod
     def get_floor_by_name(building_name: str, floor_name: str) -> Optional[FloorModel]:
@@ -51,6 +60,8 @@ class ManagerService:
             {"name": building_name, "floors.name": floor_name},
             {"$set": update_fields}
         )
+        topology_cache.refresh_building(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
 
     @staticmethod
     def delete_floor(building_name: str, floor_name: str):
@@ -58,6 +69,8 @@ class ManagerService:
             {"name": building_name},
             {"$pull": {"floors": {"name": floor_name}}}
         )
+        topology_cache.refresh_building(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
 
     @staticmethod
     def get_available_onts():
@@ -81,6 +94,7 @@ class ManagerService:
             {"name": building_name, "floors.name": floor_name},
             {"$push": {"floors.$.onts": ont.dict()}}
         )
+        topology_cache.refresh_building(building_name)
 
     @staticmethod
     def update_ont_position(building_name: str, floor_name: str, ont_serial: str, x: float, y: float):
@@ -89,32 +103,26 @@ class ManagerService:
             {"$set": {"floors.$[floor].onts.$[ont].x": x, "floors.$[floor].onts.$[ont].y": y}},
             array_filters=[{"floor.name": floor_name}, {"ont.serial": ont_serial}]
         )
+        topology_cache.refresh_building(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
 
     @staticmethod
     def get_all_onts():
-        buildings = manager_collection.find()
-        all_onts = []
-        for building in buildings:
-            for floor in building.get('floors', []):
-                all_onts.extend(floor.get('onts', []))
-        return all_onts
+        # Resueltas desde la topología en memoria, sin leer los edificios de Mongo
+        return topology_cache.all_onts()
 
     @staticmethod
     def get_onts_for_building(building_name: str):
-        building = manager_collection.find_one({"name": building_name})
-        if not building:
-            return []
-        return [ont for floor in building.get('floors', []) for ont in floor.get('onts', [])]
+        return topology_cache.onts_for_building(building_name)
 
     @staticmethod
     def get_onts_for_floor(building_name: str, floor_name: str):
-        building = manager_collection.find_one(
-            {"name": building_name, "floors.name": floor_name},
-            {"floors.$": 1}
-        )
-        if not building or not building.get('floors'):
-            return []
-        return building['floors'][0].get('onts', [])
+        return topology_cache.onts_for_floor(building_name, floor_name)
+
+    @staticmethod
+    def get_ont_location(serial: str):
+        # (edificio, piso) de una ONT, o None si no está asignada
+        return topology_cache.location(serial)
 
     @staticmethod
     def get_ont_by_serial(building_name: str, floor_name: str, ont_serial: str) -> Optional[ONTPosition]:
@@ -135,6 +143,8 @@ class ManagerService:
             {"$set": {"floors.$[floor].onts.$[ont].x": x, "floors.$[floor].onts.$[ont].y": y}},
             array_filters=[{"floor.name": floor_name}, {"ont.serial": ont_serial}]
         )
+        topology_cache.refresh_building(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
 
     @staticmethod
     def delete_ont(building_name: str, floor_name: str, ont_serial: str):
@@ -142,10 +152,126 @@ class ManagerService:
             {"name": building_name, "floors.name": floor_name},
             {"$pull": {"floors.$.onts": {"serial": ont_serial}}}
         )
+        topology_cache.refresh_building(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
 
     @staticmethod
     def update_floor_geojson(building_name: str, floor_name: str, geojson_data: Dict[str, Any]):
         manager_collection.update_one(
             {"name": building_name, "floors.name": floor_name},
             {"$set": {"floors.$.geoJsonData": geojson_data}}
-        )
\ No newline at end of file
+        )
+        simulation_cache.invalidate_floor(building_name, floor_name)
+
+    # Versiones asíncronas para las rutas: mismas consultas sobre el cliente asíncrono
+    @staticmethod
+    async def create_building_async(building: BuildingModel):
+        result = await async_manager_collection.insert_one(building.dict())
+        await topology_cache.refresh_building_async(building.name)
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def get_all_buildings_async() -> List[BuildingModel]:
+        buildings = await async_manager_collection.find().to_list()
+        return [BuildingModel(**building) for building in buildings]
+
+    @staticmethod
+    async def get_building_by_name_async(name: str) -> Optional[BuildingModel]:
+        building = await async_manager_collection.find_one({"name": name})
+        return BuildingModel(**building) if building else None
+
+    @staticmethod
+    async def update_building_async(name: str, building: BuildingModel):
+        await async_manager_collection.replace_one({"name": name}, building.dict(), upsert=True)
+        await topology_cache.refresh_building_async(name)
+        if building.name != name:
+            await topology_cache.refresh_building_async(building.name)
+
+    @staticmethod
+    async def delete_building_async(name: str):
+        await async_manager_collection.delete_one({"name": name})
+        await topology_cache.refresh_building_async(name)
+
+    @staticmethod
+    async def add_floor_to_building_async(building_name: str, floor: FloorModel):
+        await async_manager_collection.update_one(
+            {"name": building_name},
+            {"$push": {"floors": floor.dict()}}
+        )
+        await topology_cache.refresh_building_async(building_name)
+
+    @staticmethod
+    async def get_floor_by_name_async(building_name: str, floor_name: str) -> Optional[FloorModel]:
+        building = await async_manager_collection.find_one(
+            {"name": building_name, "floors.name": floor_name},
+            {"floors.$": 1}
+        )
+        if building and building.get("floors"):
+            return FloorModel(**building["floors"][0])
+        return None
+
+    @staticmethod
+    async def update_floor_async(building_name: str, floor_name: str, floor: FloorModel):
+        update_fields = {f"floors.$.{key}": value for key, value in floor.dict().items() if value is not None}
+        await async_manager_collection.update_one(
+            {"name": building_name, "floors.name": floor_name},
+            {"$set": update_fields}
+        )
+        await topology_cache.refresh_building_async(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
+
+    @staticmethod
+    async def delete_floor_async(building_name: str, floor_name: str):
+        await async_manager_collection.update_one(
+            {"name": building_name},
+            {"$pull": {"floors": {"name": floor_name}}}
+        )
+        await topology_cache.refresh_building_async(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
+
+    @staticmethod
+    async def add_ont_to_floor_async(building_name: str, floor_name: str, ont: ONTPosition):
+        await async_manager_collection.update_one(
+            {"name": building_name, "floors.name": floor_name},
+            {"$push": {"floors.$.onts": ont.dict()}}
+        )
+        await topology_cache.refresh_building_async(building_name)
+
+    @staticmethod
+    async def get_ont_by_serial_async(building_name: str, floor_name: str, ont_serial: str) -> Optional[ONTPosition]:
+        building = await async_manager_collection.find_one(
+            {"name": building_name, "floors.name": floor_name, "floors.onts.serial": ont_serial},
+            {"floors.$": 1}
+        )
+        if building and building["floors"] and building["floors"][0]["onts"]:
+            ont = next((o for o in building["floors"][0]["onts"] if o["serial"] == ont_serial), None)
+            if ont:
+                return ONTPosition(**ont)
+        return None
+
+    @staticmethod
+    async def update_ont_position_async(building_name: str, floor_name: str, ont_serial: str, x: float, y: float):
+        await async_manager_collection.update_one(
+            {"name": building_name, "floors.name": floor_name, "floors.onts.serial": ont_serial},
+            {"$set": {"floors.$[floor].onts.$[ont].x": x, "floors.$[floor].onts.$[ont].y": y}},
+            array_filters=[{"floor.name": floor_name}, {"ont.serial": ont_serial}]
+        )
+        await topology_cache.refresh_building_async(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
+
+    @staticmethod
+    async def delete_ont_async(building_name: str, floor_name: str, ont_serial: str):
+        await async_manager_collection.update_one(
+            {"name": building_name, "floors.name": floor_name},
+            {"$pull": {"floors.$.onts": {"serial": ont_serial}}}
+        )
+        await topology_cache.refresh_building_async(building_name)
+        simulation_cache.invalidate_floor(building_name, floor_name)
+
+    @staticmethod
+    async def update_floor_geojson_async(building_name: str, floor_name: str, geojson_data: Dict[str, Any]):
+        await async_manager_collection.update_one(
+            {"name": building_name, "floors.name": floor_name},
+            {"$set": {"floors.$.geoJsonData": geojson_data}}
+        )
+        simulation_cache.invalidate_floor(building_name, floor_name)
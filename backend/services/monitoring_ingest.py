@@ -0,0 +1,313 @@
+import asyncio
+import codecs
+import json
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from config import MONITORING_INGEST_BATCH_SIZE, MONITORING_INGEST_MAX_ERRORS, MONITORING_ROLLUPS_ENABLED, MONITORING_LATEST_ENABLED
+from database.mongo import monitoring_data_collection
+from database.monitoring_storage import to_storage
+from models.monitoring_model import ONTData
+from services.monitoring_rollups import MonitoringRollupService
+from services.monitoring_latest import MonitoringLatestService
+from services.topology_cache import topology_cache
+
+logger = logging.getLogger(__name__)
+
+# Un documento de Mongo no puede superar 16 MB; un elemento mayor sin cerrar es un cuerpo inválido
+MAX_ITEM_CHARS = 16 * 1024 * 1024
+
+
+class JSONArrayParser:
+    """Parser incremental de un array JSON: feed() recibe bytes y devuelve los elementos completos.
+
+    Los elementos se decodifican con raw_decode en cuanto están enteros en el buffer, así que
+    nunca se guarda el cuerpo completo en memoria.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._started = False
+        self._finished = False
+        self._after_item = False
+
+    def feed(self, data: bytes) -> List[Any]:
+        self._buffer += self._text_decoder.decode(data)
+        return self._drain(final=False)
+
+    def close(self) -> List[Any]:
+        self._buffer += self._text_decoder.decode(b'', final=True)
+        items = self._drain(final=True)
+        if not self._finished:
+            raise ValueError("Unexpected end of JSON array")
+        return items
+
+    def _drain(self, final):
+        items = []
+        buffer = self._buffer
+        position = 0
+        length = len(buffer)
+        while True:
+            while position < length and buffer[position] in ' \t\r\n':
+                position += 1
+            if position == length:
+                break
+
+            char = buffer[position]
+            if self._finished:
+                raise ValueError("Unexpected data after JSON array")
+            if not self._started:
+                if char != '[':
+                    raise ValueError("Request body must be a JSON array")
+                self._started = True
+                position += 1
+            elif char == ']':
+                self._finished = True
+                position += 1
+            elif self._after_item:
+                if char != ',':
+                    raise ValueError(f"Expected ',' or ']' at offset {position}")
+                self._after_item = False
+                position += 1
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Elemento incompleto: se espera al siguiente bloque
+                    if final or length - position > MAX_ITEM_CHARS:
+                        raise
+                    break
+                if end == length and not final and not isinstance(item, (dict, list)):
+                    break  # Un número o literal al final del buffer puede seguir en el siguiente bloque
+                items.append(item)
+                self._after_item = True
+                position = end
+
+        self._buffer = buffer[position:]
+        return items
+
+
+class IngestStats:
+    # Contadores acumulados desde el arranque del servidor
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.batches = 0
+        self.stale_batches = {}
+        self.seconds = 0.0
+        self.last_documents_per_second = 0.0
+
+    def record_batch(self, received, inserted, failed):
+        with self._lock:
+            self.batches += 1
+            self.received += received
+            self.inserted += inserted
+            self.failed += failed
+
+    def record_stale(self, views):
+        # Lotes guardados cuya actualización de una vista derivada ha fallado
+        with self._lock:
+            for view in views:
+                self.stale_batches[view] = self.stale_batches.get(view, 0) + 1
+
+    def record_request(self, inserted, seconds):
+        with self._lock:
+            self.requests += 1
+            self.seconds += seconds
+            self.last_documents_per_second = inserted / seconds if seconds > 0 else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'received': self.received,
+                'inserted': self.inserted,
+                'failed': self.failed,
+                'batches': self.batches,
+                'stale_batches': dict(self.stale_batches),
+                'seconds': self.seconds,
+                'documents_per_second': self.inserted / self.seconds if self.seconds > 0 else 0.0,
+                'last_documents_per_second': self.last_documents_per_second,
+            }
+
+
+ingest_stats = IngestStats()
+
+
+class MonitoringIngestService:
+    @staticmethod
+    def validate_batch(items: List[Any], offset: int) -> Tuple[List[dict], List[int], List[Dict[str, Any]]]:
+        # Devuelve los documentos válidos, su posición en el cuerpo y los errores de validación
+        documents, indices, errors = [], [], []
+        for i, item in enumerate(items, start=offset):
+            try:
+                document = (item if isinstance(item, ONTData) else ONTData(**item)).dict()
+                MonitoringIngestService.stamp_location(document)
+                documents.append(document)
+                indices.append(i)
+            except (ValidationError, TypeError) as e:
+                errors.append({'index': i, 'error': str(e)})
+        return documents, indices, errors
+
+    @staticmethod
+    def stamp_location(document: dict):
+        # Edificio y piso actuales de la ONT según la topología, para consultar por ámbito sin $in de seriales
+        location = topology_cache.location(document.get('serial'))
+        if location:
+            document['building'], document['floor'] = location
+
+    @staticmethod
+    def insert_batch(documents: List[dict], indices: List[int]) -> Tuple[int, List[Dict[str, Any]]]:
+        # Inserción no ordenada: un documento erróneo no detiene al resto del lote
+        if not documents:
+            return 0, []
+        try:
+            result = monitoring_data_collection.insert_many([to_storage(document) for document in documents], ordered=False)
+            return len(result.inserted_ids), []
+        except BulkWriteError as e:
+            details = e.details
+            errors = [
+                {'index': indices[error['index']], 'error': error.get('errmsg', 'Write error')}
+                for error in details.get('writeErrors', [])
+            ]
+            return details.get('nInserted', 0), errors
+
+    @staticmethod
+    def update_derived(documents: List[dict]) -> List[str]:
+        # Un fallo aquí no invalida la ingesta: las lecturas ya están guardadas y las vistas
+        # derivadas se pueden recalcular con el rebuild() de cada servicio. Devuelve las vistas
+        # que no se han actualizado para que la respuesta y las estadísticas lo indiquen
+        stale = []
+        if MONITORING_LATEST_ENABLED:
+            try:
+                MonitoringLatestService.apply(documents)
+            except Exception as e:
+                logger.exception(f"Could not update latest monitoring values for {len(documents)} documents: {e}")
+                stale.append('latest')
+        if MONITORING_ROLLUPS_ENABLED:
+            try:
+                MonitoringRollupService.apply(documents)
+            except Exception as e:
+                logger.exception(f"Could not update monitoring rollups for {len(documents)} documents: {e}")
+                stale.append('rollups')
+        if stale:
+            ingest_stats.record_stale(stale)
+        return stale
+
+    @staticmethod
+    def process_batch(items: List[Any], offset: int) -> Tuple[int, List[Dict[str, Any]], List[str]]:
+        documents, indices, errors = MonitoringIngestService.validate_batch(items, offset)
+        inserted, write_errors = MonitoringIngestService.insert_batch(documents, indices)
+        errors.extend(write_errors)
+        stale = []
+        if inserted:
+            failed = {error['index'] for error in write_errors}
+            stale = MonitoringIngestService.update_derived([document for document, i in zip(documents, indices) if i not in failed])
+        ingest_stats.record_batch(len(items), inserted, len(errors))
+        return inserted, errors, stale
+
+    @staticmethod
+    def ingest_documents(items: Iterable[Any], batch_size: int = MONITORING_INGEST_BATCH_SIZE) -> Dict[str, Any]:
+        # Versión síncrona para datos que ya están en memoria (ONTData o diccionarios)
+        summary = _IngestSummary()
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                summary.add(len(batch), *MonitoringIngestService.process_batch(batch, summary.received))
+                batch = []
+        if batch:
+            summary.add(len(batch), *MonitoringIngestService.process_batch(batch, summary.received))
+        return summary.finish()
+
+    @staticmethod
+    async def ingest_stream(chunks: AsyncIterator[bytes], batch_size: int = MONITORING_INGEST_BATCH_SIZE) -> Dict[str, Any]:
+        """Procesa un array JSON de ONTData según llega, en lotes de batch_size.
+
+        Cada lote se valida e inserta en un hilo mientras se lee el siguiente, con un único
+        lote en vuelo para que la memoria no dependa del tamaño del cuerpo.
+        """
+        summary = _IngestSummary()
+        parser = JSONArrayParser()
+        batch = []
+        pending = None
+        next_index = 0
+
+        async def flush(items):
+            nonlocal pending, next_index
+            offset = next_index
+            next_index += len(items)
+            if pending is not None:
+                summary.add(*(await pending))
+            pending = asyncio.ensure_future(_process_in_thread(items, offset))
+
+        try:
+            async for chunk in chunks:
+                batch.extend(parser.feed(chunk))
+                while len(batch) >= batch_size:
+                    await flush(batch[:batch_size])
+                    batch = batch[batch_size:]
+            batch.extend(parser.close())
+        except ValueError as e:
+            summary.parse_error = str(e)
+            # Los elementos anteriores al erróneo se guardan igualmente (los ya enviados en lotes y los pendientes)
+            summary.parse_error_index = next_index + len(batch)
+
+        if batch:
+            await flush(batch)
+        if pending is not None:
+            summary.add(*(await pending))
+        result = summary.finish()
+        logger.info(f"Ingested {result['inserted']}/{result['received']} ONT snapshots in {result['seconds']:.3f}s")
+        return result
+
+
+async def _process_in_thread(items, offset):
+    inserted, errors, stale = await asyncio.to_thread(MonitoringIngestService.process_batch, items, offset)
+    return len(items), inserted, errors, stale
+
+
+class _IngestSummary:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.stale_views = set()
+        self.parse_error = None
+        self.parse_error_index = None
+
+    def add(self, received, inserted, errors, stale=()):
+        self.stale_views.update(stale)
+        self.received += received
+        self.inserted += inserted
+        self.failed += len(errors)
+        self.errors.extend(errors[:max(MONITORING_INGEST_MAX_ERRORS - len(self.errors), 0)])
+
+    def finish(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self.started
+        ingest_stats.record_request(self.inserted, seconds)
+        result = {
+            'received': self.received,
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': seconds,
+            'documents_per_second': self.inserted / seconds if seconds > 0 else 0.0,
+        }
+        if self.stale_views:
+            # Lecturas guardadas pero sin reflejar en estas vistas hasta su rebuild()
+            result['stale_views'] = sorted(self.stale_views)
+        if self.parse_error:
+            result['parse_error'] = self.parse_error
+            result['parse_error_index'] = self.parse_error_index
+        return result
@@ -0,0 +1,104 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+from pymongo import UpdateOne
+from config import MONITORING_MIGRATION_BATCH_SIZE
+from database.mongo import monitoring_data_collection, monitoring_latest_collection
+from database.monitoring_storage import field, from_storage
+from services.monitoring_rollups import document_metrics, utc_naive
+
+logger = logging.getLogger(__name__)
+
+# Valores de gpon que get_latest_values promedia entre ONTs
+GPON_FIELDS = ('transceiverTemperature', 'rxPower', 'txPower')
+
+
+def latest_snapshot(document: Dict[str, Any]) -> Dict[str, Any]:
+    # Métricas derivadas de la lectura más reciente de una ONT (un documento por serial)
+    last, _ = document_metrics(document)
+    gpon = document.get('gpon') or {}
+    timestamp = document.get('timestamp')
+    return {
+        '_id': document.get('serial'),
+        'timestamp': utc_naive(timestamp) if isinstance(timestamp, datetime) else timestamp,
+        'building': document.get('building'),
+        'floor': document.get('floor'),
+        **last,
+        **{name: gpon.get(name) for name in GPON_FIELDS},
+    }
+
+
+class MonitoringLatestService:
+    """Última lectura de cada ONT, actualizada en cada ingesta.
+
+    Sustituye a ordenar todo el histórico para quedarse con el primer documento de cada serial:
+    leer el estado actual cuesta lo mismo tenga el histórico el tamaño que tenga.
+    """
+
+    @staticmethod
+    def apply(documents: Iterable[Dict[str, Any]]):
+        newest = {}
+        for document in documents:
+            timestamp = document.get('timestamp')
+            if not isinstance(timestamp, datetime):
+                continue
+            # Fechas con y sin zona en el mismo lote: se comparan como UTC sin zona, igual que en Mongo
+            timestamp = utc_naive(timestamp)
+            current = newest.get(document.get('serial'))
+            if current is None or timestamp >= current[0]:
+                newest[document.get('serial')] = (timestamp, document)
+        if not newest:
+            return
+
+        operations = []
+        for serial, (_, document) in newest.items():
+            snapshot = latest_snapshot(document)
+            # Sólo reemplaza si la lectura no es más antigua que la guardada (llegadas fuera de orden)
+            is_newer = {'$gte': [snapshot['timestamp'], {'$ifNull': ['$timestamp', datetime.min]}]}
+            operations.append(UpdateOne({'_id': serial},
+                                        [{'$replaceWith': {'$cond': [is_newer, {'$literal': snapshot}, '$$ROOT']}}],
+                                        upsert=True))
+        monitoring_latest_collection.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def delete(serials: List[str]):
+        monitoring_latest_collection.delete_many({'_id': {'$in': serials}})
+
+    @staticmethod
+    def seed(batch_size: int = MONITORING_MIGRATION_BATCH_SIZE) -> int:
+        # Primer arranque con la tabla activada sobre un histórico existente: se rellena antes de
+        # atender peticiones para que get_latest_values no devuelva ONTs sin datos
+        if monitoring_latest_collection.find_one({}, {'_id': 1}) is not None:
+            return 0
+        if monitoring_data_collection.find_one({}, {'_id': 1}) is None:
+            return 0
+        logger.info("Latest monitoring snapshot is empty, building it from the stored readings")
+        return MonitoringLatestService.rebuild(batch_size)
+
+    @staticmethod
+    def rebuild(batch_size: int = MONITORING_MIGRATION_BATCH_SIZE):
+        # Recalcula la tabla desde el histórico: la última lectura de cada serial
+        monitoring_latest_collection.delete_many({})
+        pipeline = [
+            {'$sort': {field('serial'): 1, 'timestamp': -1}},
+            {'$group': {'_id': '$' + field('serial'), 'document': {'$first': '$$ROOT'}}},
+        ]
+        batch = []
+        total = 0
+        for result in monitoring_data_collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+            batch.append(from_storage(result['document']))
+            if len(batch) >= batch_size:
+                MonitoringLatestService.apply(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            MonitoringLatestService.apply(batch)
+            total += len(batch)
+        logger.info(f"Latest monitoring snapshot rebuilt for {total} ONTs")
+        return total
+
+
+if __name__ == "__main__":
+    # python -m services.monitoring_latest: recalcula la última lectura de cada ONT
+    logging.basicConfig(level=logging.INFO)
+    MonitoringLatestService.rebuild()
@@ -0,0 +1,406 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from config import (MONITORING_MIGRATION_BATCH_SIZE, MONITORING_STREAM_BATCH_SIZE, MONITORING_ROLLUPS_READY_TTL,
+                    MONITORING_ROLLUP_REBUILD_LOCK_TIMEOUT)
+from database.mongo import monitoring_data_collection, monitoring_rollup_collections, monitoring_rollup_state_collection
+from database.mongo_async import async_monitoring_rollup_collections, async_monitoring_rollup_state_collection
+from database.monitoring_storage import field, from_storage
+from services.topology_cache import topology_cache
+
+logger = logging.getLogger(__name__)
+
+# Métricas de get_time_series_data. Las "last" son las del documento más reciente del bucket y
+# las "avg" se guardan como suma y número de valores para poder combinar lotes y buckets
+LAST_METRICS = ('totalBytesReceived', 'totalBytesSent', 'totalWifiBytesReceived', 'totalWifiBytesSent',
+                'totalWifiAssociations', 'activeWANs', 'activeWiFiInterfaces', 'connectedHosts', 'failedConnections')
+AVG_METRICS = {'avgTransceiverTemperature': 'transceiverTemperature', 'avgRxPower': 'rxPower', 'avgTxPower': 'txPower'}
+INTERVALS = ('minute', 'hour', 'day')
+# Documentos de monitoring_rollup_state: rollups completos y rebuild en curso
+READY_ID = 'ready'
+LOCK_ID = 'rebuild'
+
+# Último valor leído de la marca de completos (valor, time.monotonic() de la consulta)
+_ready = {'value': False, 'checked_at': None}
+_seeder = None
+_stop_rebuild = threading.Event()
+
+
+def utc_naive(timestamp: datetime) -> datetime:
+    # Mongo devuelve fechas UTC sin zona: una fecha con zona se pasa a UTC antes de quitársela
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def bucket_start(timestamp: datetime, interval: str) -> datetime:
+    # Mismos buckets que el $group por año/mes/día/hora/minuto (UTC)
+    if interval == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    if interval == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_bucket(start: datetime, interval: str) -> datetime:
+    # Inicio del bucket siguiente a start (start ya alineado con bucket_start)
+    return start + {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1)}.get(interval, timedelta(days=1))
+
+
+def rollup_interval(interval: str) -> str:
+    # get_time_series_data agrupa por día cualquier intervalo que no sea 'hour' o 'minute'
+    return interval if interval in ('minute', 'hour') else 'day'
+
+
+def document_metrics(document: Dict[str, Any]) -> Tuple[Dict[str, int], Dict[str, float]]:
+    wans = document.get('wans') or []
+    wifi = document.get('wifi') or []
+    hosts = document.get('hosts') or []
+    last = {
+        'totalBytesReceived': sum(wan.get('bytesReceived', 0) for wan in wans),
+        'totalBytesSent': sum(wan.get('bytesSent', 0) for wan in wans),
+        'totalWifiBytesReceived': sum(interface.get('totalBytesReceived', 0) for interface in wifi),
+        'totalWifiBytesSent': sum(interface.get('totalBytesSent', 0) for interface in wifi),
+        'totalWifiAssociations': sum(interface.get('totalAssociations', 0) for interface in wifi),
+        'activeWANs': sum(1 for wan in wans if wan.get('connectionStatus') == 'Connected'),
+        'activeWiFiInterfaces': sum(1 for interface in wifi if interface.get('status') == 'Up'),
+        'connectedHosts': len(hosts),
+        'failedConnections': sum(1 for host in hosts if host.get('active') is False),
+    }
+    gpon = document.get('gpon') or {}
+    values = {name: gpon[source] for name, source in AVG_METRICS.items() if gpon.get(source) is not None}
+    return last, values
+
+
+def document_scopes(document: Dict[str, Any], locations: Dict[str, Tuple[str, str]]) -> List[Tuple[str, str]]:
+    # Ámbitos a los que contribuye una lectura: su ONT, su piso, su edificio y el total
+    serial = document.get('serial')
+    building, floor = document.get('building'), document.get('floor')
+    if not building:
+        building, floor = locations.get(serial, (None, None))
+    scopes = [('serial', serial), ('all', 'all')]
+    if building:
+        scopes.append(('building', building))
+        if floor:
+            scopes.append(('floor', floor_key(building, floor)))
+    return scopes
+
+
+def floor_key(building: str, floor: str) -> str:
+    return f"{building}\x00{floor}"
+
+
+class _Bucket:
+    __slots__ = ('timestamp', 'last', 'sums', 'counts', 'documents')
+
+    def __init__(self):
+        self.timestamp = None
+        self.last = None
+        self.sums = dict.fromkeys(AVG_METRICS, 0.0)
+        self.counts = dict.fromkeys(AVG_METRICS, 0)
+        self.documents = 0
+
+    def add(self, timestamp, last, values):
+        self.documents += 1
+        if self.timestamp is None or timestamp >= self.timestamp:
+            self.timestamp = timestamp
+            self.last = last
+        for name, value in values.items():
+            self.sums[name] += value
+            self.counts[name] += 1
+
+
+class MonitoringRollupService:
+    """Buckets de minuto, hora y día por ONT, piso, edificio y total.
+
+    Cada lote de ingesta se agrega primero en memoria y después se aplica con una única
+    actualización por bucket (pipeline update con upsert), así que varios escritores pueden
+    actualizar el mismo bucket sin perder datos. rebuild() los recalcula desde las lecturas.
+    """
+
+    @staticmethod
+    def apply(documents: Iterable[Dict[str, Any]], locations: Optional[Dict[str, Tuple[str, str]]] = None):
+        buckets = MonitoringRollupService._aggregate(documents, locations)
+        for interval, interval_buckets in buckets.items():
+            if interval_buckets:
+                operations = [MonitoringRollupService._update(bucket_id, bucket) for bucket_id, bucket in interval_buckets.items()]
+                monitoring_rollup_collections[interval].bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def _aggregate(documents: Iterable[Dict[str, Any]], locations: Optional[Dict[str, Tuple[str, str]]] = None,
+                   scopes: Optional[Set[Tuple[str, str]]] = None,
+                   ranges: Optional[Dict[str, Tuple[datetime, datetime]]] = None) -> Dict[str, Dict[Tuple, _Bucket]]:
+        # Buckets en memoria de un conjunto de lecturas, opcionalmente sólo de algunos ámbitos y rangos
+        locations = topology_cache.locations() if locations is None else locations
+        buckets = {interval: {} for interval in INTERVALS}
+        for document in documents:
+            timestamp = document.get('timestamp')
+            if not isinstance(timestamp, datetime):
+                continue
+            # Buckets en UTC como en Mongo: una lectura con zona se agrupa por su instante UTC
+            timestamp = utc_naive(timestamp)
+            last, values = document_metrics(document)
+            for scope, key in document_scopes(document, locations):
+                if scopes is not None and (scope, key) not in scopes:
+                    continue
+                for interval in INTERVALS:
+                    start = bucket_start(timestamp, interval)
+                    if ranges is not None and not ranges[interval][0] <= start < ranges[interval][1]:
+                        continue
+                    bucket_id = (scope, key, start)
+                    bucket = buckets[interval].get(bucket_id)
+                    if bucket is None:
+                        bucket = buckets[interval][bucket_id] = _Bucket()
+                    bucket.add(timestamp, last, values)
+        return buckets
+
+    @staticmethod
+    def _update(bucket_id, bucket: _Bucket) -> UpdateOne:
+        scope, key, start = bucket_id
+        is_newer = {'$gte': [bucket.timestamp, {'$ifNull': ['$timestamp', datetime.min]}]}
+        fields = {
+            'timestamp': {'$max': ['$timestamp', bucket.timestamp]},
+            'last': {'$cond': [is_newer, {'$literal': bucket.last}, '$last']},
+            'documents': {'$add': [{'$ifNull': ['$documents', 0]}, bucket.documents]},
+        }
+        for name in AVG_METRICS:
+            fields[f'sums.{name}'] = {'$add': [{'$ifNull': [f'$sums.{name}', 0]}, bucket.sums[name]]}
+            fields[f'counts.{name}'] = {'$add': [{'$ifNull': [f'$counts.{name}', 0]}, bucket.counts[name]]}
+        return UpdateOne({'scope': scope, 'key': key, 'bucket': start}, [{'$set': fields}], upsert=True)
+
+    @staticmethod
+    def _document(bucket_id, bucket: _Bucket) -> Dict[str, Any]:
+        # Bucket completo, tal como queda tras aplicar _update sobre un bucket vacío
+        scope, key, start = bucket_id
+        return {'scope': scope, 'key': key, 'bucket': start, 'timestamp': bucket.timestamp, 'last': bucket.last,
+                'documents': bucket.documents, 'sums': dict(bucket.sums), 'counts': dict(bucket.counts)}
+
+    @staticmethod
+    def affected(serials: List[str], locations: Optional[Dict[str, Tuple[str, str]]] = None) \
+            -> Tuple[Set[Tuple[str, str]], Optional[datetime], Optional[datetime]]:
+        # Ámbitos y rango de tiempo de las lecturas de estas ONTs; se consulta antes de borrarlas
+        locations = topology_cache.locations() if locations is None else locations
+        pipeline = [
+            {'$match': {field('serial'): {'$in': serials}}},
+            {'$group': {
+                '_id': {name: '$' + field(name) for name in ('serial', 'building', 'floor')},
+                'start': {'$min': '$timestamp'},
+                'end': {'$max': '$timestamp'},
+            }},
+        ]
+        scopes, start, end = set(), None, None
+        for group in monitoring_data_collection.aggregate(pipeline):
+            scopes.update(document_scopes(group['_id'], locations))
+            start = group['start'] if start is None else min(start, group['start'])
+            end = group['end'] if end is None else max(end, group['end'])
+        return scopes, start, end
+
+    @staticmethod
+    def recompute(scopes: Set[Tuple[str, str]], start: Optional[datetime], end: Optional[datetime],
+                  batch_size: int = MONITORING_MIGRATION_BATCH_SIZE) -> int:
+        # Tras un borrado: recalcula desde las lecturas sólo los buckets de esos ámbitos entre start y end.
+        # Los buckets se sustituyen (upsert) y se borran los que se han quedado sin lecturas; el resto
+        # de buckets sigue disponible para las lecturas mientras tanto
+        if not scopes or start is None:
+            return 0
+        ranges = {}
+        for interval in INTERVALS:
+            ranges[interval] = (bucket_start(start, interval), next_bucket(bucket_start(end, interval), interval))
+        low, high = ranges['day']
+        documents = (from_storage(document) for document in
+                     monitoring_data_collection.find({'timestamp': {'$gte': low, '$lt': high}}, {'_id': 0}).batch_size(batch_size))
+        buckets = MonitoringRollupService._aggregate(documents, scopes=scopes, ranges=ranges)
+
+        for interval, interval_buckets in buckets.items():
+            operations = []
+            kept = {}
+            for bucket_id, bucket in interval_buckets.items():
+                scope, key, bucket_time = bucket_id
+                operations.append(ReplaceOne({'scope': scope, 'key': key, 'bucket': bucket_time},
+                                             MonitoringRollupService._document(bucket_id, bucket), upsert=True))
+                kept.setdefault((scope, key), []).append(bucket_time)
+            low, high = ranges[interval]
+            for scope, key in scopes:
+                window = {'$gte': low, '$lt': high, '$nin': kept.get((scope, key), [])}
+                operations.append(DeleteMany({'scope': scope, 'key': key, 'bucket': window}))
+            monitoring_rollup_collections[interval].bulk_write(operations, ordered=False)
+        logger.info(f"Monitoring rollups recomputed for {len(scopes)} scopes between {start} and {end}")
+        return len(scopes)
+
+    @staticmethod
+    def read(serial: Optional[str] = None, floor: Optional[str] = None, building: Optional[str] = None,
+             start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, interval: str = 'hour') -> List[Dict]:
+        # Mismo resultado que get_time_series_data, con start_date/end_date aplicados por bucket
+        interval, query = MonitoringRollupService.read_query(serial, floor, building, start_date, end_date, interval)
+        buckets = monitoring_rollup_collections[interval].find(query).sort('bucket', 1)
+        return [MonitoringRollupService.format_bucket(bucket) for bucket in buckets]
+
+    @staticmethod
+    async def read_async(serial: Optional[str] = None, floor: Optional[str] = None, building: Optional[str] = None,
+                         start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, interval: str = 'hour') -> List[Dict]:
+        interval, query = MonitoringRollupService.read_query(serial, floor, building, start_date, end_date, interval)
+        buckets = await async_monitoring_rollup_collections[interval].find(query).sort('bucket', 1).to_list()
+        return [MonitoringRollupService.format_bucket(bucket) for bucket in buckets]
+
+    @staticmethod
+    def read_query(serial: Optional[str] = None, floor: Optional[str] = None, building: Optional[str] = None,
+                   start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, interval: str = 'hour',
+                   after: Optional[datetime] = None) -> Tuple[str, Dict]:
+        # after: inicio del último bucket ya entregado (paginación por clave)
+        interval = rollup_interval(interval)
+        if serial:
+            scope, key = 'serial', serial
+        elif floor and building:
+            scope, key = 'floor', floor_key(building, floor)
+        elif building:
+            scope, key = 'building', building
+        else:
+            scope, key = 'all', 'all'
+
+        query = {'scope': scope, 'key': key}
+        if start_date:
+            query['bucket'] = {'$gte': bucket_start(utc_naive(start_date), interval)}
+        if end_date:
+            query.setdefault('bucket', {})['$lte'] = utc_naive(end_date)
+        if after:
+            after = bucket_start(utc_naive(after), interval)
+            bucket = query.setdefault('bucket', {})
+            bucket['$gte'] = max(bucket.get('$gte', after), next_bucket(after, interval))
+        return interval, query
+
+    @staticmethod
+    async def stream(serial: Optional[str] = None, floor: Optional[str] = None, building: Optional[str] = None,
+                     start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, interval: str = 'hour',
+                     after: Optional[datetime] = None, limit: Optional[int] = None,
+                     batch_size: int = MONITORING_STREAM_BATCH_SIZE) -> AsyncIterator[Tuple[datetime, Dict]]:
+        # (inicio del bucket, punto) en orden, leyendo el cursor por lotes
+        interval, query = MonitoringRollupService.read_query(serial, floor, building, start_date, end_date, interval, after)
+        cursor = async_monitoring_rollup_collections[interval].find(query).sort('bucket', 1).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for bucket in cursor:
+            yield bucket['bucket'], MonitoringRollupService.format_bucket(bucket)
+
+    @staticmethod
+    def format_bucket(bucket: Dict[str, Any]) -> Dict[str, Any]:
+        result = {'timestamp': bucket['timestamp'], **{name: bucket['last'][name] for name in LAST_METRICS}, 'deviceCount': 1}
+        for name in AVG_METRICS:
+            count = bucket['counts'][name]
+            result[name] = bucket['sums'][name] / count if count else None
+        return result
+
+    @staticmethod
+    def ready() -> bool:
+        # Los buckets sólo se leen cuando un rebuild ha terminado; mientras tanto se usa el histórico
+        if MonitoringRollupService._cached_ready() is None:
+            MonitoringRollupService._remember_ready(monitoring_rollup_state_collection.find_one({'_id': READY_ID}) is not None)
+        return _ready['value']
+
+    @staticmethod
+    async def ready_async() -> bool:
+        if MonitoringRollupService._cached_ready() is None:
+            marker = await async_monitoring_rollup_state_collection.find_one({'_id': READY_ID})
+            MonitoringRollupService._remember_ready(marker is not None)
+        return _ready['value']
+
+    @staticmethod
+    def _cached_ready() -> Optional[bool]:
+        checked_at = _ready['checked_at']
+        if checked_at is None or time.monotonic() - checked_at > MONITORING_ROLLUPS_READY_TTL:
+            return None
+        return _ready['value']
+
+    @staticmethod
+    def _remember_ready(value: bool):
+        _ready['value'], _ready['checked_at'] = value, time.monotonic()
+
+    @staticmethod
+    def seed(batch_size: int = MONITORING_MIGRATION_BATCH_SIZE) -> int:
+        # Primer arranque con los rollups activados: se calculan si ningún rebuild ha terminado aún
+        if monitoring_rollup_state_collection.find_one({'_id': READY_ID}) is not None:
+            return 0
+        logger.info("Monitoring rollups are not marked as complete, building them from the stored readings")
+        return MonitoringRollupService.rebuild(batch_size)
+
+    @staticmethod
+    def seed_in_background():
+        # Sin bloquear el arranque del servidor; hasta que termine, las series se leen del histórico
+        global _seeder
+        _stop_rebuild.clear()
+        _seeder = threading.Thread(target=MonitoringRollupService.seed, name="rollup-seed", daemon=True)
+        _seeder.start()
+
+    @staticmethod
+    def stop_rebuild(timeout: float = 5.0):
+        # Interrumpe un rebuild en curso de este proceso y libera su cerrojo
+        _stop_rebuild.set()
+        if _seeder is not None:
+            _seeder.join(timeout)
+
+    @staticmethod
+    def rebuild(batch_size: int = MONITORING_MIGRATION_BATCH_SIZE) -> int:
+        # Compactador: vacía los buckets y los recalcula a partir de todas las lecturas guardadas.
+        # Un cerrojo en monitoring_rollup_state evita que dos procesos lo hagan a la vez (cada uno
+        # sumaría las lecturas sobre los buckets del otro)
+        owner = ObjectId()
+        if not MonitoringRollupService._acquire_lock(owner):
+            logger.warning("Another monitoring rollup rebuild is running, skipping this one")
+            return 0
+        try:
+            monitoring_rollup_state_collection.delete_one({'_id': READY_ID})
+            MonitoringRollupService._remember_ready(False)
+            # Las lecturas insertadas desde aquí ya las suma la ingesta: el recorrido se queda en
+            # las anteriores (el _id lleva la hora de inserción con resolución de segundos)
+            boundary = ObjectId.from_datetime(datetime.now(timezone.utc))
+            for collection in monitoring_rollup_collections.values():
+                collection.delete_many({})
+            locations = topology_cache.locations()
+            batch = []
+            total = 0
+            for document in monitoring_data_collection.find({'_id': {'$lt': boundary}}, {'_id': 0}).batch_size(batch_size):
+                batch.append(from_storage(document))
+                if len(batch) >= batch_size:
+                    if _stop_rebuild.is_set():
+                        logger.warning(f"Monitoring rollup rebuild interrupted after {total} documents")
+                        return total
+                    MonitoringRollupService.apply(batch, locations)
+                    total += len(batch)
+                    batch = []
+                    MonitoringRollupService._renew_lock(owner)
+            if batch:
+                MonitoringRollupService.apply(batch, locations)
+                total += len(batch)
+            monitoring_rollup_state_collection.replace_one(
+                {'_id': READY_ID}, {'_id': READY_ID, 'rebuiltAt': datetime.utcnow(), 'documents': total}, upsert=True)
+            MonitoringRollupService._remember_ready(True)
+            logger.info(f"Monitoring rollups rebuilt from {total} documents")
+            return total
+        finally:
+            monitoring_rollup_state_collection.delete_one({'_id': LOCK_ID, 'owner': owner})
+
+    @staticmethod
+    def _acquire_lock(owner: ObjectId) -> bool:
+        now = datetime.utcnow()
+        try:
+            monitoring_rollup_state_collection.insert_one({'_id': LOCK_ID, 'owner': owner, 'heartbeat': now})
+            return True
+        except DuplicateKeyError:
+            # Un cerrojo sin progreso reciente es de un proceso que ya no existe
+            expired = now - timedelta(seconds=MONITORING_ROLLUP_REBUILD_LOCK_TIMEOUT)
+            result = monitoring_rollup_state_collection.update_one(
+                {'_id': LOCK_ID, 'heartbeat': {'$lt': expired}}, {'$set': {'owner': owner, 'heartbeat': now}})
+            return result.modified_count == 1
+
+    @staticmethod
+    def _renew_lock(owner: ObjectId):
+        monitoring_rollup_state_collection.update_one({'_id': LOCK_ID, 'owner': owner}, {'$set': {'heartbeat': datetime.utcnow()}})
+
+if __name__ == "__main__":
+    # python -m services.monitoring_rollups: recalcula todos los buckets
+    logging.basicConfig(level=logging.INFO)
+    MonitoringRollupService.rebuild()
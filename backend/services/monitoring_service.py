@@ -1,9 +1,17 @@
+import asyncio
 import logging
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, AsyncIterator, Tuple
 from datetime import datetime, timedelta
-from database.mongo import monitoring_data_collection, monitoring_config_collection
+from config import MONITORING_ROLLUPS_ENABLED, MONITORING_LATEST_ENABLED, MONITORING_STREAM_BATCH_SIZE
+from database.mongo import monitoring_data_collection, monitoring_config_collection, monitoring_latest_collection
+from database.mongo_async import async_collection, async_monitoring_data_collection, async_monitoring_config_collection
+from database.monitoring_storage import field
 from models.monitoring_model import ONTData, MonitoringConfig
 from services.manager_service import ManagerService
+from services.monitoring_ingest import MonitoringIngestService
+from services.monitoring_rollups import MonitoringRollupService, bucket_start, next_bucket, utc_naive
+from services.monitoring_latest import MonitoringLatestService
+from services.topology_cache import topology_cache
 from bson import ObjectId
 
 
@@ -11,16 +19,62 @@ logger = logging.getLogger(__name__)
 
 class MonitoringService:
     @staticmethod
-    def create_monitoring_data(data: List[ONTData]):
-        ont_data_list = [ont_data.dict() for ont_data in data]
-        monitoring_data_collection.insert_many(ont_data_list)
+    def create_monitoring_data(data: List[ONTData]) -> Dict[str, Any]:
+        # Lotes no ordenados; devuelve contadores y errores por documento
+        return MonitoringIngestService.ingest_documents(data)
 
     @staticmethod
     def delete_monitoring_data(building: Optional[str] = None, 
                             floor: Optional[str] = None, 
                             serial: Optional[str] = None) -> Dict[str, Any]:
         logger.info(f"delete_monitoring_data called with building={building}, floor={floor}, serial={serial}")
+        serials = MonitoringService.serials_to_delete(building, floor, serial)
+        if not serials:
+            return {"deleted_count": 0, "onts_affected": []}
+
+        # Buckets a los que contribuían las lecturas borradas (ONT, piso, edificio y total)
+        affected = MonitoringRollupService.affected(serials) if MONITORING_ROLLUPS_ENABLED else None
+        result = monitoring_data_collection.delete_many({field('serial'): {'$in': serials}})
+        deleted_count = result.deleted_count
+        if MONITORING_LATEST_ENABLED:
+            MonitoringLatestService.delete(serials)
+        if affected:
+            MonitoringRollupService.recompute(*affected)
         
+        logger.info(f"Deleted {deleted_count} documents for {len(serials)} ONTs")
+        return {
+            "deleted_count": deleted_count,
+            "onts_affected": serials
+        }
+
+    @staticmethod
+    async def delete_monitoring_data_async(building: Optional[str] = None,
+                                           floor: Optional[str] = None,
+                                           serial: Optional[str] = None) -> Dict[str, Any]:
+        logger.info(f"delete_monitoring_data_async called with building={building}, floor={floor}, serial={serial}")
+        await topology_cache.ensure_loaded_async()
+        serials = MonitoringService.serials_to_delete(building, floor, serial)
+        if not serials:
+            return {"deleted_count": 0, "onts_affected": []}
+
+        # Mismo recálculo de buckets que delete_monitoring_data, en un hilo para no bloquear el bucle
+        affected = await asyncio.to_thread(MonitoringRollupService.affected, serials) if MONITORING_ROLLUPS_ENABLED else None
+        result = await async_monitoring_data_collection.delete_many({field('serial'): {'$in': serials}})
+        if MONITORING_LATEST_ENABLED:
+            await async_collection(monitoring_latest_collection).delete_many({'_id': {'$in': serials}})
+        if affected:
+            await asyncio.to_thread(MonitoringRollupService.recompute, *affected)
+
+        logger.info(f"Deleted {result.deleted_count} documents for {len(serials)} ONTs")
+        return {
+            "deleted_count": result.deleted_count,
+            "onts_affected": serials
+        }
+
+    @staticmethod
+    def serials_to_delete(building: Optional[str] = None,
+                          floor: Optional[str] = None,
+                          serial: Optional[str] = None) -> List[str]:
         onts_to_query = []
         
         if serial:
@@ -39,22 +93,11 @@ class MonitoringService:
         
         if not onts_to_query:
             logger.warning("No ONTs found to delete data")
-            return {
-                "deleted_count": 0,
-                "onts_affected": []
-            }
+            return []
 
         serials = [ont['serial'] for ont in onts_to_query]
         logger.info(f"ONT serials to delete data: {serials}")
-        
-        result = monitoring_data_collection.delete_many({'serial': {'$in': serials}})
-        deleted_count = result.deleted_count
-        
-        logger.info(f"Deleted {deleted_count} documents for {len(serials)} ONTs")
-        return {
-            "deleted_count": deleted_count,
-            "onts_affected": serials
-        }
+        return serials
 
     @staticmethod
     def get_time_series_data(
@@ -65,23 +108,71 @@ class MonitoringService:
         end_date: Optional[datetime] = None,
         interval: str = 'hour'
     ) -> List[Dict]:
+        if MONITORING_ROLLUPS_ENABLED and MonitoringRollupService.ready():
+            logger.info(f"get_time_series_data from rollups with serial={serial}, floor={floor}, building={building}, start_date={start_date}, end_date={end_date}, interval={interval}")
+            return MonitoringRollupService.read(serial, floor, building, start_date, end_date, interval)
+        return MonitoringService.get_time_series_data_raw(serial, floor, building, start_date, end_date, interval)
+
+    @staticmethod
+    async def get_time_series_data_async(
+        serial: Optional[str] = None,
+        floor: Optional[str] = None,
+        building: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        interval: str = 'hour'
+    ) -> List[Dict]:
+        if MONITORING_ROLLUPS_ENABLED and await MonitoringRollupService.ready_async():
+            return await MonitoringRollupService.read_async(serial, floor, building, start_date, end_date, interval)
+        pipeline = MonitoringService.time_series_pipeline(serial, floor, building, start_date, end_date, interval)
+        results = await (await async_monitoring_data_collection.aggregate(pipeline)).to_list()
+        return MonitoringService.format_time_series(results)
+
+    @staticmethod
+    def get_time_series_data_raw(
+        serial: Optional[str] = None,
+        floor: Optional[str] = None,
+        building: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        interval: str = 'hour'
+    ) -> List[Dict]:
+        # Agregación sobre las lecturas sin procesar; también sirve para comprobar los rollups
         logger.info(f"get_time_series_data called with serial={serial}, floor={floor}, building={building}, start_date={start_date}, end_date={end_date}, interval={interval}")
-        
+        pipeline = MonitoringService.time_series_pipeline(serial, floor, building, start_date, end_date, interval)
+        logger.info(f"Executing MongoDB aggregation pipeline: {pipeline}")
+        results = list(monitoring_data_collection.aggregate(pipeline))
+        logger.info(f"Aggregation result count: {len(results)}")
+        formatted_results = MonitoringService.format_time_series(results)
+        logger.info(f"Returning {len(formatted_results)} time series data points")
+        return formatted_results
+
+    @staticmethod
+    def time_series_pipeline(
+        serial: Optional[str] = None,
+        floor: Optional[str] = None,
+        building: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        interval: str = 'hour',
+        after: Optional[datetime] = None
+    ) -> List[Dict]:
         match = {}
         if serial:
-            match['serial'] = serial
-        elif floor and building:
-            onts = ManagerService.get_onts_for_floor(building, floor)
-            match['serial'] = {'$in': [ont['serial'] for ont in onts]}
+            match[field('serial')] = serial
         elif building:
-            onts = ManagerService.get_onts_for_building(building)
-            match['serial'] = {'$in': [ont['serial'] for ont in onts]}
+            match.update(MonitoringService.location_match(building, floor))
         
         if start_date:
             match['timestamp'] = {'$gte': start_date}
         if end_date:
             match['timestamp'] = match.get('timestamp', {})
             match['timestamp']['$lte'] = end_date
+        if after:
+            # Paginación por clave: lecturas a partir del bucket siguiente al último entregado
+            resume = next_bucket(bucket_start(utc_naive(after), interval), interval)
+            match['timestamp'] = match.get('timestamp', {})
+            match['timestamp']['$gte'] = max(match['timestamp'].get('$gte', resume), resume)
 
         group_id = {
             'year': {'$year': '$timestamp'},
@@ -116,11 +207,36 @@ class MonitoringService:
             }},
             {'$sort': {'_id': 1}}
         ]
+        return pipeline
 
-        logger.info(f"Executing MongoDB aggregation pipeline: {pipeline}")
-        results = list(monitoring_data_collection.aggregate(pipeline))
-        logger.info(f"Aggregation result count: {len(results)}")
+    @staticmethod
+    async def stream_time_series(
+        serial: Optional[str] = None,
+        floor: Optional[str] = None,
+        building: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        interval: str = 'hour',
+        after: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> AsyncIterator[Tuple[datetime, Dict]]:
+        # Igual que get_time_series_data_async, pero punto a punto: (inicio del bucket, punto)
+        if MONITORING_ROLLUPS_ENABLED and await MonitoringRollupService.ready_async():
+            async for item in MonitoringRollupService.stream(serial, floor, building, start_date, end_date, interval, after, limit):
+                yield item
+            return
+
+        pipeline = MonitoringService.time_series_pipeline(serial, floor, building, start_date, end_date, interval, after)
+        if limit:
+            pipeline.append({'$limit': limit})
+        cursor = await async_monitoring_data_collection.aggregate(pipeline, allowDiskUse=True, batchSize=MONITORING_STREAM_BATCH_SIZE)
+        async for result in cursor:
+            group = result['_id']
+            start = datetime(group['year'], group['month'], group['day'], group.get('hour', 0), group.get('minute', 0))
+            yield start, MonitoringService.format_time_series([result])[0]
 
+    @staticmethod
+    def format_time_series(results: List[Dict]) -> List[Dict]:
         formatted_results = []
         for result in results:
             formatted_result = {
@@ -141,50 +257,122 @@ class MonitoringService:
             }
             formatted_results.append(formatted_result)
 
-        logger.info(f"Returning {len(formatted_results)} time series data points")
         return formatted_results
     @staticmethod
     def get_latest_values(serial: Optional[str] = None, 
                         floor: Optional[str] = None, 
                         building: Optional[str] = None) -> Dict:
         logger.info(f"get_latest_values called with serial={serial}, floor={floor}, building={building}")
-        
-        onts_to_query = []
-        
+        query = MonitoringService.latest_values_query(serial, floor, building)
+        if query is None:
+            return MonitoringService.empty_latest_values()
+        collection, pipeline = query
+        logger.info(f"Executing MongoDB aggregation pipeline on '{collection.name}': {pipeline}")
+        result = list(collection.aggregate(pipeline))
+        logger.info(f"Aggregation result: {result}")
+        return MonitoringService.format_latest_values(result, serial, floor, building)
+
+    @staticmethod
+    async def get_latest_values_async(serial: Optional[str] = None,
+                                      floor: Optional[str] = None,
+                                      building: Optional[str] = None) -> Dict:
+        # La lista de ONTs sale de la topología en memoria; nunca se lee con el cliente síncrono
+        await topology_cache.ensure_loaded_async()
+        query = MonitoringService.latest_values_query(serial, floor, building)
+        if query is None:
+            return MonitoringService.empty_latest_values()
+        collection, pipeline = query
+        result = await (await async_collection(collection).aggregate(pipeline)).to_list()
+        return MonitoringService.format_latest_values(result, serial, floor, building)
+
+    @staticmethod
+    def latest_values_query(serial: Optional[str] = None,
+                            floor: Optional[str] = None,
+                            building: Optional[str] = None):
+        # (colección, pipeline) de get_latest_values, o None si no hay ONTs que consultar
+        serials = None
         if serial:
-            onts_to_query = [{"serial": serial}]
+            serials = [serial]
             logger.info(f"Querying for single ONT with serial: {serial}")
-        elif floor and building:
-            onts_to_query = ManagerService.get_onts_for_floor(building, floor)
-            logger.info(f"Retrieved {len(onts_to_query)} ONTs for building '{building}', floor '{floor}'")
         elif building:
-            onts_to_query = ManagerService.get_onts_for_building(building)
-            logger.info(f"Retrieved {len(onts_to_query)} ONTs for building '{building}'")
+            # Edificio y piso se guardan en cada lectura al almacenarla
+            logger.info(f"Querying ONTs in building '{building}', floor '{floor}'")
         else:
             # Si no se proporciona ningún parámetro, obtener todas las ONTs
-            onts_to_query = ManagerService.get_all_onts()
-            logger.info(f"Retrieved {len(onts_to_query)} ONTs in total")
-        
-        if not onts_to_query:
-            logger.warning("No ONTs found to query")
-            return {
-                "timestamp": None,
-                "totalBytesReceived": 0,
-                "totalBytesSent": 0,
-                "totalWifiAssociations": 0,
-                "activeWANs": 0,
-                "activeWiFiInterfaces": 0,
-                "deviceCount": 0
-            }
+            serials = [ont['serial'] for ont in ManagerService.get_all_onts()]
+            logger.info(f"Retrieved {len(serials)} ONTs in total")
+            if not serials:
+                logger.warning("No ONTs found to query")
+                return None
 
-        serials = [ont['serial'] for ont in onts_to_query]
-        logger.info(f"ONT serials to query: {serials}")
-        
-        pipeline = [
-            {'$match': {'serial': {'$in': serials}}},
+        if MONITORING_LATEST_ENABLED:
+            # Un documento por ONT con sus métricas ya calculadas (_id = serial)
+            collection = monitoring_latest_collection
+            match = {'_id': {'$in': serials}} if serials is not None else MonitoringService.location_match(building, floor, path=str)
+            pipeline = [{'$match': match}]
+        else:
+            collection = monitoring_data_collection
+            match = {field('serial'): {'$in': serials}} if serials is not None else MonitoringService.location_match(building, floor)
+            pipeline = MonitoringService.latest_per_serial_pipeline(match)
+
+        pipeline.append({'$group': {
+            '_id': None,
+            'timestamp': {'$max': '$timestamp'},
+            'totalBytesReceived': {'$sum': '$totalBytesReceived'},
+            'totalBytesSent': {'$sum': '$totalBytesSent'},
+            'activeWANs': {'$sum': '$activeWANs'},
+            'totalWifiBytesReceived': {'$sum': '$totalWifiBytesReceived'},
+            'totalWifiBytesSent': {'$sum': '$totalWifiBytesSent'},
+            'activeWiFiInterfaces': {'$sum': '$activeWiFiInterfaces'},
+            'connectedHosts': {'$sum': '$connectedHosts'},
+            'failedConnections': {'$sum': '$failedConnections'},
+            'deviceCount': {'$sum': 1},
+            'avgTransceiverTemperature': {'$avg': '$transceiverTemperature'},
+            'avgRxPower': {'$avg': '$rxPower'},
+            'avgTxPower': {'$avg': '$txPower'},
+        }})
+        return collection, pipeline
+
+    @staticmethod
+    def empty_latest_values() -> Dict:
+        return {
+            "timestamp": None,
+            "totalBytesReceived": 0,
+            "totalBytesSent": 0,
+            "totalWifiAssociations": 0,
+            "activeWANs": 0,
+            "activeWiFiInterfaces": 0,
+            "deviceCount": 0
+        }
+
+    @staticmethod
+    def format_latest_values(result: List[Dict], serial: Optional[str] = None,
+                             floor: Optional[str] = None, building: Optional[str] = None) -> Dict:
+        if not result:
+            logger.warning("No results found from aggregation")
+            return MonitoringService.empty_latest_values()
+
+        latest_values = result[0]
+        latest_values['_id'] = building or floor or serial or "all"
+        logger.info(f"Returning latest values: {latest_values}")
+        return latest_values
+
+    @staticmethod
+    def location_match(building: str, floor: Optional[str] = None, path=field) -> Dict[str, Any]:
+        # Filtro por edificio (y piso) sobre los campos guardados en cada lectura
+        match = {path('building'): building}
+        if floor:
+            match[path('floor')] = floor
+        return match
+
+    @staticmethod
+    def latest_per_serial_pipeline(match: Dict[str, Any]) -> List[Dict]:
+        # Última lectura de cada ONT a partir del histórico completo
+        return [
+            {'$match': match},
             {'$sort': {'timestamp': -1}},
             {'$group': {
-                '_id': '$serial',
+                '_id': '$' + field('serial'),
                 'timestamp': {'$first': '$timestamp'},
                 'totalBytesReceived': {'$first': {'$sum': '$wans.bytesReceived'}},
                 'totalBytesSent': {'$first': {'$sum': '$wans.bytesSent'}},
@@ -216,43 +404,7 @@ class MonitoringService:
                 'rxPower': {'$first': '$gpon.rxPower'},
                 'txPower': {'$first': '$gpon.txPower'},
             }},
-            {'$group': {
-                '_id': None,
-                'timestamp': {'$max': '$timestamp'},
-                'totalBytesReceived': {'$sum': '$totalBytesReceived'},
-                'totalBytesSent': {'$sum': '$totalBytesSent'},
-                'activeWANs': {'$sum': '$activeWANs'},
-                'totalWifiBytesReceived': {'$sum': '$totalWifiBytesReceived'},
-                'totalWifiBytesSent': {'$sum': '$totalWifiBytesSent'},
-                'activeWiFiInterfaces': {'$sum': '$activeWiFiInterfaces'},
-                'connectedHosts': {'$sum': '$connectedHosts'},
-                'failedConnections': {'$sum': '$failedConnections'},
-                'deviceCount': {'$sum': 1},
-                'avgTransceiverTemperature': {'$avg': '$transceiverTemperature'},
-                'avgRxPower': {'$avg': '$rxPower'},
-                'avgTxPower': {'$avg': '$txPower'},
-            }}
         ]
-        logger.info(f"Executing MongoDB aggregation pipeline: {pipeline}")
-        result = list(monitoring_data_collection.aggregate(pipeline))
-        logger.info(f"Aggregation result: {result}")
-
-        if not result:
-            logger.warning("No results found from aggregation")
-            return {
-                "timestamp": None,
-                "totalBytesReceived": 0,
-                "totalBytesSent": 0,
-                "totalWifiAssociations": 0,
-                "activeWANs": 0,
-                "activeWiFiInterfaces": 0,
-                "deviceCount": 0
-            }
-
-        latest_values = result[0]
-        latest_values['_id'] = building or floor or serial or "all"
-        logger.info(f"Returning latest values: {latest_values}")
-        return latest_values
      
 
 
@@ -266,4 +418,15 @@ class MonitoringService:
 
     @staticmethod
     def update_monitoring_config(config: MonitoringConfig):
-        monitoring_config_collection.update_one({}, {"$set": config.dict()}, upsert=True)
\ No newline at end of file
+        monitoring_config_collection.update_one({}, {"$set": config.dict()}, upsert=True)
+
+    @staticmethod
+    async def get_monitoring_config_async():
+        config_data = await async_monitoring_config_collection.find_one()
+        if config_data:
+            return MonitoringConfig(**config_data)
+        return MonitoringConfig()
+
+    @staticmethod
+    async def update_monitoring_config_async(config: MonitoringConfig):
+        await async_monitoring_config_collection.update_one({}, {"$set": config.dict()}, upsert=True)
\ No newline at end of file
@@ -1,13 +1,157 @@
-import schedule
+import asyncio
+import logging
 import time
-from services.monitoring_service import MonitoringService
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import SCHEDULER_CONFIG_RELOAD, SCHEDULER_OVERLAP_POLICY, SCHEDULER_HISTORY
+from models.monitoring_model import MonitoringConfig
+from services.swh_service import SWHService
 from services.config_service import ConfigService
 
-def collect_data_job():
-    config = ConfigService.get_monitoring_config()
-    schedule.every(config.interval).seconds.do(MonitoringService.collect_and_store_ont_data)
+logger = logging.getLogger(__name__)
 
-def start_scheduler():
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
\ No newline at end of file
+
+class CollectionScheduler:
+    """Planificador asíncrono de la recogida de datos de las ONTs.
+
+    Los ticks caen en una rejilla fija (inicio + k * interval), así que la duración de cada
+    ejecución no acumula deriva. Si al llegar un tick la ejecución anterior sigue en marcha,
+    con la política "skip" el tick se descarta y con "coalesce" se ejecuta una sola vez al
+    terminar la anterior. MonitoringConfig se vuelve a leer cada SCHEDULER_CONFIG_RELOAD
+    segundos o al llamar a reload(), de modo que enabled e interval se aplican sin reiniciar.
+    """
+
+    def __init__(self, job: Callable[[], Awaitable[Any]] = SWHService.collect_and_store_ont_data_async,
+                 load_config: Callable[[], MonitoringConfig] = ConfigService.get_monitoring_config,
+                 overlap_policy=SCHEDULER_OVERLAP_POLICY, reload_interval=SCHEDULER_CONFIG_RELOAD):
+        if overlap_policy not in ("skip", "coalesce"):
+            raise ValueError(f"Unknown overlap policy: {overlap_policy}")
+        self.job = job
+        self.load_config = load_config
+        self.overlap_policy = overlap_policy
+        self.reload_interval = reload_interval
+        self.enabled = False
+        self.interval = None
+        self.next_run: Optional[datetime] = None
+        self._task = None
+        self._run_task = None
+        self._coalesced = False
+        self._wakeup = None
+        self._metrics = {'runs': 0, 'failures': 0, 'skipped': 0, 'coalesced': 0, 'last_started': None,
+                         'last_duration': None, 'max_duration': 0.0, 'total_duration': 0.0, 'last_error': None}
+        self._durations = deque(maxlen=SCHEDULER_HISTORY)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        for task in (self._task, self._run_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._run_task = None
+
+    def reload(self):
+        # Fuerza una nueva lectura de la configuración (p. ej. tras actualizarla por la API)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        runs = self._metrics['runs']
+        return {
+            **self._metrics,
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'running': self._run_task is not None and not self._run_task.done(),
+            'next_run': self.next_run,
+            'average_duration': self._metrics['total_duration'] / runs if runs else None,
+            'recent_durations': list(self._durations),
+        }
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        next_tick = None
+        while True:
+            try:
+                config = await asyncio.to_thread(self.load_config)
+            except Exception as e:
+                logger.error(f"Could not load monitoring config: {e}")
+                config = None
+
+            if config is not None:
+                if not config.enabled:
+                    next_tick = None
+                elif next_tick is None:
+                    next_tick = loop.time()
+                elif config.interval != self.interval:
+                    # Nuevo intervalo contado desde el último tick, no desde ahora
+                    next_tick += max(config.interval, 1) - self.interval
+                self.enabled = config.enabled
+                self.interval = max(config.interval, 1)
+
+            if next_tick is None:
+                self.next_run = None
+                await self._wait(self.reload_interval)
+                continue
+
+            now = loop.time()
+            if now < next_tick:
+                self.next_run = datetime.utcfromtimestamp(time.time() + next_tick - now)
+                await self._wait(min(next_tick - now, self.reload_interval))
+                continue
+
+            self._fire()
+            # Si el bucle llega tarde más de un intervalo, los ticks perdidos se cuentan como saltados
+            missed = int((now - next_tick) // self.interval)
+            self._metrics['skipped'] += missed
+            next_tick += (missed + 1) * self.interval
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _fire(self):
+        if self._run_task is not None and not self._run_task.done():
+            if self.overlap_policy == "coalesce":
+                self._coalesced = True
+                self._metrics['coalesced'] += 1
+            else:
+                self._metrics['skipped'] += 1
+            logger.warning("Data collection still running at the next tick")
+            return
+        self._run_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        started = time.perf_counter()
+        self._metrics['last_started'] = datetime.utcnow()
+        try:
+            await self.job()
+        except Exception as e:
+            self._metrics['failures'] += 1
+            self._metrics['last_error'] = str(e)
+            logger.error(f"Data collection failed: {e}")
+        finally:
+            duration = time.perf_counter() - started
+            self._metrics['runs'] += 1
+            self._metrics['last_duration'] = duration
+            self._metrics['max_duration'] = max(self._metrics['max_duration'], duration)
+            self._metrics['total_duration'] += duration
+            self._durations.append(duration)
+            logger.info(f"Data collection finished in {duration:.2f}s")
+
+        if self._coalesced:
+            self._coalesced = False
+            self._run_task = asyncio.create_task(self._run())
+
+
+collection_scheduler = CollectionScheduler()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import numpy as np
+from config import SIMULATION_CACHE_ENTRIES, SIMULATION_CACHE_DIR, SIMULATION_CACHE_MAX_DISK_MB
+
+logger = logging.getLogger(__name__)
+
+
+class SimulationCache:
+    """Caché de resultados de simulación direccionada por contenido.
+
+    La clave es un sha256 de la geometría, las ONTs, la escala y los parámetros, así que un
+    resultado sólo se reutiliza si todas las entradas coinciden. Hay un nivel en memoria (LRU)
+    y otro en disco (un .npz por resultado, expulsando los menos usados al superar el tamaño).
+    Los ficheros llevan una etiqueta del piso para poder invalidar un piso completo.
+    """
+
+    def __init__(self, max_entries=SIMULATION_CACHE_ENTRIES, directory=SIMULATION_CACHE_DIR, max_disk_mb=SIMULATION_CACHE_MAX_DISK_MB):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(geojson_data, onts, scale, parameters: Optional[Dict[str, Any]] = None) -> str:
+        # El orden de las ONTs no cambia el resultado, así que se ordenan por serial
+        onts = sorted(
+            ({'serial': ont['serial'], 'x': ont.get('x'), 'y': ont.get('y')} for ont in
+             (ont if isinstance(ont, dict) else ont.dict() for ont in onts)),
+            key=lambda ont: ont['serial']
+        )
+        payload = {
+            'geoJsonData': geojson_data or {},
+            'onts': onts,
+            'scale': scale,
+            'parameters': parameters or {},
+        }
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def floor_tag(building_name: str, floor_name: str) -> str:
+        return hashlib.sha256(f"{building_name}\0{floor_name}".encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, tag: str, key: str) -> str:
+        return os.path.join(self.directory, f"{tag}_{key}.npz")
+
+    def get(self, building_name: str, floor_name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+        tag = self.floor_tag(building_name, floor_name)
+        with self._lock:
+            entry = self._memory.get((tag, key))
+            if entry is not None:
+                self._memory.move_to_end((tag, key))
+                return entry
+
+        path = self._path(tag, key)
+        try:
+            with np.load(path) as data:
+                entry = {name: self._freeze(data[name]) for name in data.files}
+            os.utime(path)  # La fecha de modificación hace de marca LRU en disco
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+        self._remember(tag, key, entry)
+        return entry
+
+    def put(self, building_name: str, floor_name: str, key: str, arrays: Dict[str, np.ndarray]):
+        tag = self.floor_tag(building_name, floor_name)
+        entry = {name: self._freeze(np.array(array)) for name, array in arrays.items()}
+        self._remember(tag, key, entry)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Escritura atómica: otro proceso nunca ve un .npz a medias
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **entry)
+            os.replace(tmp_path, self._path(tag, key))
+            self._evict_disk()
+        except OSError as e:
+            logger.warning(f"Could not write simulation cache entry: {e}")
+
+    def invalidate_floor(self, building_name: str, floor_name: str):
+        tag = self.floor_tag(building_name, floor_name)
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._memory if cache_key[0] == tag]:
+                del self._memory[cache_key]
+        for name in self._disk_files():
+            if name.startswith(f"{tag}_"):
+                self._remove(name)
+        logger.info(f"Simulation cache invalidated for building '{building_name}', floor '{floor_name}'")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for name in self._disk_files():
+            self._remove(name)
+
+    def _remember(self, tag, key, entry):
+        with self._lock:
+            self._memory[(tag, key)] = entry
+            self._memory.move_to_end((tag, key))
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_files(self):
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith('.npz')]
+        except FileNotFoundError:
+            return []
+
+    def _evict_disk(self):
+        files = []
+        for name in self._disk_files():
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+        total = sum(size for _, _, size in files)
+        for _, name, size in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(name)
+            total -= size
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _freeze(array):
+        # Las entradas se comparten entre peticiones, así que no deben modificarse
+        array.setflags(write=False)
+        return array
+
+
+simulation_cache = SimulationCache()
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import uuid
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import SIMULATION_MAX_JOBS, SIMULATION_JOB_WORKERS, SIMULATION_JOB_HISTORY
+from models.simulation_model import Simulation
+from services.simulation_service import SimulationService, _heatmap_tile
+from services.simulation_store import SimulationStore
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class SimulationCancelled(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, simulation: Simulation, owner):
+        self.simulation = simulation
+        self.owner = owner
+        self.task = None
+        self.future = None
+        self.cancelled = threading.Event()
+        self.saving = None  # Última escritura en SimulationStore; cada una espera a la anterior
+
+
+class SimulationJobs:
+    """Trabajos de simulación ejecutados fuera del bucle de eventos.
+
+    Cada trabajo recorre las etapas de SimulationService.stream_simulation en un hilo y calcula
+    cada tesela en un pool de procesos, así que el bucle de eventos sólo reenvía eventos. Como
+    mucho max_jobs trabajos se ejecutan a la vez; el resto espera en estado pending. Cancelar un
+    trabajo descarta las etapas que faltan (la tesela en curso termina, pero no se emite).
+    Cada cambio de estado se guarda con SimulationStore, y la rejilla final, en GridFS.
+    """
+
+    def __init__(self, max_jobs=SIMULATION_MAX_JOBS, workers=SIMULATION_JOB_WORKERS, history=SIMULATION_JOB_HISTORY):
+        self.max_jobs = max_jobs
+        self.workers = workers
+        self.history = history
+        self.service = SimulationService()
+        self._jobs: Dict[str, _Job] = OrderedDict()
+        self._semaphore = None
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: el servidor tiene hilos y un cliente de Mongo abiertos, que no deben heredarse con fork
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, building_name, floor_name, parameters: Dict[str, Any],
+               emit: Callable[[str, Dict[str, Any]], Awaitable[None]], owner=None,
+               progressive=False, response_format='records') -> Simulation:
+        simulation = Simulation(id=uuid.uuid4().hex, building_name=building_name, floor_name=floor_name, parameters=parameters)
+        job = _Job(simulation, owner)
+        self._jobs[simulation.id] = job
+        self._forget_finished()
+        self._persist(job)
+        job.task = asyncio.create_task(self._run(job, emit, progressive, response_format))
+        return simulation
+
+    def get(self, simulation_id) -> Optional[Simulation]:
+        # Sólo los trabajos de este servidor; los guardados se leen con SimulationStore
+        job = self._jobs.get(simulation_id)
+        return job.simulation if job else None
+
+    def list_jobs(self, owner=None) -> List[Simulation]:
+        return [job.simulation for job in self._jobs.values() if owner is None or job.owner == owner]
+
+    def cancel(self, simulation_id, owner=None) -> bool:
+        job = self._jobs.get(simulation_id)
+        if job is None or (owner is not None and job.owner != owner) or job.simulation.status in FINISHED_STATUSES:
+            return False
+        job.simulation.status = "cancelled"
+        job.simulation.finished_at = datetime.utcnow()
+        job.cancelled.set()
+        if job.future is not None:
+            job.future.cancel()
+        job.task.cancel()
+        self._persist(job)
+        logger.info(f"Simulation {simulation_id} cancelled")
+        return True
+
+    def cancel_owner(self, owner) -> int:
+        return sum(self.cancel(job.simulation.id) for job in list(self._jobs.values()) if job.owner == owner)
+
+    async def shutdown(self):
+        for job in list(self._jobs.values()):
+            self.cancel(job.simulation.id)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        # Que el último estado de cada trabajo quede guardado antes de salir
+        pending = [job.saving for job in self._jobs.values() if job.saving is not None]
+        if pending:
+            await asyncio.gather(*pending)
+
+    def _persist(self, job: _Job):
+        # Escritura en segundo plano para no bloquear el bucle de eventos. Se guarda una copia del
+        # estado actual y las escrituras de un trabajo se encadenan, así que llegan en orden
+        snapshot = job.simulation.copy(deep=True)
+        previous = job.saving
+
+        async def save():
+            if previous is not None:
+                await previous
+            try:
+                await asyncio.to_thread(SimulationStore.save, snapshot)
+            except Exception as e:
+                logger.error(f"Could not save simulation {snapshot.id}: {e}")
+
+        job.saving = asyncio.create_task(save())
+
+    def _save_grid(self, job: _Job):
+        # Se ejecuta en el hilo del trabajo con la rejilla completa
+        def save(x_values, y_values, values):
+            SimulationStore.save_grid(job.simulation, x_values, y_values, values, self.service.HEATMAP_RESOLUTION)
+        return save
+
+    def _compute_tile(self, job: _Job):
+        # Se ejecuta en el hilo del trabajo: envía la tesela al pool y espera su resultado
+        def compute(shared, tile):
+            if job.cancelled.is_set():
+                raise SimulationCancelled()
+            job.future = self._pool().submit(_heatmap_tile, shared, tile)
+            return job.future.result()
+        return compute
+
+    async def _run(self, job: _Job, emit, progressive, response_format):
+        simulation = job.simulation
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        try:
+            async with self._semaphore:
+                simulation.status = "running"
+                self._persist(job)
+                events = self.service.stream_simulation(
+                    simulation.id, simulation.building_name, simulation.floor_name, simulation.parameters.dict(),
+                    progressive=progressive, response_format=response_format,
+                    compute_tile=self._compute_tile(job), on_grid=self._save_grid(job)
+                )
+                while True:
+                    event = await asyncio.to_thread(next, events, None)
+                    if event is None:
+                        break
+                    name, payload = event
+                    if name in ('simulation_complete', 'simulation_error'):
+                        simulation.status = "completed" if name == 'simulation_complete' else "failed"
+                        simulation.error = payload.get('error')
+                        simulation.finished_at = datetime.utcnow()
+                        self._persist(job)
+                    await emit(name, payload)
+        except asyncio.CancelledError:
+            simulation.status = "cancelled"
+            raise
+        except Exception as e:
+            if job.cancelled.is_set():
+                return
+            simulation.status = "failed"
+            simulation.error = str(e)
+            simulation.finished_at = datetime.utcnow()
+            self._persist(job)
+            logger.error(f"Simulation {simulation.id} failed for building: {simulation.building_name}, floor: {simulation.floor_name}: {e}")
+            await emit('simulation_error', {'simulation_id': simulation.id, 'error': str(e)})
+
+    def _forget_finished(self):
+        # Un trabajo terminado no se olvida hasta que su última escritura ha llegado a Mongo
+        finished = [simulation_id for simulation_id, job in self._jobs.items()
+                    if job.simulation.status in FINISHED_STATUSES and (job.saving is None or job.saving.done())]
+        for simulation_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[simulation_id]
+
+
+simulation_jobs = SimulationJobs()
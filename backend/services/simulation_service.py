@@ -1,13 +1,44 @@
 import numpy as np
 import math
-from typing import List
+import base64
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any
+from config import SIMULATION_MEMORY_BUDGET_MB, SIMULATION_WORKERS, SIMULATION_TILE_SIZE, SIMULATION_COVERAGE_MAX_MB, SIMULATION_STREAM_COARSE_POINTS
 from models.manager_model import ONTPosition
+from services.manager_service import ManagerService
+from services.simulation_cache import simulation_cache
+from signal_strength_simulation.spatial_index import UniformGridIndex
+from signal_strength_simulation import parallel
+
+class CoverageLayers:
+    # Potencia de cada ONT de un piso sobre la rejilla del mapa de calor. El mapa completo es el
+    # máximo entre capas, así que mover, añadir o quitar una ONT sólo recalcula su capa.
+    def __init__(self, grid_key, x_values, y_values):
+        self.grid_key = grid_key
+        self.shape = (len(y_values), len(x_values))
+        grid_x, grid_y = np.meshgrid(x_values, y_values)
+        self.grid_points = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+        self.layers = {}  # (serial, n) -> ((x, y), potencia por punto en float32)
+        self.lock = threading.Lock()
+        self.nbytes = self.grid_points.nbytes
+
+    def layer_nbytes(self):
+        return len(self.grid_points) * np.dtype(np.float32).itemsize
+
+
+# Capas por piso, compartidas por todas las instancias del servicio
+_coverage_layers = OrderedDict()
+_coverage_layers_lock = threading.Lock()
+
 
 class SimulationService:
     def __init__(self):
         self.NUM_RAYS = 360
         self.NUM_REFLECTIONS = 3
         self.MAX_DISTANCE = 1000  # Ajustado para escala de píxeles
+        self.HEATMAP_RESOLUTION = 10  # Paso de la rejilla del mapa de calor en unidades del plano
+        self.SPATIAL_INDEX_MIN_WALLS = 1000  # Por debajo, el collider vectorizado sobre todas las paredes es más rápido
 
     def process_geojson(self, geojson_data):
         walls = []
@@ -25,7 +56,44 @@ class SimulationService:
     def linestring_to_lines(self, linestring):
         return [np.array([linestring[i], linestring[i+1]]) for i in range(len(linestring)-1)]
 
-    def generate_rays(self, origin, walls_points):
+    def find_nearest_wall(self, walls_points, wall_index, ro, rd, last_wall_index):
+        # Devuelve (índice, punto, normal) de la pared más cercana o None
+        if wall_index is not None:
+            def intersect(indices):
+                indices = np.array([i for i in indices if i != last_wall_index], dtype=int)
+                if len(indices) == 0:
+                    return
+                points, valid, t, normals = self.collider(walls_points[indices], np.array([ro]), np.array([rd]))
+                for k in np.nonzero(valid[0])[0]:
+                    yield int(indices[k]), t[0][k], (points[0][k], normals[k])
+
+            index, _, hit = wall_index.closest_hit(ro, rd, intersect)
+            return (index, hit[0], hit[1]) if index >= 0 else None
+
+        intersection_points, valid_intersections, t, wall_normals = self.collider(walls_points, np.array([ro]), np.array([rd]))
+
+        if last_wall_index != -1:
+            valid_intersections[0][last_wall_index] = False
+
+        valid_points = intersection_points[0][valid_intersections[0]]
+        valid_t = t[0][valid_intersections[0]]
+
+        if len(valid_points) == 0:
+            return None
+        nearest_index = np.argmin(valid_t)
+        return (
+            np.where(valid_intersections[0])[0][nearest_index],
+            valid_points[nearest_index],
+            wall_normals[valid_intersections[0]][nearest_index]
+        )
+
+    def generate_rays(self, origin, walls_points, use_spatial_index=None):
+        walls_points = np.asarray(walls_points, dtype=float)
+        if use_spatial_index is None:
+            use_spatial_index = len(walls_points) >= self.SPATIAL_INDEX_MIN_WALLS
+        # El índice espacial se construye una vez y lo comparten todos los rayos
+        wall_index = UniformGridIndex(walls_points) if use_spatial_index else None
+
         angles = np.linspace(0, 2 * np.pi, self.NUM_RAYS, endpoint=False)
         directions = np.column_stack((np.cos(angles), np.sin(angles)))
 
@@ -42,18 +110,10 @@ class SimulationService:
             for _ in range(self.NUM_REFLECTIONS + 1):
                 end_point = ro + self.MAX_DISTANCE * rd
 
-                intersection_points, valid_intersections, t, wall_normals = self.collider(walls_points, np.array([ro]), np.array([rd]))
-
-                if last_wall_index != -1:
-                    valid_intersections[0][last_wall_index] = False
+                nearest = self.find_nearest_wall(walls_points, wall_index, ro, rd, last_wall_index)
 
-                valid_points = intersection_points[0][valid_intersections[0]]
-                valid_t = t[0][valid_intersections[0]]
-
-                if len(valid_points) > 0:
-                    nearest_index = np.argmin(valid_t)
-                    nearest_point = valid_points[nearest_index]
-                    nearest_normal = wall_normals[valid_intersections[0]][nearest_index]
+                if nearest is not None:
+                    last_wall_index, nearest_point, nearest_normal = nearest
 
                     ray_segments.append((amplitude, ro, nearest_point))
 
@@ -64,8 +124,6 @@ class SimulationService:
                     ro = nearest_point
                     rd = rd - 2 * np.dot(rd, nearest_normal) * nearest_normal
                     amplitude *= 0.75
-
-                    last_wall_index = np.where(valid_intersections[0])[0][nearest_index]
                 else:
                     ray_segments.append((amplitude, ro, end_point))
                     break
@@ -107,37 +165,272 @@ class SimulationService:
         power_watts = 10 ** ((power_dbm - 30) / 10)
         return power_watts
 
-    def run_simulation(self, geojson_data, onts: List[ONTPosition], scale):
+    def signal_strength_from_distance(self, distance):
+        # Versión vectorizada de calculate_signal_strength sobre distancias ya escaladas
+        with np.errstate(divide='ignore'):
+            power_dbm = np.maximum(-100, -20 * np.log10(distance) - 40)
+        return np.power(10, (power_dbm - 30) / 10)
+
+    def heatmap_chunk_size(self, num_onts):
+        # Puntos por bloque para que la matriz puntos×ONTs (dx, dy, distancia) quepa en el presupuesto
+        bytes_per_point = 3 * 8 * max(num_onts, 1)
+        return max(1, (SIMULATION_MEMORY_BUDGET_MB * 1024 * 1024) // bytes_per_point)
+
+    def ont_origins(self, onts: List[ONTPosition]):
+        return np.array(
+            [[ont.x, ont.y] for ont in onts if ont.x is not None and ont.y is not None],
+            dtype=float
+        ).reshape(-1, 2)
+
+    def compute_heatmap(self, grid_points, onts: List[ONTPosition], scale):
+        return self.compute_heatmap_from_origins(grid_points, self.ont_origins(onts), scale)
+
+    def compute_heatmap_from_origins(self, grid_points, origins, scale):
+        max_power = np.full(len(grid_points), -np.inf)
+        if len(origins) == 0:
+            return max_power
+
+        # La potencia decrece con la distancia, así que el máximo por punto es la potencia de la ONT más cercana
+        chunk_size = self.heatmap_chunk_size(len(origins))
+        for start in range(0, len(grid_points), chunk_size):
+            block = grid_points[start:start + chunk_size]
+            diff = block[:, np.newaxis, :] - origins[np.newaxis, :, :]
+            distances = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff)) * scale
+            max_power[start:start + chunk_size] = self.signal_strength_from_distance(distances.min(axis=1))
+        return max_power
+
+    def heatmap_axes(self, geojson_data, resolution=10):
         self.walls_points = self.process_geojson(geojson_data)
-        
+
         all_coords = np.vstack(self.walls_points)
         min_x, min_y = np.min(all_coords, axis=0)
         max_x, max_y = np.max(all_coords, axis=0)
 
-        resolution = 10  # Ajustar según necesidad
-        x_values = np.arange(min_x, max_x, resolution)
-        y_values = np.arange(min_y, max_y, resolution)
+        return np.arange(min_x, max_x, resolution), np.arange(min_y, max_y, resolution)
+
+    def compute_heatmap_grid(self, geojson_data, onts: List[ONTPosition], scale, resolution=10, workers=None):
+        x_values, y_values = self.heatmap_axes(geojson_data, resolution)
+
+        # Cada punto es independiente, así que las teselas dan exactamente el mismo resultado
+        workers = SIMULATION_WORKERS if workers is None else workers
+        shape = (len(y_values), len(x_values))
+        tiles = parallel.grid_tiles(shape, SIMULATION_TILE_SIZE) if workers > 1 else [(slice(None), slice(None))]
+        shared = {'x_values': x_values, 'y_values': y_values, 'origins': self.ont_origins(onts), 'scale': scale}
+        blocks = parallel.map_tiles(_heatmap_tile, tiles, shared, workers)
+        values = parallel.merge_tiles(shape, tiles, blocks)
+        return x_values, y_values, values
+
+    def coverage_layers(self, building_name, floor_name, grid_key, x_values, y_values) -> CoverageLayers:
+        # Capas del piso; se descartan si cambia la rejilla (geometría, escala o resolución)
+        with _coverage_layers_lock:
+            floor = _coverage_layers.get((building_name, floor_name))
+            if floor is None or floor.grid_key != grid_key:
+                floor = CoverageLayers(grid_key, x_values, y_values)
+                _coverage_layers[(building_name, floor_name)] = floor
+            _coverage_layers.move_to_end((building_name, floor_name))
+        return floor
+
+    def trim_coverage_layers(self):
+        # Expulsa los pisos menos usados hasta que el total de capas quepa en el presupuesto
+        budget = SIMULATION_COVERAGE_MAX_MB * 1024 * 1024
+        with _coverage_layers_lock:
+            total = sum(floor.nbytes for floor in _coverage_layers.values())
+            while total > budget and _coverage_layers:
+                _, floor = _coverage_layers.popitem(last=False)
+                total -= floor.nbytes
+
+    def incremental_heatmap_grid(self, building_name, floor_name, geojson_data, onts: List[ONTPosition], scale, resolution=10):
+        # Mismo resultado que compute_heatmap_grid (en float32), recalculando sólo las capas de las ONTs que han cambiado
+        x_values, y_values = self.heatmap_axes(geojson_data, resolution)
+
+        positions = {}
+        occurrences = {}
+        for ont in onts:
+            if ont.x is None or ont.y is None:
+                continue
+            n = occurrences.get(ont.serial, 0)
+            occurrences[ont.serial] = n + 1
+            positions[(ont.serial, n)] = (float(ont.x), float(ont.y))
+
+        # Si las capas del piso (más la rejilla y el mapa resultante) no caben en el presupuesto no
+        # se guardan: se calcula el mapa completo
+        num_points = len(x_values) * len(y_values)
+        if num_points * (16 + 4 * (len(positions) + 1)) > SIMULATION_COVERAGE_MAX_MB * 1024 * 1024:
+            with _coverage_layers_lock:
+                _coverage_layers.pop((building_name, floor_name), None)
+            x_values, y_values, values = self.compute_heatmap_grid(geojson_data, onts, scale, resolution)
+            return x_values, y_values, values.astype(np.float32)
+
+        grid_key = simulation_cache.make_key(geojson_data, [], scale, {'kind': 'grid', 'resolution': resolution})
+        floor = self.coverage_layers(building_name, floor_name, grid_key, x_values, y_values)
+
+        with floor.lock:
+            for key in [key for key in floor.layers if key not in positions]:
+                del floor.layers[key]
+            for key, position in positions.items():
+                layer = floor.layers.get(key)
+                if layer is None or layer[0] != position:
+                    power = self.compute_heatmap_from_origins(floor.grid_points, np.array([position], dtype=float), scale)
+                    floor.layers[key] = (position, power.astype(np.float32))
+            floor.nbytes = floor.grid_points.nbytes + len(floor.layers) * floor.layer_nbytes()
+
+            # Máximo acumulado sobre un único array: sin apilar antes todas las capas
+            values = np.full(len(floor.grid_points), -np.inf, dtype=np.float32)
+            for _, power in floor.layers.values():
+                np.maximum(values, power, out=values)
+        self.trim_coverage_layers()
+        return x_values, y_values, values.reshape(floor.shape)
+
+    def heatmap_to_records(self, x_values, y_values, values):
         grid_x, grid_y = np.meshgrid(x_values, y_values)
-        grid_points = np.column_stack((grid_x.ravel(), grid_y.ravel()))
-
-        heatmap_data = []
-        for point in grid_points:
-            max_signal = -float('inf')
-            for ont in onts:
-                origin = np.array([ont.x, ont.y])
-                signal = self.calculate_signal_strength(origin, point, scale)
-                max_signal = max(max_signal, signal)
-            heatmap_data.append({
-                'lng': float(point[0]),
-                'lat': float(point[1]),
-                'value': float(max_signal)
-            })
+        return [
+            {'lng': lng, 'lat': lat, 'value': value}
+            for lng, lat, value in zip(
+                grid_x.ravel().astype(float).tolist(), grid_y.ravel().astype(float).tolist(), values.ravel().tolist()
+            )
+        ]
+
+    def heatmap_to_bytes(self, values):
+        # Valores float32 little-endian en orden fila a fila (lat, luego lng)
+        return np.ascontiguousarray(values, dtype='<f4').tobytes()
+
+    def heatmap_layout(self, x_values, y_values, resolution):
+        return {
+            'origin': [float(x_values[0]) if len(x_values) else 0.0, float(y_values[0]) if len(y_values) else 0.0],
+            'step': [float(resolution), float(resolution)],
+            'shape': [len(y_values), len(x_values)]
+        }
 
+    def heatmap_to_columnar(self, x_values, y_values, values, resolution):
         return {
-            'heatmapData': heatmap_data,
+            **self.heatmap_layout(x_values, y_values, resolution),
+            'dtype': 'float32',
+            'byteOrder': 'little',
+            'encoding': 'base64',
+            'values': base64.b64encode(self.heatmap_to_bytes(values)).decode('ascii')
+        }
+
+    def heatmap_cache_key(self, geojson_data, onts: List[ONTPosition], scale, parameters: Optional[Dict[str, Any]] = None):
+        return simulation_cache.make_key(geojson_data, onts, scale, {**(parameters or {}), 'kind': 'heatmap', 'resolution': self.HEATMAP_RESOLUTION})
+
+    def cached_heatmap_grid(self, building_name, floor_name, geojson_data, onts: List[ONTPosition], scale,
+                            parameters: Optional[Dict[str, Any]] = None):
+        # Mismo resultado que compute_heatmap_grid, reutilizado si la geometría, las ONTs, la escala
+        # y los parámetros no han cambiado
+        resolution = self.HEATMAP_RESOLUTION
+        key = self.heatmap_cache_key(geojson_data, onts, scale, parameters)
+        cached = simulation_cache.get(building_name, floor_name, key)
+        if cached is not None:
+            return cached['x_values'], cached['y_values'], cached['values']
+
+        x_values, y_values, values = self.incremental_heatmap_grid(building_name, floor_name, geojson_data, onts, scale, resolution)
+        simulation_cache.put(building_name, floor_name, key, {'x_values': x_values, 'y_values': y_values, 'values': values})
+        return x_values, y_values, values
+
+    def run_simulation(self, geojson_data, onts: List[ONTPosition], scale, response_format='records',
+                       building_name=None, floor_name=None, parameters: Optional[Dict[str, Any]] = None):
+        resolution = self.HEATMAP_RESOLUTION
+        if building_name and floor_name:
+            x_values, y_values, values = self.cached_heatmap_grid(building_name, floor_name, geojson_data, onts, scale, parameters)
+        else:
+            x_values, y_values, values = self.compute_heatmap_grid(geojson_data, onts, scale, resolution)
+        return self.simulation_result(geojson_data, onts, x_values, y_values, values, resolution, response_format)
+
+    def simulation_result(self, geojson_data, onts: List[ONTPosition], x_values, y_values, values, resolution, response_format='records'):
+        result = {
             'geoJsonData': geojson_data,
             'onts': [{'serial': ont.serial, 'x': ont.x, 'y': ont.y} for ont in onts]
         }
+        if response_format == 'columnar':
+            result['heatmap'] = self.heatmap_to_columnar(x_values, y_values, values, resolution)
+        else:
+            result['heatmapData'] = self.heatmap_to_records(x_values, y_values, values)
+        return result
+
+    def load_floor(self, building_name, floor_name):
+        # (geojson, onts, escala) de un piso guardado, o None si no existe
+        floor_data = ManagerService.get_floor_by_name(building_name, floor_name)
+        if not floor_data:
+            return None
+
+        geojson_data = floor_data.geoJsonData if floor_data.geoJsonData else {}
+        onts = floor_data.onts if floor_data.onts else []
+        scale = floor_data.scale if floor_data.scale else 1.0
+        return geojson_data, onts, scale
+
+    def simulate_floor(self, building_name, floor_name, parameters: Optional[Dict[str, Any]] = None, response_format='records'):
+        # Simulación completa de un piso guardado; devuelve None si el piso no existe
+        floor = self.load_floor(building_name, floor_name)
+        if floor is None:
+            return None
+        geojson_data, onts, scale = floor
+        return self.run_simulation(geojson_data, onts, scale, response_format, building_name, floor_name, parameters)
+
+    def heatmap_stage_plan(self, shape, progressive=True):
+        # Etapas de la simulación progresiva: primero toda la rejilla submuestreada (como mucho
+        # SIMULATION_STREAM_COARSE_POINTS puntos) y después las teselas a resolución completa
+        rows, cols = shape
+        stride = max(1, math.ceil(math.sqrt(rows * cols / SIMULATION_STREAM_COARSE_POINTS)))
+        stages = []
+        if progressive and stride > 1:
+            stages.append(('coarse', (slice(0, rows, stride), slice(0, cols, stride))))
+        stages.extend(('tile', tile) for tile in parallel.grid_tiles(shape, SIMULATION_TILE_SIZE))
+        return stages
+
+    def stream_simulation(self, simulation_id, building_name, floor_name, parameters: Optional[Dict[str, Any]] = None,
+                          progressive=True, response_format='columnar', compute_tile=None, on_grid=None):
+        """Genera los eventos (nombre, datos) de una simulación progresiva de un piso.
+
+        Cada etapa produce un simulation_partial con su bloque en formato columnar (origen y paso
+        propios) y un simulation_progress; al final se emite simulation_complete con el mapa
+        completo. Si el resultado ya está en caché sólo se emite el final. Con progressive=False
+        no hay etapa de baja resolución ni simulation_partial. compute_tile(shared, tile) permite
+        calcular cada etapa en otro proceso (por defecto, en el actual) y on_grid(x, y, valores)
+        recibe la rejilla completa antes del evento final.
+        """
+        compute_tile = compute_tile or _heatmap_tile
+        floor = self.load_floor(building_name, floor_name)
+        if floor is None:
+            yield 'simulation_error', {'simulation_id': simulation_id, 'error': 'Floor not found'}
+            return
+        geojson_data, onts, scale = floor
+        resolution = self.HEATMAP_RESOLUTION
+
+        key = self.heatmap_cache_key(geojson_data, onts, scale, parameters)
+        cached = simulation_cache.get(building_name, floor_name, key)
+        if cached is not None:
+            x_values, y_values, values = cached['x_values'], cached['y_values'], cached['values']
+        else:
+            x_values, y_values = self.heatmap_axes(geojson_data, resolution)
+            shape = (len(y_values), len(x_values))
+            shared = {'x_values': x_values, 'y_values': y_values, 'origins': self.ont_origins(onts), 'scale': scale}
+            stages = self.heatmap_stage_plan(shape, progressive)
+            values = np.empty(shape)
+
+            for index, (kind, tile) in enumerate(stages):
+                block = compute_tile(shared, tile)
+                rows, cols = tile
+                if kind == 'tile':
+                    values[rows, cols] = block
+                if progressive:
+                    stride = rows.step or 1
+                    yield 'simulation_partial', {
+                        'simulation_id': simulation_id,
+                        'stage': index,
+                        'stages': len(stages),
+                        'kind': kind,
+                        **self.heatmap_to_columnar(x_values[cols], y_values[rows], block, resolution * stride)
+                    }
+                yield 'simulation_progress', {'simulation_id': simulation_id, 'progress': (index + 1) / len(stages)}
+
+            simulation_cache.put(building_name, floor_name, key, {'x_values': x_values, 'y_values': y_values, 'values': values})
+
+        if on_grid is not None:
+            on_grid(x_values, y_values, values)
+        yield 'simulation_complete', {
+            'simulation_id': simulation_id,
+            'result': self.simulation_result(geojson_data, onts, x_values, y_values, values, resolution, response_format)
+        }
 
     def allocate_wifi_channels(self, onts: List[ONTPosition]):
         channels = [1, 6, 11]  # Canales no superpuestos en 2.4 GHz
@@ -154,3 +447,11 @@ class SimulationService:
                 'signalStrength': np.random.randint(-80, -30)
             })
         return allocation
+
+
+def _heatmap_tile(shared, tile):
+    rows, cols = tile
+    grid_x, grid_y = np.meshgrid(shared['x_values'][cols], shared['y_values'][rows])
+    grid_points = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    values = SimulationService().compute_heatmap_from_origins(grid_points, shared['origins'], shared['scale'])
+    return values.reshape(grid_x.shape)
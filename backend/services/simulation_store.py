@@ -0,0 +1,85 @@
+from typing import List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from gridfs.errors import NoFile
+from database.mongo import simulations_collection, simulation_grids
+from models.simulation_model import Simulation, SimulationGrid
+
+GRID_DTYPE = np.dtype('<f4')
+
+
+class SimulationStore:
+    # Los metadatos de cada simulación van en la colección simulations (_id = id de la simulación)
+    # y la rejilla de received_power, en GridFS, para poder leer sólo un rango de filas
+
+    @staticmethod
+    def save(simulation: Simulation):
+        document = simulation.dict(exclude={'result'})
+        simulations_collection.replace_one({"_id": simulation.id}, {"_id": simulation.id, **document}, upsert=True)
+
+    @staticmethod
+    def save_grid(simulation: Simulation, x_values, y_values, values, resolution) -> SimulationGrid:
+        values = np.ascontiguousarray(values, dtype=GRID_DTYPE)
+        file_id = simulation_grids.put(
+            values.tobytes(),
+            filename=f"{simulation.id}.f32",
+            simulation_id=simulation.id,
+            building_name=simulation.building_name,
+            floor_name=simulation.floor_name
+        )
+        simulation.grid = SimulationGrid(
+            file_id=str(file_id),
+            origin=[float(x_values[0]) if len(x_values) else 0.0, float(y_values[0]) if len(y_values) else 0.0],
+            step=[float(resolution), float(resolution)],
+            shape=list(values.shape)
+        )
+        return simulation.grid
+
+    @staticmethod
+    def get(simulation_id: str) -> Optional[Simulation]:
+        document = simulations_collection.find_one({"_id": simulation_id})
+        return Simulation(**document) if document else None
+
+    @staticmethod
+    def list_by_floor(building_name: str, floor_name: str, limit: int = 20) -> List[Simulation]:
+        documents = simulations_collection.find(
+            {"building_name": building_name, "floor_name": floor_name}
+        ).sort("created_at", -1).limit(limit)
+        return [Simulation(**document) for document in documents]
+
+    @staticmethod
+    def read_grid(simulation: Simulation, rows: slice = slice(None), cols: slice = slice(None)) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Lee el rectángulo [rows, cols] de la rejilla guardada y devuelve (x_values, y_values, values).
+
+        Sólo se descargan de GridFS las filas del rango; las columnas se recortan en memoria.
+        """
+        grid = simulation.grid
+        if grid is None:
+            return None
+        height, width = grid.shape
+        row_start, row_stop, _ = rows.indices(height)
+        col_start, col_stop, _ = cols.indices(width)
+        row_stop = max(row_stop, row_start)
+        col_stop = max(col_stop, col_start)
+
+        try:
+            with simulation_grids.get(ObjectId(grid.file_id)) as grid_file:
+                grid_file.seek(row_start * width * GRID_DTYPE.itemsize)
+                data = grid_file.read((row_stop - row_start) * width * GRID_DTYPE.itemsize)
+        except NoFile:
+            return None
+
+        values = np.frombuffer(data, dtype=GRID_DTYPE).reshape(row_stop - row_start, width)[:, col_start:col_stop]
+        x_values = grid.origin[0] + grid.step[0] * np.arange(col_start, col_stop)
+        y_values = grid.origin[1] + grid.step[1] * np.arange(row_start, row_stop)
+        return x_values, y_values, values
+
+    @staticmethod
+    def delete(simulation_id: str) -> bool:
+        simulation = SimulationStore.get(simulation_id)
+        if simulation is None:
+            return False
+        if simulation.grid is not None:
+            simulation_grids.delete(ObjectId(simulation.grid.file_id))
+        simulations_collection.delete_one({"_id": simulation_id})
+        return True
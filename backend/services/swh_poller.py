@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+import httpx
+from config import (SWH_API_URL, SWH_API_USERNAME, SWH_API_PASSWORD, SWH_POLL_CONCURRENCY, SWH_REQUEST_TIMEOUT,
+                    SWH_MAX_RETRIES, SWH_RETRY_BASE_DELAY, SWH_POLL_BATCH_SIZE, MONITORING_INGEST_MAX_ERRORS)
+from services.monitoring_ingest import MonitoringIngestService
+
+logger = logging.getLogger(__name__)
+
+# Respuestas del SWH que merece la pena reintentar
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class SWHPoller:
+    """Recogida concurrente de los datos de todas las ONTs del SWH.
+
+    Las peticiones comparten un cliente HTTP con conexiones persistentes y un semáforo limita
+    cuántas hay en vuelo. Cada lectura se reintenta con backoff exponencial y jitter ante
+    errores transitorios. Las lecturas se entregan por lotes al escritor de monitoreo, que
+    inserta en un hilo mientras continúa la recogida.
+    """
+
+    def __init__(self, base_url=SWH_API_URL, username=SWH_API_USERNAME, password=SWH_API_PASSWORD,
+                 concurrency=SWH_POLL_CONCURRENCY, timeout=SWH_REQUEST_TIMEOUT, retries=SWH_MAX_RETRIES,
+                 retry_delay=SWH_RETRY_BASE_DELAY, batch_size=SWH_POLL_BATCH_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.auth = (username, password) if username else None
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+
+    def client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        return httpx.AsyncClient(base_url=self.base_url, auth=self.auth, timeout=httpx.Timeout(self.timeout), limits=limits)
+
+    async def request(self, client: httpx.AsyncClient, path: str) -> Any:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.get(path)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.retries:
+                # Full jitter: evita que todas las ONTs fallidas reintenten a la vez
+                await asyncio.sleep(random.uniform(0, self.retry_delay * 2 ** attempt))
+        raise RuntimeError(f"GET {path} failed after {self.retries + 1} attempts ({error})")
+
+    async def fetch_serials(self, client: httpx.AsyncClient) -> List[str]:
+        return await self.request(client, "/onts")
+
+    async def fetch_ont(self, client: httpx.AsyncClient, serial: str) -> Dict[str, Any]:
+        data = await self.request(client, f"/onts/{serial}")
+        data.setdefault('serial', serial)
+        return data
+
+    async def poll(self, serials: Optional[List[str]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        summary = {'onts': 0, 'collected': 0, 'failed': 0, 'inserted': 0, 'errors': [], 'stale_views': []}
+        queue = asyncio.Queue(maxsize=self.batch_size * 2)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.client() as client:
+            if serials is None:
+                serials = await self.fetch_serials(client)
+            summary['onts'] = len(serials)
+
+            async def collect(serial):
+                async with semaphore:
+                    try:
+                        data = await self.fetch_ont(client, serial)
+                    except Exception as e:
+                        logger.warning(f"Could not collect data for ONT {serial}: {e}")
+                        self._add_errors(summary, [{'serial': serial, 'error': str(e)}])
+                        return
+                summary['collected'] += 1
+                await queue.put(data)
+
+            writer = asyncio.create_task(self._write(queue, summary))
+            try:
+                await asyncio.gather(*(collect(serial) for serial in serials))
+            finally:
+                await queue.put(None)
+                await writer
+
+        summary['seconds'] = time.perf_counter() - started
+        logger.info(f"SWH poll: {summary['collected']}/{summary['onts']} ONTs collected, {summary['inserted']} stored in {summary['seconds']:.2f}s")
+        return summary
+
+    async def _write(self, queue: asyncio.Queue, summary: Dict[str, Any]):
+        # Agrupa las lecturas en lotes y los inserta en un hilo, con un lote en vuelo como mucho
+        batch = []
+        pending = None
+        while True:
+            item = await queue.get()
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) >= self.batch_size):
+                if pending is not None:
+                    await self._store_result(summary, *pending)
+                pending = (batch, asyncio.ensure_future(asyncio.to_thread(MonitoringIngestService.process_batch, batch, 0)))
+                batch = []
+            if item is None:
+                break
+        if pending is not None:
+            await self._store_result(summary, *pending)
+
+    async def _store_result(self, summary, batch, future):
+        try:
+            inserted, errors, stale = await future
+        except Exception as e:
+            # El escritor no debe detenerse: las recogidas pendientes se quedarían esperando en la cola
+            logger.error(f"Could not store {len(batch)} ONT snapshots: {e}")
+            self._add_errors(summary, [{'serial': item.get('serial'), 'error': str(e)} for item in batch])
+            return
+        summary['inserted'] += inserted
+        summary['stale_views'] = sorted(set(summary['stale_views']) | set(stale))
+        self._add_errors(summary, [{'serial': batch[error['index']].get('serial'), 'error': error['error']} for error in errors])
+
+    @staticmethod
+    def _add_errors(summary, errors):
+        summary['failed'] += len(errors)
+        summary['errors'].extend(errors[:max(MONITORING_INGEST_MAX_ERRORS - len(summary['errors']), 0)])
@@ -1,5 +1,7 @@
 from models.monitoring_model import ONTData
+from services.swh_poller import SWHPoller
 from typing import List
+import asyncio
 
 class SWHService:
     @staticmethod
@@ -23,6 +25,10 @@ class SWHService:
 
     @staticmethod
     def collect_and_store_ont_data():
-        # Implementar la lógica para recolectar y almacenar datos de todas las ONTs
-        # Esta función se puede llamar periódicamente para actualizar los datos
-        pass
\ No newline at end of file
+        # Recolecta en paralelo los datos de todas las ONTs del SWH y los almacena por lotes.
+        # Versión síncrona para llamarla fuera del bucle de eventos (planificador, hilos)
+        return asyncio.run(SWHPoller().poll())
+
+    @staticmethod
+    async def collect_and_store_ont_data_async():
+        return await SWHPoller().poll()
\ No newline at end of file
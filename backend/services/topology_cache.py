@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.errors import PyMongoError
+from config import TOPOLOGY_CACHE_MAX_AGE
+from database.mongo import manager_collection
+from database.mongo_async import async_manager_collection
+
+logger = logging.getLogger(__name__)
+
+# La geometría de los pisos no hace falta para resolver seriales y es lo que más ocupa
+TOPOLOGY_PROJECTION = {'floors.geoJsonData': 0}
+
+
+class TopologyCache:
+    """Índice en memoria edificio -> piso -> ONTs y serial -> (edificio, piso).
+
+    Se carga entero al arrancar y los métodos de escritura de ManagerService vuelven a leer sólo
+    el edificio que han modificado. Si hay otros procesos escribiendo en manager, watch() sigue
+    los cambios con un change stream (requiere replica set); sin él, start() recarga el índice
+    en un hilo cada max_age segundos. Las lecturas sólo consultan Mongo si el índice no se ha
+    cargado nunca; después devuelven el último índice cargado, que se sustituye entero al recargar.
+    """
+
+    def __init__(self, max_age=TOPOLOGY_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self._buildings: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._locations: Dict[str, Tuple[str, str]] = {}
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._refresher = None
+        self._stopping = threading.Event()
+
+    def load(self):
+        buildings = {}
+        for building in manager_collection.find({}, TOPOLOGY_PROJECTION):
+            buildings[building.get('name')] = self._floors(building)
+        self._swap(buildings)
+
+    async def load_async(self):
+        # Misma carga con el cliente asíncrono, para hacerla desde el bucle de eventos
+        buildings = {}
+        async for building in async_manager_collection.find({}, TOPOLOGY_PROJECTION):
+            buildings[building.get('name')] = self._floors(building)
+        self._swap(buildings)
+
+    async def ensure_loaded_async(self):
+        # Las rutas asíncronas no pueden esperar a una carga síncrona: si aún no hay índice se
+        # carga aquí; una vez cargado las lecturas son sólo de memoria
+        if self._loaded_at is None:
+            await self.load_async()
+
+    def _swap(self, buildings: Dict[str, Dict[str, List[Dict[str, Any]]]]):
+        with self._lock:
+            self._buildings = buildings
+            self._reindex()
+            self._loaded_at = time.monotonic()
+        logger.info(f"Topology cache loaded: {len(buildings)} buildings, {len(self._locations)} ONTs")
+
+    def refresh_building(self, name: str):
+        # Tras una escritura: vuelve a leer un único edificio (o lo quita si ya no existe)
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._set_building(name, manager_collection.find_one({'name': name}, TOPOLOGY_PROJECTION))
+
+    async def refresh_building_async(self, name: str):
+        if self._loaded_at is None:
+            return
+        building = await async_manager_collection.find_one({'name': name}, TOPOLOGY_PROJECTION)
+        with self._lock:
+            self._set_building(name, building)
+
+    def all_onts(self) -> List[Dict[str, Any]]:
+        buildings = self._current()
+        return [ont for floors in buildings.values() for onts in floors.values() for ont in onts]
+
+    def onts_for_building(self, building_name: str) -> List[Dict[str, Any]]:
+        floors = self._current().get(building_name, {})
+        return [ont for onts in floors.values() for ont in onts]
+
+    def onts_for_floor(self, building_name: str, floor_name: str) -> List[Dict[str, Any]]:
+        return list(self._current().get(building_name, {}).get(floor_name, []))
+
+    def location(self, serial: str) -> Optional[Tuple[str, str]]:
+        self._current()
+        return self._locations.get(serial)
+
+    def locations(self) -> Dict[str, Tuple[str, str]]:
+        self._current()
+        return dict(self._locations)
+
+    def start(self):
+        # Hilo que recarga el índice cada max_age segundos (recoge escrituras de otros procesos)
+        if self._refresher is None and self.max_age:
+            self._stopping.clear()
+            self._refresher = threading.Thread(target=self._refresh, name="topology-refresh", daemon=True)
+            self._refresher.start()
+
+    def watch(self):
+        # Hilo que recarga el índice con cada cambio en manager hecho por cualquier proceso
+        if self._watcher is None:
+            self._stopping.clear()
+            self._watcher = threading.Thread(target=self._watch, name="topology-watch", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._watcher = None
+        self._refresher = None
+
+    def _current(self) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        # Scripts y llamadas síncronas fuera del servidor: la primera lectura carga el índice.
+        # El servidor lo carga al arrancar (y las rutas asíncronas con ensure_loaded_async), así
+        # que desde el bucle de eventos nunca se llega a esta carga; las recargas son en segundo plano
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self.load()
+        return self._buildings
+
+    def _refresh(self):
+        while not self._stopping.wait(self.max_age):
+            try:
+                self.load()
+            except PyMongoError as e:
+                # Se mantiene el último índice cargado hasta el siguiente intento
+                logger.warning(f"Topology cache refresh failed: {e}")
+
+    def _watch(self):
+        try:
+            with manager_collection.watch(max_await_time_ms=1000) as stream:
+                while not self._stopping.is_set():
+                    if stream.try_next() is not None:
+                        self.load()
+        except PyMongoError as e:
+            # Sin replica set no hay change streams: se sigue dependiendo de la recarga periódica
+            logger.warning(f"Topology change stream unavailable: {e}")
+        self._watcher = None
+
+    def _set_building(self, name: str, building: Optional[Dict[str, Any]]):
+        # Copia nueva en lugar de modificarlo: los lectores recorren el diccionario sin el lock
+        buildings = dict(self._buildings)
+        if building:
+            buildings[name] = self._floors(building)
+        else:
+            buildings.pop(name, None)
+        self._buildings = buildings
+        self._reindex()
+
+    @staticmethod
+    def _floors(building: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+        return {floor.get('name'): list(floor.get('onts', [])) for floor in building.get('floors', [])}
+
+    def _reindex(self):
+        # Si una ONT aparece en varios pisos gana el primero, como al recorrer los edificios
+        locations = {}
+        for building_name, floors in self._buildings.items():
+            for floor_name, onts in floors.items():
+                for ont in onts:
+                    locations.setdefault(ont.get('serial'), (building_name, floor_name))
+        self._locations = locations
+
+
+topology_cache = TopologyCache()
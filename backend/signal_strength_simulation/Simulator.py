@@ -1,5 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import pygame
 import math
 import random
@@ -8,9 +9,16 @@ from pyqtree import Index
 from pygame.locals import *
 from scipy.constants import mu_0, epsilon_0, pi
 import copy
+import logging
 import time
 import cmath
 from tqdm import tqdm
+from spatial_index import UniformGridIndex
+from ray_store import RaySegmentStore
+import kernels
+import parallel
+
+logger = logging.getLogger(__name__)
 
 
 # Definir constantes de colores
@@ -29,9 +37,27 @@ class Environment(Visualizable):
         self.dimensions = dimensions
         self.obstacles = obstacles if obstacles else []
         self.materials = materials if materials else []
+        self._spatial_index = None
+        self._walls_array = None
 
     def add_obstacle(self, obstacle):
         self.obstacles.append(obstacle)
+        self._spatial_index = None
+        self._walls_array = None
+
+    @property
+    def spatial_index(self):
+        # Se construye una vez por entorno y se reconstruye si cambian los obstáculos
+        if self._spatial_index is None or self._spatial_index.size != len(self.obstacles):
+            self._spatial_index = UniformGridIndex.from_walls(self.obstacles)
+        return self._spatial_index
+
+    @property
+    def walls_array(self):
+        # Paredes como array (n, 4) para los núcleos compilados, con la misma invalidación que el índice
+        if self._walls_array is None or len(self._walls_array) != len(self.obstacles):
+            self._walls_array = kernels.walls_array(self.obstacles)
+        return self._walls_array
 
     def visualize(self, display, scale):
         for obstacle in self.obstacles:
@@ -108,6 +134,16 @@ class Ray(Visualizable):
     def __repr__(self):
         return f"Ray: Position ('{self.start_point}', {self.end_point}) Path: ('{self.path}'); Reflections and transmisions: ('{self.num_reflections}',''{self.num_transmissions})"
 
+    def spawn(self, start_point, direction):
+        # Copia superficial para la propagación iterativa: la trayectoria no se copia,
+        # el simulador la comparte con el rayo padre mediante índices (path_node)
+        child = Ray.__new__(Ray)
+        child.__dict__.update(self.__dict__)
+        child.start_point = start_point
+        child.direction = direction
+        child.path = None
+        return child
+
     def collide(self, wall):
         # based off line segment intersection formula found at https://en.wikipedia.org/wiki/Line%E2%80%93line_intersection
         
@@ -186,11 +222,26 @@ class ReceiverGrid(Visualizable):
         
         return total_power
 
+    def calculate_received_power_from_segments(self, segments, mask, frequency, calculation_point):
+        # Misma fórmula que calculate_received_power_in_cell sobre las filas seleccionadas del almacén
+        c = 3e8
+        wavelength = c / frequency
+        end_points = segments.end_points[mask]
+        distance_correction = np.hypot(end_points[:, 0] - calculation_point[0], end_points[:, 1] - calculation_point[1])
+        distance = segments.distances[mask] - distance_correction
+        path_loss = (4 * np.pi * distance / wavelength) ** 2  # Free-space path loss
+        ray_power = segments.powers[mask] * (np.abs(segments.alphas[mask]) ** 2) / path_loss
+        return ray_power.sum()
+
     def visualize(self, display, scale):
         return super().visualize(display, scale)
 
 class Simulator:
-    def __init__(self, environment, tx_antenna, rx_grid, num_rays, max_path_loss, max_reflections, max_transmissions):
+    # Desde cuántas paredes compensa el índice espacial si no se indica, por backend: el recorrido
+    # lineal compilado de numba es mucho más rápido que el de Python
+    SPATIAL_INDEX_MIN_WALLS = {"python": 50, "numba": 2000}
+
+    def __init__(self, environment, tx_antenna, rx_grid, num_rays, max_path_loss, max_reflections, max_transmissions, use_spatial_index=None, propagation="recursive", backend="python"):
         self.environment = environment
         self.tx_antenna = tx_antenna
         self.rx_grid = rx_grid
@@ -198,24 +249,45 @@ class Simulator:
         self.max_path_loss = max_path_loss
         self.max_reflections = max_reflections
         self.max_transmissions = max_transmissions
-        self.rays = []
+        self.use_spatial_index = use_spatial_index  # None: según el número de paredes (SPATIAL_INDEX_MIN_WALLS)
+        self.propagation = propagation  # "recursive" o "iterative"
+        self.backend = kernels.resolve_backend(backend)  # "python" o "numba" (núcleos de kernels.py)
+        self.rays = []  # Objetos Ray, sólo en la propagación recursiva
+        self.segments = RaySegmentStore()  # Segmentos de la última simulación, en ambos modos
         self.reflected_rays = []
         self.quadtree = Index(bbox=(0, 0, environment.dimensions[0], environment.dimensions[1]))
 
+    @property
+    def indexed(self):
+        # Con pocas paredes es más rápido probarlas todas que recorrer la rejilla del índice
+        if self.use_spatial_index is None:
+            return len(self.environment.obstacles) >= self.SPATIAL_INDEX_MIN_WALLS[self.backend]
+        return self.use_spatial_index
+
     def launch_rays(self):
         self.rays = []
+        self.segments.clear()
         rays = self.tx_antenna.launch_rays(self.num_rays)
+        propagate = self.propagate_ray_iterative if self.propagation == "iterative" else self.propagate_ray
         start = time.time()
 
         with tqdm(total=self.num_rays, desc="Launching rays", unit="ray") as pbar:
             for ray in rays:
-                self.propagate_ray(ray)
+                propagate(ray)
                 pbar.update(1)
 
-        print(f"Launched {len(self.rays)} rays in {time.time() - start:.2f} seconds")
-        return self.rays
+        if self.propagation != "iterative":
+            self.segments = RaySegmentStore.from_rays(self.rays)
+
+        logger.info(f"Launched {self.num_rays} rays ({len(self.segments)} segments) in {time.time() - start:.2f} seconds")
+        return self.segments
 
     def find_closest_collision(self, ray):
+        if self.backend == "numba":
+            return self.find_closest_collision_compiled(ray)
+        if self.indexed:
+            return self.find_closest_collision_indexed(ray)
+
         obstacles = self.environment.obstacles
 
         closest_collision = None
@@ -231,6 +303,66 @@ class Simulator:
             ray.end_point = closest_collision.point
             # ray.path.append(ray.end_point)
             return closest_collision
+
+    def find_closest_collision_indexed(self, ray):
+        # Igual que find_closest_collision pero probando sólo las paredes de las celdas que cruza el rayo
+        obstacles = self.environment.obstacles
+
+        def intersect(indices):
+            for index in indices:
+                collision = ray.collide(obstacles[index])
+                if collision:
+                    yield index, math.dist(ray.start_point, collision.point), collision
+
+        _, _, closest_collision = self.environment.spatial_index.closest_hit(ray.start_point, ray.direction, intersect, max_distance=1000)
+        if closest_collision:
+            ray.end_point = closest_collision.point
+            return closest_collision
+
+    def find_closest_collision_compiled(self, ray):
+        # Búsqueda con los núcleos numba: recorrido lineal compilado de todas las paredes o,
+        # con índice espacial, intersección compilada de las paredes candidatas
+        obstacles = self.environment.obstacles
+        rx, ry = ray.start_point
+        dx, dy = ray.direction
+
+        if self.indexed:
+            walls = self.environment.walls_array
+
+            def intersect(indices):
+                for index in indices:
+                    hit, px, py = kernels.segment_intersection(walls[index, 0], walls[index, 1], walls[index, 2], walls[index, 3], rx, ry, dx, dy)
+                    if hit:
+                        yield index, math.dist(ray.start_point, (px, py)), (px, py)
+
+            index, _, point = self.environment.spatial_index.closest_hit(ray.start_point, ray.direction, intersect, max_distance=1000)
+        else:
+            index, px, py, _ = kernels.closest_wall(self.environment.walls_array, rx, ry, dx, dy, 1000.0)
+            point = (px, py)
+
+        if index >= 0:
+            ray.end_point = point
+            return Collision(ray, point, obstacles[index])
+
+    def advance_ray(self, ray, collision):
+        # Actualiza el rayo con el segmento hasta la colisión: distancia recorrida y path loss
+        ray.end_point = collision.point
+        wavelength = 3e8 / self.tx_antenna.frequency
+        if self.backend == "numba":
+            ray.distance, ray.path_loss = kernels.accumulate_path_loss(ray.distance, math.dist(ray.start_point, collision.point), wavelength)
+        else:
+            ray.distance += math.dist(ray.start_point, collision.point)
+            ray.path_loss = (4 * np.pi * ray.distance / wavelength) ** 2
+
+    def collision_coefficients(self, ray, collision):
+        dot_product = np.dot(ray.direction, collision.wall.normal_direction)
+        dot_product = np.clip(dot_product, -1.0, 1.0)  # Clip the dot product to the valid range [-1, 1]
+        incident_angle = math.acos(dot_product)
+        material = collision.wall.material
+        if self.backend == "numba":
+            return kernels.fresnel_coefficients(incident_angle, material.permittivity, material.conductivity, material.thickness,
+                                                self.tx_antenna.frequency, ray.polarization == 'TE')
+        return self.calculate_coefficients1(incident_angle, material, ray.polarization)
             
     def propagate_ray(self, ray):
         # Verificar si el path loss del rayo está por encima del umbral
@@ -242,15 +374,7 @@ class Simulator:
 
         if collision is not None:
             # Actualizar el rayo original con la distancia y el path loss
-            distance = math.dist(ray.start_point, collision.point)
-            ray.end_point = collision.point
-            ray.distance += distance
-
-            # Actualizar el path loss del rayo
-            frequency = self.tx_antenna.frequency
-            wavelength = 3e8 / frequency
-            path_loss = (4 * np.pi * ray.distance / wavelength) ** 2
-            ray.path_loss = path_loss
+            self.advance_ray(ray, collision)
 
             # Verificar si el path loss excede el umbral
             if ray.path_loss > self.max_path_loss:
@@ -258,10 +382,7 @@ class Simulator:
                 return
 
             # Calcular los coeficientes de reflexión y transmisión
-            dot_product = np.dot(ray.direction, collision.wall.normal_direction)
-            dot_product = np.clip(dot_product, -1.0, 1.0)  # Clip the dot product to the valid range [-1, 1]
-            incident_angle = math.acos(dot_product)
-            reflection_coefficient, transmission_coefficient, refracted_angle = self.calculate_coefficients1(incident_angle, collision.wall.material, ray.polarization)
+            reflection_coefficient, transmission_coefficient, refracted_angle = self.collision_coefficients(ray, collision)
 
             # Calcular y propagar el rayo reflejado
             reflected_ray = self.reflect_ray(ray, collision, reflection_coefficient)
@@ -275,8 +396,61 @@ class Simulator:
             self.rays.append(ray)  # Agrega el rayo original al final
         else:
             self.rays.append(ray)
-    
-    def reflect_ray(self, ray, collision, reflection_coefficient):
+
+    def propagate_ray_iterative(self, ray):
+        # Mismo recorrido que propagate_ray (postorden: subárbol reflejado, subárbol refractado
+        # y luego el propio rayo) con una pila explícita en lugar de recursión. Los rayos hijos
+        # se crean con Ray.spawn y comparten la trayectoria del padre a través de los nodos del
+        # almacén. Cada rayo terminado se escribe directamente en self.segments.
+        segments = self.segments
+        ray.path_node = segments.add_path_node(ray.start_point, -1)
+        stack = [(ray, False)]
+        while stack:
+            ray, expanded = stack.pop()
+            if expanded:
+                segments.append_ray(ray)
+                continue
+
+            if ray.path_loss > self.max_path_loss:
+                continue
+
+            collision = self.find_closest_collision(ray)
+            if collision is None:
+                segments.append_ray(ray)
+                continue
+
+            self.advance_ray(ray, collision)
+
+            if ray.path_loss > self.max_path_loss:
+                segments.append_ray(ray)
+                continue
+
+            # Los coeficientes no se aplican todavía (alpha usa valores fijos), igual que en reflect_ray/refract_ray
+            reflection_coefficient, transmission_coefficient, refracted_angle = self.collision_coefficients(ray, collision)
+
+            # El padre se emite cuando terminan sus hijos; el reflejado se apila el último para procesarlo primero
+            stack.append((ray, True))
+            node = segments.add_path_node(collision.point, ray.path_node)
+
+            if ray.num_reflections == 0:
+                refracted_ray = ray.spawn(collision.point, ray.direction)
+                refracted_ray.path_node = node
+                refracted_ray.alpha *= 0.6
+                refracted_ray.num_transmissions += 1
+                stack.append((refracted_ray, False))
+
+            reflected_ray = ray.spawn(collision.point, self.reflected_direction(ray, collision))
+            reflected_ray.path_node = node
+            reflected_ray.alpha *= 0.8
+            reflected_ray.num_reflections += 1
+            stack.append((reflected_ray, False))
+
+    def get_ray_path(self, ray):
+        if ray.path is not None:
+            return ray.path
+        return self.segments.get_path(ray.path_node)
+
+    def reflected_direction(self, ray, collision):
         # Calcular el vector normal de la pared en el punto de colisión
         normal = collision.wall.normal_direction
 
@@ -285,11 +459,14 @@ class Simulator:
         normal = (normal[0] / normal_magnitude, normal[1] / normal_magnitude)
 
         # Calcular la dirección del rayo reflejado
-        reflected_direction = (
+        return (
             ray.direction[0] - 2 * np.dot(ray.direction, normal) * normal[0],
             ray.direction[1] - 2 * np.dot(ray.direction, normal) * normal[1]
         )
 
+    def reflect_ray(self, ray, collision, reflection_coefficient):
+        reflected_direction = self.reflected_direction(ray, collision)
+
         # Actualizar el rayo original para representar la reflexión
         reflected_ray = copy.deepcopy(ray)
         reflected_ray.start_point = collision.point
@@ -442,8 +619,104 @@ class Simulator:
         
         return reflection_coefficient, transmission_coefficient, refracted_angle
 
-    def generate_contour_map(self):
+    def generate_contour_map(self, method="raster", workers=1, tile_size=64):
+        self.compute_contour_map(method, workers, tile_size)
+        self.plot()
+
+    def compute_contour_map(self, method="raster", workers=1, tile_size=64):
+        # Rellena rx_grid.received_power (dBm). "raster" recorre cada segmento una vez por la
+        # rejilla; "brute_force" prueba todos los segmentos en cada celda (referencia, O(celdas × segmentos)).
+        # Con workers > 1 la rejilla se divide en teselas de tile_size celdas que se calculan en procesos.
+        if method == "brute_force":
+            return self.compute_contour_map_brute_force()
+        if method != "raster":
+            raise ValueError(f"Unknown contour map method: {method}")
+
+        resolution = self.rx_grid.resolution
+        cell_w, cell_h = self.rx_grid.cell_size
+        segments = self.segments
+        # Los segmentos se envían una vez a cada proceso; las tareas sólo llevan su tesela
+        shared = {
+            'start_points': segments.start_points,
+            'end_points': segments.end_points,
+            'distances': segments.distances,
+            'powers': segments.powers,
+            'alphas': segments.alphas,
+            'cell_size': (cell_w, cell_h),
+            'wavelength': 3e8 / self.tx_antenna.frequency,
+        }
+        shape = (resolution, resolution)
+        tiles = parallel.grid_tiles(shape, tile_size if workers > 1 else resolution)
+        blocks = parallel.map_tiles(received_power_tile, tiles, shared, workers)
+        received_power_dbm = parallel.merge_tiles(shape, tiles, blocks)
+
+        # Celda del transmisor con un valor fijo, como en el cálculo por celdas
+        tx_cell_x = int(self.tx_antenna.location[0] // cell_w)
+        tx_cell_y = int(self.tx_antenna.location[1] // cell_h)
+        if 0 <= tx_cell_x < resolution and 0 <= tx_cell_y < resolution:
+            received_power_dbm[tx_cell_y, tx_cell_x] = -30
+
+        self.rx_grid.received_power[:, :] = received_power_dbm
+        return self.rx_grid.received_power
+
+    @staticmethod
+    def rasterize_segments(start_points, end_points, cell_size, rows, cols):
+        # Recorre cada segmento fila a fila de la rejilla de receptores y, en cada fila, el rango de
+        # columnas que cubre (DDA por filas, vectorizado sobre todos los segmentos), limitado a las
+        # filas j y columnas i de la ventana (rows, cols). Devuelve los pares (segmento, celda i,
+        # celda j) con los mismos criterios que segments_intersect_cell.
+        cell_w, cell_h = cell_size
+        eps = 1e-9 * max(cell_w, cell_h)
+
+        # Sólo los segmentos con final cuya caja toca la ventana
+        x_min, x_max = np.fmin(start_points[:, 0], end_points[:, 0]), np.fmax(start_points[:, 0], end_points[:, 0])
+        y_min, y_max = np.fmin(start_points[:, 1], end_points[:, 1]), np.fmax(start_points[:, 1], end_points[:, 1])
+        valid = np.flatnonzero(
+            np.isfinite(end_points).all(axis=1) &
+            (x_max >= cols.start * cell_w - eps) & (x_min <= cols.stop * cell_w + eps) &
+            (y_max >= rows.start * cell_h - eps) & (y_min <= rows.stop * cell_h + eps)
+        )
+        x0, y0 = start_points[valid, 0], start_points[valid, 1]
+        x1, y1 = end_points[valid, 0], end_points[valid, 1]
+        y_lo, y_hi = np.minimum(y0, y1), np.maximum(y0, y1)
+
+        # Filas que cubre cada segmento (con un pequeño margen para los que tocan un borde)
+        row_lo = np.clip(np.floor((y_lo - eps) / cell_h), rows.start, rows.stop - 1).astype(np.int64)
+        row_hi = np.clip(np.floor((y_hi + eps) / cell_h), rows.start, rows.stop - 1).astype(np.int64)
+        owner, row_index = Simulator._expand_ranges(row_lo, row_hi)
+
+        # Tramo del segmento dentro de cada fila y columnas que cubre
+        x0, y0, x1, y1 = x0[owner], y0[owner], x1[owner], y1[owner]
+        slab_lo = np.maximum(row_index * cell_h, y_lo[owner])
+        slab_hi = np.minimum((row_index + 1) * cell_h, y_hi[owner])
+        horizontal = y0 == y1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xa = np.where(horizontal, x0, x0 + (slab_lo - y0) * (x1 - x0) / (y1 - y0))
+            xb = np.where(horizontal, x1, x0 + (slab_hi - y0) * (x1 - x0) / (y1 - y0))
+        col_lo = np.clip(np.floor((np.minimum(xa, xb) - eps) / cell_w), cols.start, cols.stop - 1).astype(np.int64)
+        col_hi = np.clip(np.floor((np.maximum(xa, xb) + eps) / cell_w), cols.start, cols.stop - 1).astype(np.int64)
+        row_owner, col_index = Simulator._expand_ranges(col_lo, col_hi)
+
+        segment_index = valid[owner[row_owner]]
+        cell_i, cell_j = col_index, row_index[row_owner]
+
+        # Los candidatos se confirman con la misma prueba que el cálculo por celdas
+        cell_bbox = (cell_i * cell_w, cell_j * cell_h, cell_i * cell_w + cell_w, cell_j * cell_h + cell_h)
+        hit = Simulator.segments_intersect_cell(start_points[segment_index], end_points[segment_index], cell_bbox)
+        return segment_index[hit], cell_i[hit], cell_j[hit]
+
+    @staticmethod
+    def _expand_ranges(lo, hi):
+        # Para cada rango [lo, hi] genera (índice del rango, valor) de todos sus valores
+        counts = hi - lo + 1
+        owner = np.repeat(np.arange(len(lo)), counts)
+        offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return owner, lo[owner] + offsets
+
+    def compute_contour_map_brute_force(self):
         total_cells = self.rx_grid.resolution ** 2
+        segments = self.segments
+        start_points, end_points = segments.start_points, segments.end_points
 
         # Calcular las coordenadas de la celda del transmisor
         tx_cell_x = int(self.tx_antenna.location[0] // self.rx_grid.cell_size[0])
@@ -464,16 +737,13 @@ class Simulator:
                         self.rx_grid.received_power[j, i] = -30
                     
                     else:
-                        # Obtener los rayos que intersectan con la celda actual
-                        rays_in_cell = []
-                        for ray in self.rays:
-                            if self.ray_intersects_cell(ray, cell_bbox):
-                                rays_in_cell.append(ray)
+                        # Obtener los segmentos que intersectan con la celda actual
+                        rays_in_cell = self.segments_intersect_cell(start_points, end_points, cell_bbox)
 
                         # Calcular el punto de cálculo para la celda actual
                         calculation_point = (cell_coords[0] + self.rx_grid.cell_size[0] / 2, cell_coords[1] + self.rx_grid.cell_size[1] / 2)
 
-                        received_power = self.rx_grid.calculate_received_power_in_cell(rays_in_cell, self.tx_antenna.frequency, calculation_point)
+                        received_power = self.rx_grid.calculate_received_power_from_segments(segments, rays_in_cell, self.tx_antenna.frequency, calculation_point)
 
                         # Agregar una pequeña constante al valor de received_power antes de calcular el logaritmo
                         received_power_dbm = 10 * math.log10(received_power / 1e-3 + 1e-12)  # Convertir a dBm
@@ -486,9 +756,8 @@ class Simulator:
 
                     pbar.update(1)
 
-        self.plot()
+        return self.rx_grid.received_power
 
-    
     def ray_intersects_cell(self, ray, cell_bbox):
         # Verificar si el rayo intersecta con la celda
         x1, y1 = ray.start_point
@@ -512,6 +781,37 @@ class Simulator:
         
         return False
 
+    @staticmethod
+    def segments_intersect_cell(start_points, end_points, cell_bbox):
+        # Versión vectorizada de ray_intersects_cell sobre todos los segmentos a la vez
+        x1, y1 = start_points[:, 0], start_points[:, 1]
+        x2, y2 = end_points[:, 0], end_points[:, 1]
+        cell_x1, cell_y1, cell_x2, cell_y2 = cell_bbox
+
+        outside = ((x1 < cell_x1) & (x2 < cell_x1)) | ((x1 > cell_x2) & (x2 > cell_x2)) | \
+            ((y1 < cell_y1) & (y2 < cell_y1)) | ((y1 > cell_y2) & (y2 > cell_y2))
+        inside = (cell_x1 <= x1) & (x1 <= cell_x2) & (cell_x1 <= x2) & (x2 <= cell_x2) & \
+            (cell_y1 <= y1) & (y1 <= cell_y2) & (cell_y1 <= y2) & (y2 <= cell_y2)
+        crosses = Simulator.segments_intersect_line(start_points, end_points, (cell_x1, cell_y1, cell_x2, cell_y1)) | \
+            Simulator.segments_intersect_line(start_points, end_points, (cell_x2, cell_y1, cell_x2, cell_y2)) | \
+            Simulator.segments_intersect_line(start_points, end_points, (cell_x2, cell_y2, cell_x1, cell_y2)) | \
+            Simulator.segments_intersect_line(start_points, end_points, (cell_x1, cell_y2, cell_x1, cell_y1))
+
+        return ~outside & (inside | crosses)
+
+    @staticmethod
+    def segments_intersect_line(start_points, end_points, line):
+        x1, y1 = start_points[:, 0], start_points[:, 1]
+        x2, y2 = end_points[:, 0], end_points[:, 1]
+        x3, y3, x4, y4 = line
+
+        det = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) / det
+            u = -((x1 - x2) * (y1 - y3) - (y1 - y2) * (x1 - x3)) / det
+
+        return (det != 0) & (0 <= t) & (t <= 1) & (0 <= u) & (u <= 1)
+
     def ray_intersects_line(self, ray, line):
         # Verificar si el rayo intersecta con una línea
         x1, y1 = ray.start_point
@@ -563,10 +863,34 @@ class Simulator:
         self.tx_antenna.location = new_position
 
     def export_simulation_data(self):
-        rays_data = [(ray.start_point, ray.end_point) for ray in self.rays]
+        # Array (n, 2, 2) de (inicio, fin) leído directamente del almacén de segmentos
+        rays_data = self.segments.segments()
         walls_data = [(wall.start_point, wall.end_point) for wall in self.environment.obstacles]
         return rays_data, walls_data
     
+def received_power_tile(shared, tile):
+    # Potencia recibida (dBm) de las celdas de una tesela (filas j, columnas i) del mapa de contorno
+    rows, cols = tile
+    cell_w, cell_h = shared['cell_size']
+    end_points = shared['end_points']
+    segment_index, cell_i, cell_j = Simulator.rasterize_segments(shared['start_points'], end_points, (cell_w, cell_h), rows, cols)
+
+    # Misma fórmula que calculate_received_power_from_segments, para cada par (segmento, celda)
+    centers_x = cell_i * cell_w + cell_w / 2
+    centers_y = cell_j * cell_h + cell_h / 2
+    distance_correction = np.hypot(end_points[segment_index, 0] - centers_x, end_points[segment_index, 1] - centers_y)
+    distance = shared['distances'][segment_index] - distance_correction
+    with np.errstate(divide='ignore'):
+        path_loss = (4 * np.pi * distance / shared['wavelength']) ** 2  # Free-space path loss
+        ray_power = shared['powers'][segment_index] * (np.abs(shared['alphas'][segment_index]) ** 2) / path_loss
+
+    height, width = rows.stop - rows.start, cols.stop - cols.start
+    cells = (cell_j - rows.start) * width + (cell_i - cols.start)
+    received_power = np.bincount(cells, weights=ray_power, minlength=height * width)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        received_power_dbm = 10 * np.log10(received_power / 1e-3 + 1e-12)  # Convertir a dBm
+    return received_power_dbm.reshape(height, width)
+
 class SimulationVisualizer:
     def __init__(self, simulator):
         self.simulator = simulator
@@ -615,8 +939,12 @@ class SimulationVisualizer:
             self.simulator.environment.visualize(self.display, self.scale)
             self.display.blit(texto, (10, 10))
 
-            for ray in self.simulator.rays:
-                ray.visualize(self.display, self.scale)
+            for start_point, end_point in self.simulator.segments.segments():
+                if np.isnan(end_point).any():
+                    continue
+                start_point_scaled = (int(start_point[0] * self.scale[0]), int(start_point[1] * self.scale[1]))
+                end_point_scaled = (int(end_point[0] * self.scale[0]), int(end_point[1] * self.scale[1]))
+                pygame.draw.line(self.display, RAYS, start_point_scaled, end_point_scaled)
             
             pygame.display.update()
             self.clock.tick(fps)
@@ -627,8 +955,8 @@ def plot_simulation(rays_data, walls_data, dimensions):
     plt.figure(figsize=(8, 6))
     for wall_start, wall_end in walls_data:
         plt.plot([wall_start[0], wall_end[0]], [wall_start[1], wall_end[1]], 'k-', linewidth=2)
-    for ray_start, ray_end in rays_data:
-        plt.plot([ray_start[0], ray_end[0]], [ray_start[1], ray_end[1]], 'b-', alpha=0.5)
+    # Una sola colección para todos los segmentos (los que no tienen fin son NaN y no se dibujan)
+    plt.gca().add_collection(LineCollection(np.asarray(rays_data, dtype=float), colors='b', alpha=0.5))
     plt.xlim(0, dimensions[0])
     plt.ylim(0, dimensions[1])
     plt.xlabel('X')
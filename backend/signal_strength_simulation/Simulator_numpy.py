@@ -1,5 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import pygame
 import math
 import random
@@ -10,8 +11,13 @@ from scipy.constants import mu_0, epsilon_0, pi
 import copy
 import cmath
 from numba import njit
+import logging
 import time
 from line_profiler import LineProfiler
+from spatial_index import UniformGridIndex
+from ray_store import RaySegmentStore
+
+logger = logging.getLogger(__name__)
 
 # Definir constantes de colores
 BLACK = (0, 0, 0)
@@ -29,9 +35,18 @@ class Environment(Visualizable):
         self.dimensions = dimensions
         self.obstacles = obstacles if obstacles else []
         self.materials = materials if materials else []
+        self._spatial_index = None
 
     def add_obstacle(self, obstacle):
         self.obstacles.append(obstacle)
+        self._spatial_index = None
+
+    @property
+    def spatial_index(self):
+        # Se construye una vez por entorno y se reconstruye si cambian los obstáculos
+        if self._spatial_index is None or self._spatial_index.size != len(self.obstacles):
+            self._spatial_index = UniformGridIndex.from_walls(self.obstacles)
+        return self._spatial_index
 
     def visualize(self, display, scale):
         for obstacle in self.obstacles:
@@ -220,7 +235,9 @@ class ReceiverGrid(Visualizable):
     #     plt.show()
 
 class Simulator:
-    def __init__(self, environment, tx_antenna, rx_grid, num_rays, min_power, max_reflections, max_transmissions):
+    SPATIAL_INDEX_MIN_WALLS = 50  # Desde cuántas paredes compensa el índice espacial si no se indica
+
+    def __init__(self, environment, tx_antenna, rx_grid, num_rays, min_power, max_reflections, max_transmissions, use_spatial_index=None, propagation="recursive", wavefront_memory_mb=64):
         self.environment = environment
         self.tx_antenna = tx_antenna
         self.rx_grid = rx_grid
@@ -228,13 +245,27 @@ class Simulator:
         self.min_power = min_power
         self.max_reflections = max_reflections
         self.max_transmissions = max_transmissions
-        self.rays = []
+        self.use_spatial_index = use_spatial_index  # None: según el número de paredes (SPATIAL_INDEX_MIN_WALLS)
+        self.propagation = propagation  # "recursive" o "wavefront"
+        self.wavefront_memory_mb = wavefront_memory_mb  # Memoria máxima de cada bloque rayos×paredes
+        self.rays = []  # Objetos Ray, sólo en la propagación recursiva
+        self.segments = RaySegmentStore()  # Segmentos de la última simulación, en ambos modos
         self.reflected_rays = []
         self.quadtree = Index(bbox=(0, 0, environment.dimensions[0], environment.dimensions[1]))
 
+    @property
+    def indexed(self):
+        # Con pocas paredes es más rápido probarlas todas que recorrer la rejilla del índice
+        if self.use_spatial_index is None:
+            return len(self.environment.obstacles) >= self.SPATIAL_INDEX_MIN_WALLS
+        return self.use_spatial_index
+
     def launch_rays(self):
         self.rays = []
         self.quadtree = Index(bbox=(0, 0, self.environment.dimensions[0], self.environment.dimensions[1]))  # Reiniciar el Quadtree
+        if self.propagation == "wavefront":
+            return self.launch_rays_wavefront()
+
         rays = self.tx_antenna.launch_rays(self.num_rays)
 
         start = time.time()
@@ -243,9 +274,164 @@ class Simulator:
         
         print(time.time() - start)
         # print(len(self.rays))
-        return self.rays
+        self.segments = RaySegmentStore.from_rays(self.rays)
+        return self.segments
+
+    def launch_rays_wavefront(self):
+        # Propagación por frentes de onda: todos los rayos activos con el mismo número de rebotes
+        # se intersectan a la vez contra todas las paredes y sus hijos reflejados y refractados
+        # se generan con operaciones de arrays. Produce los mismos segmentos que propagate_ray,
+        # agrupados por profundidad en lugar de en postorden.
+        self.segments = segments = RaySegmentStore()
+        walls = self.wall_arrays()
+        frequency = self.tx_antenna.frequency
+
+        start = time.time()
+        num_rays = self.num_rays
+        directions = np.array([(math.cos(i * 2 * math.pi / num_rays), math.sin(i * 2 * math.pi / num_rays)) for i in range(num_rays)]).reshape(-1, 2)
+        start_points = np.tile(np.asarray(self.tx_antenna.location, dtype=float), (num_rays, 1))
+        alphas = np.ones(num_rays, dtype=complex)
+        distances = np.zeros(num_rays)
+        num_reflections = np.zeros(num_rays, dtype=np.int32)
+        num_transmissions = np.zeros(num_rays, dtype=np.int32)
+        polarization_te = np.ones(num_rays, dtype=bool)  # Antenna.launch_rays usa polarización TE
+        path_nodes = segments.extend_path_nodes(start_points, np.full(num_rays, -1))
+
+        while len(start_points):
+            # Los rayos que superan los límites se descartan sin guardarse, como en propagate_ray
+            active = (num_reflections <= self.max_reflections) & (num_transmissions <= self.max_transmissions)
+            start_points, directions, alphas, distances = start_points[active], directions[active], alphas[active], distances[active]
+            num_reflections, num_transmissions = num_reflections[active], num_transmissions[active]
+            polarization_te, path_nodes = polarization_te[active], path_nodes[active]
+            if not len(start_points):
+                break
+
+            wall_index, end_points = self.closest_hits(start_points, directions, walls)
+            hit = wall_index >= 0
+            miss = ~hit
+            # Los hijos sin colisión conservan el end_point copiado del padre (su propio punto de
+            # partida), igual que las copias de reflect_ray/refract_ray; los rayos iniciales no tienen
+            inherited_ends = np.where((num_reflections[miss] + num_transmissions[miss] > 0)[:, np.newaxis], start_points[miss], np.nan)
+            segments.extend(start_points[miss], inherited_ends, directions[miss], alphas[miss], distances[miss], 0, 1.0,
+                            num_reflections[miss], num_transmissions[miss], path_nodes[miss])
+
+            start_points, directions, alphas, distances = start_points[hit], directions[hit], alphas[hit], distances[hit]
+            num_reflections, num_transmissions = num_reflections[hit], num_transmissions[hit]
+            polarization_te, path_nodes, end_points, wall_index = polarization_te[hit], path_nodes[hit], end_points[hit], wall_index[hit]
+
+            delta = end_points - start_points
+            segment_lengths = np.sqrt(self.rowwise_dot(delta, delta))
+            alphas = alphas * self.calculate_complex_amplitudes(segment_lengths, frequency)
+            segments.extend(start_points, end_points, directions, alphas, distances, 0, 1.0,
+                            num_reflections, num_transmissions, path_nodes)
+            child_nodes = segments.extend_path_nodes(end_points, path_nodes)
+
+            normals = walls['normals'][wall_index]
+            dot = self.rowwise_dot(directions, normals)
+            reflection, transmission = self.calculate_coefficients_batch(np.arccos(dot), walls['eta'][wall_index], polarization_te)
+
+            reflected_directions = directions - 2 * dot[:, np.newaxis] * normals
+            start_points = np.concatenate((end_points, end_points))
+            directions = np.concatenate((reflected_directions, directions))
+            alphas = np.concatenate((alphas * reflection, alphas * transmission))
+            distances = np.concatenate((distances + segment_lengths, distances))
+            num_reflections = np.concatenate((num_reflections + 1, num_reflections))
+            num_transmissions = np.concatenate((num_transmissions, num_transmissions + 1))
+            polarization_te = np.concatenate((polarization_te, polarization_te))
+            path_nodes = np.concatenate((child_nodes, child_nodes))
+
+        logger.info(f"Wavefront propagation of {self.num_rays} rays ({len(segments)} segments) in {time.time() - start:.2f} seconds")
+        return segments
+
+    def wall_arrays(self):
+        obstacles = self.environment.obstacles
+        frequency = self.tx_antenna.frequency
+        normals = []
+        for wall in obstacles:
+            normal = np.array(wall.normal_direction, dtype=float)
+            normal /= np.linalg.norm(normal)
+            normals.append(normal)
+        return {
+            'start': np.array([wall.start_point for wall in obstacles], dtype=float).reshape(-1, 2),
+            'end': np.array([wall.end_point for wall in obstacles], dtype=float).reshape(-1, 2),
+            'normals': np.array(normals).reshape(-1, 2),
+            'eta': np.array([
+                np.sqrt(wall.material.permittivity - 1j * wall.material.conductivity / (2 * np.pi * frequency * epsilon_0))
+                for wall in obstacles
+            ], dtype=complex),
+        }
+
+    def closest_hits(self, start_points, directions, walls):
+        # Misma intersección que Ray.collide, para bloques de rayos × todas las paredes.
+        # Devuelve el índice de la pared más cercana (-1 si no hay colisión) y el punto de impacto.
+        num_walls = len(walls['start'])
+        wall_index = np.full(len(start_points), -1)
+        end_points = np.full((len(start_points), 2), np.nan)
+        if num_walls == 0:
+            return wall_index, end_points
+
+        wx1, wy1 = walls['start'][:, 0], walls['start'][:, 1]
+        wx2, wy2 = walls['end'][:, 0], walls['end'][:, 1]
+        chunk = max(1, int(self.wavefront_memory_mb * 1024 * 1024 // (num_walls * 8 * 8)))
+        for first in range(0, len(start_points), chunk):
+            block = slice(first, first + chunk)
+            rx3 = start_points[block, 0:1]
+            ry3 = start_points[block, 1:2]
+            rx4 = rx3 + directions[block, 0:1]
+            ry4 = ry3 + directions[block, 1:2]
+
+            denominator = (wx1 - wx2) * (ry3 - ry4) - (wy1 - wy2) * (rx3 - rx4)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = ((wx1 - rx3) * (ry3 - ry4) - (wy1 - ry3) * (rx3 - rx4)) / denominator
+                u = -((wx1 - wx2) * (wy1 - ry3) - (wy1 - wy2) * (wx1 - rx3)) / denominator
+                valid = (denominator != 0) & (0 < t) & (t < 1) & (u > 0)
+
+                px = wx1 + t * (wx2 - wx1)
+                py = wy1 + t * (wy2 - wy1)
+                dx, dy = px - rx3, py - ry3
+                distances = np.where(valid, np.sqrt(dx * dx + dy * dy), np.inf)
+
+            nearest = np.argmin(distances, axis=1)
+            rows = np.arange(len(nearest))
+            found = np.isfinite(distances[rows, nearest])
+            wall_index[block] = np.where(found, nearest, -1)
+            end_points[block] = np.where(found[:, np.newaxis], np.column_stack((px[rows, nearest], py[rows, nearest])), np.nan)
+        return wall_index, end_points
+
+    @staticmethod
+    def rowwise_dot(a, b):
+        # Producto escalar fila a fila con matmul, que redondea igual que np.dot en propagate_ray
+        return np.matmul(a[:, np.newaxis, :], b[:, :, np.newaxis])[:, 0, 0]
+
+    def calculate_complex_amplitudes(self, distances, frequency):
+        # Versión vectorizada de calculate_complex_amplitude
+        speed_of_light = 299792458
+        delay = distances / speed_of_light
+        omega = 2 * cmath.pi * frequency
+        with np.errstate(divide='ignore'):
+            attenuation = 1 / distances
+        return attenuation * np.exp(-1j * omega * delay)
+
+    def calculate_coefficients_batch(self, incident_angles, eta, polarization_te):
+        # Coeficientes de Fresnel TE/TM de reflexión y transmisión para un frente de onda completo
+        cos_i = np.cos(incident_angles)
+        cos_theta_t = np.sqrt(1 - (1 / eta)**2 * (1 - cos_i**2))
+        reflection = np.where(
+            polarization_te,
+            (cos_i - eta * cos_theta_t) / (cos_i + eta * cos_theta_t),
+            (eta * cos_i - cos_theta_t) / (eta * cos_i + cos_theta_t)
+        )
+        transmission = np.where(
+            polarization_te,
+            2 * cos_i / (cos_i + eta * cos_theta_t),
+            2 * eta * cos_i / (eta * cos_i + cos_theta_t)
+        )
+        return reflection, transmission
 
     def find_closest_collision(self, ray):
+        if self.indexed:
+            return self.find_closest_collision_indexed(ray)
+
         obstacles = self.environment.obstacles
 
         collisions = [ray.collide(obstacle) for obstacle in obstacles]
@@ -256,6 +442,20 @@ class Simulator:
             closest_collision = valid_collisions[np.argmin(distances)]
             ray.end_point = closest_collision.point
             return closest_collision
+
+    def find_closest_collision_indexed(self, ray):
+        obstacles = self.environment.obstacles
+
+        def intersect(indices):
+            for index in indices:
+                collision = ray.collide(obstacles[index])
+                if collision:
+                    yield index, np.linalg.norm(np.array(collision.point) - np.array(ray.start_point)), collision
+
+        _, _, closest_collision = self.environment.spatial_index.closest_hit(ray.start_point, ray.direction, intersect)
+        if closest_collision:
+            ray.end_point = closest_collision.point
+            return closest_collision
             
     def propagate_ray(self, ray):
         # Verificar si la potencia del rayo está por debajo del umbral
@@ -463,7 +663,7 @@ class Simulator:
         self.tx_antenna.location = new_position
 
     def export_simulation_data(self):
-        rays_data = [(ray.start_point, ray.end_point) for ray in self.rays]
+        rays_data = self.segments.segments()
         walls_data = [(wall.start_point, wall.end_point) for wall in self.environment.obstacles]
         return rays_data, walls_data
     
@@ -515,8 +715,12 @@ class SimulationVisualizer:
             self.simulator.environment.visualize(self.display, self.scale)
             self.display.blit(texto, (10, 10))
 
-            for ray in self.simulator.rays:
-                ray.visualize(self.display, self.scale)
+            for start_point, end_point in self.simulator.segments.segments():
+                if np.isnan(end_point).any():
+                    continue
+                start_point_scaled = (int(start_point[0] * self.scale[0]), int(start_point[1] * self.scale[1]))
+                end_point_scaled = (int(end_point[0] * self.scale[0]), int(end_point[1] * self.scale[1]))
+                pygame.draw.line(self.display, RAYS, start_point_scaled, end_point_scaled)
             
             pygame.display.update()
             self.clock.tick(fps)
@@ -527,8 +731,7 @@ def plot_simulation(rays_data, walls_data, dimensions):
     plt.figure(figsize=(8, 6))
     for wall_start, wall_end in walls_data:
         plt.plot([wall_start[0], wall_end[0]], [wall_start[1], wall_end[1]], 'k-', linewidth=2)
-    for ray_start, ray_end in rays_data:
-        plt.plot([ray_start[0], ray_end[0]], [ray_start[1], ray_end[1]], 'b-', alpha=0.5)
+    plt.gca().add_collection(LineCollection(np.asarray(rays_data, dtype=float), colors='b', alpha=0.5))
     plt.xlim(0, dimensions[0])
     plt.ylim(0, dimensions[1])
     plt.xlabel('X')
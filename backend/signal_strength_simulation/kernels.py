@@ -0,0 +1,103 @@
+import cmath
+import logging
+import math
+import numpy as np
+from scipy.constants import epsilon_0
+
+logger = logging.getLogger(__name__)
+
+# Núcleos escalares del simulador compilados con numba. Si numba no está instalado,
+# njit no hace nada y las mismas funciones se ejecutan como Python normal.
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda function: function
+
+SPEED_OF_LIGHT = 299792458
+
+
+@njit(cache=True)
+def segment_intersection(wx1, wy1, wx2, wy2, rx3, ry3, dx, dy):
+    # Misma fórmula que Ray.collide. Devuelve (colisiona, px, py)
+    rx4 = rx3 + dx
+    ry4 = ry3 + dy
+    d = (wx1 - wx2) * (ry3 - ry4) - (wy1 - wy2) * (rx3 - rx4)
+    if d == 0:
+        return False, 0.0, 0.0
+    t = ((wx1 - rx3) * (ry3 - ry4) - (wy1 - ry3) * (rx3 - rx4)) / d
+    u = ((wx2 - wx1) * (wy1 - ry3) - (wy2 - wy1) * (wx1 - rx3)) / d
+    if t > 0 and t < 1 and u > 0:
+        return True, wx1 + t * (wx2 - wx1), wy1 + t * (wy2 - wy1)
+    return False, 0.0, 0.0
+
+
+@njit(cache=True)
+def closest_wall(walls, rx, ry, dx, dy, max_distance):
+    # Recorre todas las paredes (filas wx1, wy1, wx2, wy2) y devuelve (índice, px, py, distancia)
+    # de la colisión más cercana por debajo de max_distance, o índice -1 si no hay ninguna
+    best_index = -1
+    best_x = 0.0
+    best_y = 0.0
+    best_distance = max_distance
+    for i in range(walls.shape[0]):
+        hit, px, py = segment_intersection(walls[i, 0], walls[i, 1], walls[i, 2], walls[i, 3], rx, ry, dx, dy)
+        if hit:
+            distance = math.sqrt((px - rx) ** 2 + (py - ry) ** 2)
+            if distance < best_distance:
+                best_index = i
+                best_x = px
+                best_y = py
+                best_distance = distance
+    return best_index, best_x, best_y, best_distance
+
+
+@njit(cache=True)
+def fresnel_coefficients(incident_angle, permittivity, conductivity, thickness, frequency, te):
+    # Mismo cálculo que Simulator.calculate_coefficients1.
+    # Devuelve (coef. reflexión, coef. transmisión, ángulo de refracción)
+    epsilon_complex = permittivity - 1j * conductivity / (2 * math.pi * frequency * epsilon_0)
+
+    sin_theta_i = math.sin(incident_angle)
+    cos_theta_i = math.cos(incident_angle)
+    sin_theta_t = sin_theta_i / math.sqrt(epsilon_complex.real)
+    cos_theta_t = math.sqrt(1 - sin_theta_t ** 2)
+
+    root = cmath.sqrt(epsilon_complex - sin_theta_i ** 2)
+    if te:
+        reflection_coefficient = (cos_theta_i - root) / (cos_theta_i + root)
+        transmission_coefficient = 2 * cos_theta_i / (cos_theta_i + root)
+    else:
+        reflection_coefficient = (epsilon_complex * cos_theta_i - root) / (epsilon_complex * cos_theta_i + root)
+        transmission_coefficient = 2 * epsilon_complex * cos_theta_i / (epsilon_complex * cos_theta_i + root)
+
+    k = 2 * math.pi * frequency * cmath.sqrt(epsilon_complex) / SPEED_OF_LIGHT
+    transmission_coefficient *= cmath.exp(-1j * k * thickness * cos_theta_t)
+
+    refracted_angle = math.asin(sin_theta_t)
+    return reflection_coefficient, transmission_coefficient, refracted_angle
+
+
+@njit(cache=True)
+def accumulate_path_loss(distance, segment_length, wavelength):
+    # Suma el segmento a la distancia recorrida y devuelve (distancia, path loss en espacio libre)
+    distance += segment_length
+    return distance, (4 * math.pi * distance / wavelength) ** 2
+
+
+def walls_array(walls):
+    # Paredes como array contiguo (n, 4) de float64 para closest_wall
+    return np.ascontiguousarray([[wall.start_point[0], wall.start_point[1], wall.end_point[0], wall.end_point[1]] for wall in walls], dtype=np.float64).reshape(-1, 4)
+
+
+def resolve_backend(backend):
+    if backend not in ("python", "numba"):
+        raise ValueError(f"Unknown simulator backend: {backend}")
+    if backend == "numba" and not NUMBA_AVAILABLE:
+        logger.warning("numba is not installed, the simulator kernels will run as plain Python")
+    return backend
@@ -0,0 +1,50 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+
+# Ejecución por teselas de los cálculos sobre rejillas (mapa de calor del servicio y mapa de
+# contorno del simulador). Los datos comunes (paredes, segmentos, ONTs...) se envían una sola vez
+# a cada proceso mediante el initializer; cada tarea sólo recibe los límites de su tesela.
+
+_shared = {}
+
+
+def grid_tiles(shape, tile_size):
+    # Teselas (filas, columnas) como pares de slices, en orden fila a fila
+    rows, cols = shape
+    tile_size = max(int(tile_size), 1)
+    return [
+        (slice(row, min(row + tile_size, rows)), slice(col, min(col + tile_size, cols)))
+        for row in range(0, rows, tile_size)
+        for col in range(0, cols, tile_size)
+    ]
+
+
+def _initialize_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
+
+
+def _run_tile(function, tile):
+    return function(_shared, tile)
+
+
+def map_tiles(function, tiles, shared, workers=1):
+    """Aplica function(shared, tile) a cada tesela y devuelve los resultados en el orden de tiles.
+
+    Con workers <= 1 (o una sola tesela) se ejecuta en el proceso actual. `function` debe ser
+    una función de módulo para poder enviarla a los procesos.
+    """
+    if workers <= 1 or len(tiles) <= 1:
+        return [function(shared, tile) for tile in tiles]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tiles)), initializer=_initialize_worker, initargs=(shared,)) as executor:
+        return list(executor.map(partial(_run_tile, function), tiles))
+
+
+def merge_tiles(shape, tiles, blocks, dtype=float):
+    # Las teselas son disjuntas y se copian en orden, así que el resultado no depende de qué
+    # proceso calculó cada una ni de cuándo terminó
+    result = np.empty(shape, dtype=dtype)
+    for (rows, cols), block in zip(tiles, blocks):
+        result[rows, cols] = block
+    return result
@@ -0,0 +1,192 @@
+import numpy as np
+
+
+class _Columns:
+    # Columnas numpy preasignadas que crecen geométricamente (x2) al llenarse
+    def __init__(self, dtypes, capacity):
+        self.dtypes = dtypes
+        self.size = 0
+        self.capacity = max(int(capacity), 1)
+        self.arrays = {name: np.empty((self.capacity,) + shape, dtype) for name, (dtype, shape) in dtypes.items()}
+
+    def reserve(self, count):
+        needed = self.size + count
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for name, array in self.arrays.items():
+            grown = np.empty((capacity,) + array.shape[1:], array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[name] = grown
+        self.capacity = capacity
+
+    def view(self, name):
+        return self.arrays[name][:self.size]
+
+
+class RaySegmentStore:
+    """Almacén compacto (struct-of-arrays) de los segmentos de rayo de una simulación.
+
+    Cada segmento ocupa una fila en arrays numpy en lugar de un objeto Ray. Los segmentos sin
+    colisión tienen end_point NaN. Las trayectorias se guardan como un árbol de nodos
+    (punto, nodo padre) compartido entre los rayos hijos; path_node apunta al último nodo.
+    """
+
+    SEGMENT_COLUMNS = {
+        'start_points': (np.float64, (2,)),
+        'end_points': (np.float64, (2,)),
+        'directions': (np.float64, (2,)),
+        'alphas': (np.complex128, ()),
+        'distances': (np.float64, ()),
+        'path_losses': (np.float64, ()),
+        'powers': (np.float64, ()),
+        'num_reflections': (np.int32, ()),
+        'num_transmissions': (np.int32, ()),
+        'path_nodes': (np.int64, ()),
+    }
+    PATH_COLUMNS = {
+        'points': (np.float64, (2,)),
+        'parents': (np.int64, ()),
+    }
+
+    def __init__(self, capacity=1024):
+        self._segments = _Columns(self.SEGMENT_COLUMNS, capacity)
+        self._paths = _Columns(self.PATH_COLUMNS, capacity)
+
+    def __len__(self):
+        return self._segments.size
+
+    def clear(self):
+        self._segments.size = 0
+        self._paths.size = 0
+
+    def append(self, start_point, end_point, direction, alpha, distance, path_loss, power,
+               num_reflections=0, num_transmissions=0, path_node=-1):
+        columns = self._segments
+        columns.reserve(1)
+        i = columns.size
+        arrays = columns.arrays
+        arrays['start_points'][i] = start_point
+        arrays['end_points'][i] = end_point if end_point is not None else (np.nan, np.nan)
+        arrays['directions'][i] = direction
+        arrays['alphas'][i] = alpha
+        arrays['distances'][i] = distance
+        arrays['path_losses'][i] = path_loss
+        arrays['powers'][i] = power
+        arrays['num_reflections'][i] = num_reflections
+        arrays['num_transmissions'][i] = num_transmissions
+        arrays['path_nodes'][i] = path_node
+        columns.size += 1
+        return i
+
+    def append_ray(self, ray):
+        return self.append(ray.start_point, ray.end_point, ray.direction, ray.alpha, ray.distance, ray.path_loss,
+                           ray.power, ray.num_reflections, ray.num_transmissions, getattr(ray, 'path_node', -1))
+
+    def extend(self, start_points, end_points, directions, alphas, distances, path_losses, powers,
+               num_reflections, num_transmissions, path_nodes=-1):
+        count = len(start_points)
+        columns = self._segments
+        columns.reserve(count)
+        block = slice(columns.size, columns.size + count)
+        arrays = columns.arrays
+        arrays['start_points'][block] = start_points
+        arrays['end_points'][block] = end_points
+        arrays['directions'][block] = directions
+        arrays['alphas'][block] = alphas
+        arrays['distances'][block] = distances
+        arrays['path_losses'][block] = path_losses
+        arrays['powers'][block] = powers
+        arrays['num_reflections'][block] = num_reflections
+        arrays['num_transmissions'][block] = num_transmissions
+        arrays['path_nodes'][block] = path_nodes
+        columns.size += count
+
+    @classmethod
+    def from_rays(cls, rays):
+        store = cls(capacity=len(rays))
+        for ray in rays:
+            store.append_ray(ray)
+        return store
+
+    def add_path_node(self, point, parent):
+        columns = self._paths
+        columns.reserve(1)
+        i = columns.size
+        columns.arrays['points'][i] = point
+        columns.arrays['parents'][i] = parent
+        columns.size += 1
+        return i
+
+    def extend_path_nodes(self, points, parents):
+        # Añade un nodo por fila y devuelve sus índices
+        count = len(points)
+        columns = self._paths
+        columns.reserve(count)
+        block = slice(columns.size, columns.size + count)
+        columns.arrays['points'][block] = points
+        columns.arrays['parents'][block] = parents
+        columns.size += count
+        return np.arange(block.start, block.stop)
+
+    def get_path(self, node):
+        points = self._paths.arrays['points']
+        parents = self._paths.arrays['parents']
+        path = []
+        while node != -1:
+            path.append(tuple(points[node]))
+            node = parents[node]
+        return path[::-1]
+
+    def get_segment_path(self, index):
+        return self.get_path(self.path_nodes[index])
+
+    def segments(self):
+        # Array (n, 2, 2) con (inicio, fin) de cada segmento, listo para LineCollection
+        return np.stack((self.start_points, self.end_points), axis=1)
+
+    @property
+    def start_points(self):
+        return self._segments.view('start_points')
+
+    @property
+    def end_points(self):
+        return self._segments.view('end_points')
+
+    @property
+    def directions(self):
+        return self._segments.view('directions')
+
+    @property
+    def alphas(self):
+        return self._segments.view('alphas')
+
+    @property
+    def distances(self):
+        return self._segments.view('distances')
+
+    @property
+    def path_losses(self):
+        return self._segments.view('path_losses')
+
+    @property
+    def powers(self):
+        return self._segments.view('powers')
+
+    @property
+    def num_reflections(self):
+        return self._segments.view('num_reflections')
+
+    @property
+    def num_transmissions(self):
+        return self._segments.view('num_transmissions')
+
+    @property
+    def path_nodes(self):
+        return self._segments.view('path_nodes')
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self._segments.arrays.values()) + sum(a.nbytes for a in self._paths.arrays.values())
@@ -0,0 +1,178 @@
+import math
+import numpy as np
+
+
+class UniformGridIndex:
+    """Rejilla uniforme de segmentos de pared para buscar el impacto más cercano de un rayo.
+
+    Cada celda guarda los índices de las paredes que la atraviesan y los rayos se recorren
+    celda a celda con DDA (Amanatides-Woo), así que cada consulta sólo prueba las paredes
+    cercanas a su trayectoria en lugar de todas las del entorno.
+    """
+
+    def __init__(self, segments, walls_per_cell=2.0, max_cells_per_axis=1024):
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        self.size = len(self.segments)
+
+        if self.size:
+            points = self.segments.reshape(-1, 2)
+            self.min_x, self.min_y = points.min(axis=0)
+            max_x, max_y = points.max(axis=0)
+        else:
+            self.min_x = self.min_y = max_x = max_y = 0.0
+
+        extent_x = max(max_x - self.min_x, 1e-9)
+        extent_y = max(max_y - self.min_y, 1e-9)
+        self.tolerance = 1e-9 * max(extent_x, extent_y)
+
+        # Tamaño de celda para tener unas pocas paredes por celda de media
+        target_cells = max(1.0, self.size / walls_per_cell)
+        cell = math.sqrt(extent_x * extent_y / target_cells)
+        if cell < 1e-9 * max(extent_x, extent_y):
+            cell = max(extent_x, extent_y) / target_cells
+        self.nx = int(min(max(math.ceil(extent_x / cell), 1), max_cells_per_axis))
+        self.ny = int(min(max(math.ceil(extent_y / cell), 1), max_cells_per_axis))
+        self.cell_x = extent_x / self.nx
+        self.cell_y = extent_y / self.ny
+        self.max_x = self.min_x + extent_x
+        self.max_y = self.min_y + extent_y
+
+        self._segment_list = None
+        self.cells = [[] for _ in range(self.nx * self.ny)]
+        for index, segment in enumerate(self.segments):
+            for cell_index in self._cells_for_segment(segment):
+                self.cells[cell_index].append(index)
+
+    @classmethod
+    def from_walls(cls, walls, **kwargs):
+        return cls([[wall.start_point, wall.end_point] for wall in walls], **kwargs)
+
+    def _column(self, x):
+        return min(max(int((x - self.min_x) / self.cell_x), 0), self.nx - 1)
+
+    def _row(self, y):
+        return min(max(int((y - self.min_y) / self.cell_y), 0), self.ny - 1)
+
+    def _cells_for_segment(self, segment):
+        # Recorre las filas que cubre el segmento y, en cada una, el rango de columnas
+        # de la parte del segmento contenida en la fila (con un pequeño margen)
+        (x0, y0), (x1, y1) = segment
+        eps = self.tolerance
+        row_lo = self._row(min(y0, y1) - eps)
+        row_hi = self._row(max(y0, y1) + eps)
+        for row in range(row_lo, row_hi + 1):
+            if y0 == y1:
+                xa, xb = x0, x1
+            else:
+                slab_lo = max(self.min_y + row * self.cell_y, min(y0, y1))
+                slab_hi = min(self.min_y + (row + 1) * self.cell_y, max(y0, y1))
+                xa = x0 + (slab_lo - y0) * (x1 - x0) / (y1 - y0)
+                xb = x0 + (slab_hi - y0) * (x1 - x0) / (y1 - y0)
+            col_lo = self._column(min(xa, xb) - eps)
+            col_hi = self._column(max(xa, xb) + eps)
+            for col in range(col_lo, col_hi + 1):
+                yield row * self.nx + col
+
+    def traverse(self, origin, direction, max_distance=math.inf):
+        """Genera (t_entrada, t_salida, paredes) para cada celda que cruza el rayo, en orden.
+
+        t se mide en unidades de distancia a lo largo de la dirección normalizada.
+        """
+        ox, oy = float(origin[0]), float(origin[1])
+        norm = math.hypot(direction[0], direction[1])
+        if norm == 0:
+            return
+        dx, dy = direction[0] / norm, direction[1] / norm
+
+        # Recortar el rayo a la caja de la rejilla
+        t_start, t_end = 0.0, max_distance
+        for o, d, lo, hi in ((ox, dx, self.min_x, self.max_x), (oy, dy, self.min_y, self.max_y)):
+            if d == 0:
+                if o < lo - self.tolerance or o > hi + self.tolerance:
+                    return
+                continue
+            ta, tb = (lo - o) / d, (hi - o) / d
+            if ta > tb:
+                ta, tb = tb, ta
+            t_start, t_end = max(t_start, ta), min(t_end, tb)
+        if t_start > t_end:
+            return
+
+        col = self._column(ox + t_start * dx)
+        row = self._row(oy + t_start * dy)
+        step_col = 1 if dx > 0 else -1
+        step_row = 1 if dy > 0 else -1
+        if dx != 0:
+            t_next_col = (self.min_x + (col + (dx > 0)) * self.cell_x - ox) / dx
+            t_delta_col = self.cell_x / abs(dx)
+        else:
+            t_next_col = t_delta_col = math.inf
+        if dy != 0:
+            t_next_row = (self.min_y + (row + (dy > 0)) * self.cell_y - oy) / dy
+            t_delta_row = self.cell_y / abs(dy)
+        else:
+            t_next_row = t_delta_row = math.inf
+
+        t_enter = t_start
+        while True:
+            t_exit = min(t_next_col, t_next_row, t_end)
+            yield t_enter, t_exit, self.cells[row * self.nx + col]
+            if t_exit >= t_end:
+                return
+            if t_next_col < t_next_row:
+                col += step_col
+                t_next_col += t_delta_col
+            else:
+                row += step_row
+                t_next_row += t_delta_row
+            if not (0 <= col < self.nx and 0 <= row < self.ny):
+                return
+            t_enter = t_exit
+
+    def closest_hit(self, origin, direction, intersect, max_distance=math.inf):
+        """Devuelve (índice, distancia, datos) del impacto más cercano o (-1, max_distance, None).
+
+        `intersect(indices)` recibe las paredes candidatas aún no probadas y genera tuplas
+        (índice, distancia, datos) para las que el rayo golpea. Con empates gana el índice
+        más bajo, igual que un recorrido lineal de todas las paredes.
+        """
+        best_index, best_distance, best_data = -1, max_distance, None
+        tested = set()
+        for _, t_exit, candidates in self.traverse(origin, direction, max_distance):
+            pending = [index for index in candidates if index not in tested]
+            if pending:
+                tested.update(pending)
+                for index, distance, data in intersect(pending):
+                    if distance < best_distance or (distance == best_distance and 0 <= index < best_index):
+                        best_index, best_distance, best_data = index, distance, data
+            # Ningún impacto en celdas posteriores puede estar más cerca que éste
+            if best_index >= 0 and best_distance <= t_exit - self.tolerance:
+                break
+        return best_index, best_distance, best_data
+
+    def segment_intersector(self, origin, direction):
+        if self._segment_list is None:
+            self._segment_list = self.segments.tolist()
+        return segment_intersector(self._segment_list, origin, direction)
+
+
+def segment_intersector(segments, origin, direction):
+    """Intersección rayo-segmento (misma fórmula que Ray.collide) para usar con closest_hit."""
+    rx3, ry3 = float(origin[0]), float(origin[1])
+    rx4, ry4 = rx3 + direction[0], ry3 + direction[1]
+    norm = math.hypot(direction[0], direction[1])
+    # Las celdas tienen pocas paredes, así que un bucle escalar es más rápido que numpy
+    walls = segments.tolist() if isinstance(segments, np.ndarray) else segments
+
+    def intersect(indices):
+        for index in indices:
+            (wx1, wy1), (wx2, wy2) = walls[index]
+            d = (wx1 - wx2) * (ry3 - ry4) - (wy1 - wy2) * (rx3 - rx4)
+            if d == 0:
+                continue
+            t = ((wx1 - rx3) * (ry3 - ry4) - (wy1 - ry3) * (rx3 - rx4)) / d
+            u = ((wx2 - wx1) * (wy1 - ry3) - (wy2 - wy1) * (wx1 - rx3)) / d
+            if 0 < t < 1 and u > 0:
+                yield index, u * norm, (wx1 + t * (wx2 - wx1), wy1 + t * (wy2 - wy1))
+
+    return intersect